@@ -1,9 +1,13 @@
-from datetime import datetime
+from collections import Counter
+from habit import User
+from habit_calendar import epoch_period, period_start
 
 
 class Analytics:
     def __init__(self, habits):
-        self.habits = habits
+        """ habits is a list of Habits, or a User whose name index then serves lookups by name """
+        self.user = habits if isinstance(habits, User) else None
+        self.habits = habits.habits if self.user is not None else habits
 
     def get_all_tracked_habits(self):
         """Return a list of all currently tracked habits."""
@@ -14,49 +18,43 @@ class Analytics:
         return [habit.name for habit in self.habits if habit.periodicity == periodicity]
 
     def get_longest_streak(self):
-        """Return the longest run streak of all defined habits."""
-        longest_streak = 0
-        for habit in self.habits:
-            current_streak = 0
-            for i in range(1, len(habit.tracking_data)):
-                # Calculate the difference between consecutive dates
-                time_diff = habit.tracking_data[i] - habit.tracking_data[i - 1]
-                # If the difference is exactly one day, increase the streak
-                if time_diff.days == 1:
-                    current_streak += 1
-                else:
-                    # If the streak is broken, update the longest streak if needed
-                    longest_streak = max(longest_streak, current_streak)
-                    # Reset the current streak
-                    current_streak = 0
-            # Update the longest streak for this habit after iterating through all tracking data
-            longest_streak = max(longest_streak, current_streak)
-        return longest_streak
+        """Return the longest run of consecutive periods (days or weeks) checked off by any habit."""
+        return max((habit.calendar().longest_streak() for habit in self.habits), default=0)
 
     def get_longest_streak_for_habit(self, habit_name):
-        """Return the longest run streak for a given habit."""
-        habit = None
-        for h in self.habits:
-            if h.name == habit_name:
-                habit = h
-                break
-
+        """Return the longest run of consecutive periods checked off for a given habit."""
+        habit = self._find_habit(habit_name)
         if not habit:
             return 0
+        return habit.calendar().longest_streak()
+
+    def _find_habit(self, habit_name):
+        if self.user is not None:
+            return self.user.get_habit(habit_name)
+        for habit in self.habits:
+            if habit.name == habit_name:
+                return habit
+        return None
+
+    def get_longest_gap_for_habit(self, habit_name):
+        """Return the longest gap, in whole days, between consecutive check-ins of a habit."""
+        habit = self._find_habit(habit_name)
+        if not habit or len(habit.checkins) < 2:
+            return 0
+        checkins = habit.checkins
+        return max(checkins[i] - checkins[i - 1] for i in range(1, len(checkins))) // 86400
+
+    def get_completion_rate(self, habit_name):
+        """Return the share of periods, from the first check-in to the last, with at least one check-in."""
+        habit = self._find_habit(habit_name)
+        if not habit:
+            return 0.0
+        return habit.calendar().completion_rate()
 
-        longest_streak = 0
-        current_streak = 0
-        for i in range(1, len(habit.tracking_data)):
-            # Calculate the difference between consecutive dates
-            time_diff = habit.tracking_data[i] - habit.tracking_data[i - 1]
-            # If the difference is exactly one day, increase the streak
-            if time_diff.days == 1:
-                current_streak += 1
-            else:
-                # If the streak is broken, update the longest streak if needed
-                longest_streak = max(longest_streak, current_streak)
-                # Reset the current streak
-                current_streak = 0
-        # Update the longest streak for this habit after iterating through all tracking data
-        longest_streak = max(longest_streak, current_streak)
-        return longest_streak
+    def get_period_counts(self, habit_name):
+        """Return the number of check-ins per day (daily habits) or week (weekly habits), keyed by period start."""
+        habit = self._find_habit(habit_name)
+        if not habit:
+            return {}
+        counts = Counter(epoch_period(second, habit.periodicity) for second in habit.checkins)
+        return {period_start(ordinal, habit.periodicity): counts[ordinal] for ordinal in sorted(counts)}
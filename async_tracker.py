@@ -0,0 +1,138 @@
+""" asyncio front end for HabitTracker.
+
+Every blocking HabitTracker call runs on a dedicated thread pool no larger than the
+connection pool, so a coroutine never waits on SQLite in the event loop and the worker
+threads never queue for connections. Check-ins made with mark_habit_as_done are not
+written one transaction each: concurrent calls are queued and written together in a
+single group commit, so throughput grows with the number of concurrent callers.
+"""
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from habit_tracker import HabitTracker
+from timekeys import local_time, parse_time, user_offsets
+
+
+class AsyncHabitTracker:
+    """ Coroutine versions of the HabitTracker methods.
+
+    Args:
+        user_id (int): The user whose habits are tracked.
+        db_file (str): The database file.
+        max_workers (int): Worker threads; defaults to, and is capped at, the connection pool size.
+        timeout (float): Default number of seconds a call may take before asyncio.TimeoutError,
+            or None to wait indefinitely.
+        batch_size (int): Largest number of check-ins written in one group commit.
+
+    A call that is cancelled or times out stops waiting at once. Its blocking work still
+    runs to completion on the worker thread, except for check-ins that were still queued
+    for the next group commit, which are dropped.
+    """
+
+    def __init__(self, user_id, db_file, max_workers=None, timeout=None, batch_size=500):
+        self.tracker = HabitTracker(user_id, db_file)
+        self.user_id = user_id
+        self.db_file = db_file
+        self.timeout = timeout
+        self.batch_size = batch_size
+        size = self.tracker.pool.size
+        self.executor = ThreadPoolExecutor(max_workers=min(max_workers or size, size),
+                                           thread_name_prefix="habit-tracker")
+        self.group_commits = 0
+        self._pending = []
+        self._flusher = None
+
+    async def _run(self, function, *args, timeout=None):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, partial(function, *args))
+        return await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+
+    async def create_habit(self, user_id, name, description, periodicity, timeout=None):
+        return await self._run(self.tracker.create_habit, user_id, name, description, periodicity, timeout=timeout)
+
+    async def get_habit_info(self, name, timeout=None):
+        return await self._run(self.tracker.get_habit_info, name, timeout=timeout)
+
+    async def update_habit(self, name, new_name=None, new_description=None, new_periodicity=None, timeout=None):
+        return await self._run(self.tracker.update_habit, name, new_name, new_description, new_periodicity,
+                               timeout=timeout)
+
+    async def remove_habit(self, name, timeout=None):
+        return await self._run(self.tracker.remove_habit, name, timeout=timeout)
+
+    async def get_all_habits(self, timeout=None):
+        return await self._run(self.tracker.get_all_habits, timeout=timeout)
+
+    async def get_habit_tracking_by_id(self, habit_id, timeout=None):
+        return await self._run(self.tracker.get_habit_tracking_by_id, habit_id, timeout=timeout)
+
+    async def mark_habits_done_bulk(self, records, chunk_size=500, timeout=None):
+        return await self._run(self.tracker.mark_habits_done_bulk, list(records), chunk_size, timeout=timeout)
+
+    async def get_streak(self, name, timeout=None):
+        return await self._run(self.tracker.get_streak, name, timeout=timeout)
+
+    async def get_habits_with_longest_streak(self, timeout=None):
+        return await self._run(self.tracker.get_habits_with_longest_streak, timeout=timeout)
+
+    async def get_worst_streak_habit(self, timeout=None):
+        return await self._run(self.tracker.get_worst_streak_habit, timeout=timeout)
+
+    async def get_worst_habit_last_month(self, timeout=None):
+        return await self._run(self.tracker.get_worst_habit_last_month, timeout=timeout)
+
+    async def mark_habit_as_done(self, user_id, name, timeout=None):
+        """ Check a habit off now; the write shares a transaction with concurrent check-ins """
+        loop = asyncio.get_running_loop()
+        result = loop.create_future()
+        self._pending.append((name, parse_time(), result))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._flush())
+        # wait_for cancels `result` on timeout, which takes it out of the queue if not yet written
+        return await asyncio.wait_for(result, self.timeout if timeout is None else timeout)
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            batch = [entry for entry in self._pending[:self.batch_size] if not entry[2].done()]
+            del self._pending[:self.batch_size]
+            if not batch:
+                continue
+            try:
+                statuses = await loop.run_in_executor(
+                    self.executor, self._write_checkins, [(name, checked_at) for name, checked_at, _ in batch])
+            except Exception as e:
+                for _, _, result in batch:
+                    if not result.done():
+                        result.set_exception(e)
+                continue
+            for (_, _, result), status in zip(batch, statuses):
+                if not result.done():
+                    result.set_result(status)
+
+    def _write_checkins(self, checkins):
+        """ Write a batch of check-ins in one transaction, returning mark_habit_as_done's status for each """
+        try:
+            with self.tracker.pool.transaction() as conn:
+                offset = user_offsets(conn, [self.user_id])[self.user_id]
+                for name, checked_at in checkins:
+                    conn.execute("INSERT INTO habit_tracking (habit_id, checked_at, utc_offset) "
+                                 "SELECT id, ?, ? FROM habits WHERE user_id=? AND name=? COLLATE NOCASE",
+                                 local_time(checked_at, offset) + (self.user_id, name))
+            self.group_commits += 1
+            return ["Habit marked as done successfully"] * len(checkins)
+        except sqlite3.Error as e:
+            return [f"Error marking habit as done: {e}"] * len(checkins)
+
+    async def close(self):
+        """ Write the queued check-ins and stop the worker threads """
+        if self._flusher is not None:
+            await self._flusher
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
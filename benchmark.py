@@ -0,0 +1,943 @@
+""" Benchmarks for the habit tracker.
+
+Usage:
+    python benchmark.py <name> [arguments...]
+
+Each benchmark builds its own throwaway database in a temporary directory.
+"""
+import asyncio
+import gc
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from datetime import date, datetime, timedelta, timezone
+import cli
+import columnar
+from analytics import Analytics
+from async_tracker import AsyncHabitTracker
+from checkin_writer import FLUSHED, QUEUED, CheckinWriter
+from compaction import compact_checkins
+from connection import close_all_pools
+from database import Database
+from habit import Habit, User
+from habit_calendar import HabitCalendar, period_ordinal, to_epoch_seconds
+from habit_tracker import HabitTracker
+from loadgen import generate
+from numpy_analytics import NumpyAnalytics
+from parallel_analytics import analyze
+from replica import ReadReplica
+from rollups import day_sql, rank_habits, week_sql
+from scheduler import DueScheduler
+from search import create_search_index, search_habits
+from sharding import ShardRouter
+from streaks import rebuild_streaks
+from timekeys import local_time
+
+
+def _create_schema(db_file, habits=(("Exercise", "Hit the gym.", "daily"),), journal_mode=None):
+    Database(db_file).migrate()
+    close_all_pools()
+    conn = sqlite3.connect(db_file)
+    if journal_mode:
+        conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    conn.executemany("INSERT INTO habits (user_id, name, description, periodicity) VALUES (1, ?, ?, ?)", habits)
+    conn.commit()
+    conn.close()
+
+
+def _legacy_mark_habit_as_done(db_file, user_id, name):
+    """ The check-in path before pooling: connect, insert, commit and close on every call """
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    cursor.execute("INSERT INTO habit_tracking (habit_id, checked_at) "
+                   "SELECT id, ? FROM habits WHERE name=? AND user_id=?",
+                   (current_time, name, user_id))
+    conn.commit()
+    conn.close()
+
+
+def _populate_checkins(db_file, habits, checkins_per_habit, seed=42):
+    """ Fill db_file with daily habits whose check-ins mostly run on consecutive days """
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1, 8, 0)
+    conn = sqlite3.connect(db_file)
+    conn.executemany("INSERT INTO habits (id, user_id, name, description, periodicity) VALUES (?, 1, ?, '', 'daily')",
+                     ((habit_id, f"Habit {habit_id}") for habit_id in range(1, habits + 1)))
+
+    def rows():
+        for habit_id in range(1, habits + 1):
+            day = 0
+            for _ in range(checkins_per_habit):
+                day += 1 if rng.random() < 0.8 else rng.randint(2, 5)
+                yield (habit_id,) + local_time(start + timedelta(days=day))
+
+    conn.executemany("INSERT INTO habit_tracking (habit_id, checked_at, utc_offset) VALUES (?, ?, ?)", rows())
+    conn.commit()
+    conn.close()
+
+
+# The FTS5 search table, its shadow tables and triggers: iterdump() writes them in an order that cannot be
+# replayed, so they are left out of a dump and rebuilt by the migration step after a restore
+_SEARCH_DUMP = re.compile(r"INSERT INTO sqlite_master\(.*VALUES\('table','habit_search"
+                          r"|INSERT INTO \"habit_search|CREATE TABLE 'habit_search_|CREATE TRIGGER habits_search_")
+
+
+def _dump_without_search(conn):
+    return (statement for statement in conn.iterdump() if not _SEARCH_DUMP.match(statement))
+
+
+def _legacy_habits_with_longest_streak(tracker):
+    """ The N+1 implementation: one query per habit and a Python walk over its parsed check-ins """
+    conn = sqlite3.connect(tracker.db_file)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, name, description, periodicity, creation_date FROM habits")
+    habit_streaks = []
+    for habit_id, name, description, periodicity, created_at in cursor.fetchall():
+        cursor.execute("SELECT checked_at FROM habit_tracking WHERE habit_id = ? ORDER BY checked_at", (habit_id,))
+        habit_tracking = [{"checked_at": datetime.fromisoformat(row[0])} for row in cursor.fetchall()]
+        if habit_tracking:
+            streak_length, start_date, end_date = tracker.calculate_streak(habit_tracking, periodicity)
+            habit_streaks.append((habit_id, name, description, periodicity,
+                                  created_at, streak_length, start_date, end_date))
+    habit_streaks.sort(key=lambda x: (-x[5], x[1], x[0]))
+    conn.close()
+    return habit_streaks
+
+
+def bench_checkins(count=2000):
+    """ Check-ins per second with a connection per call versus the shared pool """
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = os.path.join(tmp, "legacy.db")
+        pooled_db = os.path.join(tmp, "pooled.db")
+        _create_schema(legacy_db, journal_mode="DELETE")
+        _create_schema(pooled_db)
+
+        start = time.perf_counter()
+        for _ in range(count):
+            _legacy_mark_habit_as_done(legacy_db, 1, "Exercise")
+        legacy_elapsed = time.perf_counter() - start
+
+        tracker = HabitTracker(1, pooled_db)
+        start = time.perf_counter()
+        for _ in range(count):
+            tracker.mark_habit_as_done(1, "Exercise")
+        pooled_elapsed = time.perf_counter() - start
+        close_all_pools()
+
+    return {
+        "checkins": count,
+        "before_per_sec": round(count / legacy_elapsed),
+        "after_per_sec": round(count / pooled_elapsed),
+    }
+
+
+def bench_bulk_checkins(count=20000):
+    """ Bulk check-in throughput for growing chunk sizes, against one call per check-in """
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    records = [(1, "Exercise", timestamp)] * count
+    result = {"checkins": count}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "bulk.db")
+        _create_schema(db_file)
+        tracker = HabitTracker(1, db_file)
+
+        single = min(count, 2000)
+        start = time.perf_counter()
+        for _ in range(single):
+            tracker.mark_habit_as_done(1, "Exercise")
+        result["single_per_sec"] = round(single / (time.perf_counter() - start))
+
+        for chunk_size in (10, 100, 1000, 10000):
+            start = time.perf_counter()
+            tracker.mark_habits_done_bulk(records, chunk_size=chunk_size)
+            result[f"chunk_{chunk_size}_per_sec"] = round(count / (time.perf_counter() - start))
+        close_all_pools()
+    return result
+
+
+def bench_longest_streak(habits=20000, checkins_per_habit=100):
+    """ Longest streaks for every habit: N+1 queries, one streaming pass and the materialized table """
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "streaks.db")
+        Database(db_file).migrate()
+        close_all_pools()
+        _populate_checkins(db_file, habits, checkins_per_habit)
+        tracker = HabitTracker(1, db_file)
+
+        start = time.perf_counter()
+        legacy = _legacy_habits_with_longest_streak(tracker)
+        legacy_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with tracker.pool.transaction() as conn:
+            rebuild_streaks(conn)
+        rebuild_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        streaks = tracker.get_habits_with_longest_streak()
+        elapsed = time.perf_counter() - start
+        close_all_pools()
+
+    return {
+        "habits": habits,
+        "checkins": habits * checkins_per_habit,
+        "n_plus_one_seconds": round(legacy_elapsed, 3),
+        "single_pass_rebuild_seconds": round(rebuild_elapsed, 3),
+        "materialized_read_seconds": round(elapsed, 3),
+        "identical_results": legacy == streaks,
+    }
+
+
+def bench_rankings(habits=2000, checkins_per_habit=500, repeat=20):
+    """ Worst habit overall and over 30 days: GROUP BY over habit_tracking versus the rollups """
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "rankings.db")
+        Database(db_file).migrate()
+        close_all_pools()
+        _populate_checkins(db_file, habits, checkins_per_habit)
+        tracker = HabitTracker(1, db_file)
+        with tracker.pool.connection() as conn:
+            last_day = date.fromisoformat(conn.execute("SELECT MAX(checked_at) FROM habit_tracking").fetchone()[0][:10])
+        window_start = last_day - timedelta(days=29)
+
+        def rescan(start):
+            with tracker.pool.connection() as conn:
+                return conn.execute("""
+                    SELECT habit_id FROM habit_tracking WHERE day_key >= ?
+                    GROUP BY habit_id ORDER BY COUNT(*) ASC, habit_id LIMIT 1
+                """, (period_ordinal(start, "daily") if start else 0,)).fetchone()[0]
+
+        def rollup(start):
+            with tracker.pool.connection() as conn:
+                return rank_habits(conn, start=start or None, limit=1)[0][0]
+
+        result = {"checkins": habits * checkins_per_habit}
+        for label, start in (("all_time", ""), ("last_30_days", window_start)):
+            for name, query in (("rescan", rescan), ("rollup", rollup)):
+                began = time.perf_counter()
+                for _ in range(repeat):
+                    answer = query(start)
+                result[f"{label}_{name}_ms"] = round((time.perf_counter() - began) / repeat * 1e3, 2)
+                result[f"{label}_{name}_habit"] = answer
+        close_all_pools()
+    return result
+
+
+def bench_streak_lookup(max_history=100000, lookups=1000):
+    """ get_streak latency for habits with ever longer histories; it should stay flat """
+    result = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for history in (10, 1000, max_history):
+            db_file = os.path.join(tmp, f"lookup_{history}.db")
+            Database(db_file).migrate()
+            close_all_pools()
+            _populate_checkins(db_file, 1, history)
+            tracker = HabitTracker(1, db_file)
+            start = time.perf_counter()
+            for _ in range(lookups):
+                tracker.get_streak("Habit 1")
+            result[f"history_{history}_us"] = round((time.perf_counter() - start) / lookups * 1e6, 1)
+            close_all_pools()
+    return result
+
+
+def bench_habit_lookup(habits=1000, lookups=20000):
+    """ get_habit_info latency when every lookup misses the habit cache versus when it hits """
+    rng = random.Random(42)
+    names = [f"Habit {rng.randint(1, habits)}" for _ in range(lookups)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "lookup.db")
+        _create_schema(db_file, habits=[(f"Habit {index}", "", "daily") for index in range(1, habits + 1)])
+        tracker = HabitTracker(1, db_file)
+
+        start = time.perf_counter()
+        for name in names:
+            tracker.cache.clear()
+            tracker.get_habit_info(name)
+        miss_elapsed = time.perf_counter() - start
+
+        tracker.cache.clear()
+        for name in set(names):
+            tracker.get_habit_info(name)
+        start = time.perf_counter()
+        for name in names:
+            tracker.get_habit_info(name)
+        hit_elapsed = time.perf_counter() - start
+        stats = tracker.cache.stats()
+        close_all_pools()
+
+    return {
+        "lookups": lookups,
+        "miss_us": round(miss_elapsed / lookups * 1e6, 1),
+        "hit_us": round(hit_elapsed / lookups * 1e6, 1),
+        "cache_size": stats["size"],
+        "evictions": stats["evictions"],
+    }
+
+
+def bench_async_checkins(count=5000):
+    """ Check-ins per second through AsyncHabitTracker as the number of concurrent callers grows """
+    async def run(tracker, concurrency):
+        async def caller(calls):
+            for _ in range(calls):
+                await tracker.mark_habit_as_done(1, "Exercise")
+
+        await asyncio.gather(*(caller(count // concurrency) for _ in range(concurrency)))
+
+    result = {"checkins": count}
+    with tempfile.TemporaryDirectory() as tmp:
+        for concurrency in (1, 10, 100, 1000):
+            db_file = os.path.join(tmp, f"async_{concurrency}.db")
+            _create_schema(db_file)
+            tracker = AsyncHabitTracker(1, db_file)
+            start = time.perf_counter()
+            asyncio.run(run(tracker, concurrency))
+            elapsed = time.perf_counter() - start
+            asyncio.run(tracker.close())
+            result[f"concurrency_{concurrency}_per_sec"] = round(count // concurrency * concurrency / elapsed)
+            result[f"concurrency_{concurrency}_commits"] = tracker.group_commits
+            close_all_pools()
+    return result
+
+
+def bench_history_scan(habits=100, checkins_per_habit=10000):
+    """ Peak Python memory and time to walk every check-in: fetchall() versus the streaming reader """
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "history.db")
+        Database(db_file).migrate()
+        close_all_pools()
+        _populate_checkins(db_file, habits, checkins_per_habit)
+        database = Database(db_file)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        total = 0
+        for habit_id in range(1, habits + 1):
+            total += len(database.get_habit_tracking_by_habit_id(habit_id))
+        with database.pool.connection() as conn:
+            total += len(conn.execute("SELECT id, habit_id, checked_at FROM habit_tracking").fetchall())
+        fetchall_elapsed = time.perf_counter() - start
+        fetchall_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        streamed = 0
+        for habit_id in range(1, habits + 1):
+            streamed += sum(1 for _ in database.iter_habit_tracking(habit_id))
+        streamed += sum(1 for _ in database.iter_habit_tracking())
+        streaming_elapsed = time.perf_counter() - start
+        streaming_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        close_all_pools()
+
+    return {
+        "checkins": habits * checkins_per_habit,
+        "rows_read": total,
+        "fetchall_seconds": round(fetchall_elapsed, 3),
+        "fetchall_peak_mb": round(fetchall_peak / 2**20, 1),
+        "streaming_seconds": round(streaming_elapsed, 3),
+        "streaming_peak_mb": round(streaming_peak / 2**20, 1),
+        "identical_counts": streamed == total,
+    }
+
+
+class _LegacyHabit:
+    """ The model before __slots__: a __dict__ per habit and check-ins as a list of strings """
+
+    def __init__(self, name, periodicity, tracking_data):
+        self.user_id = 1
+        self.name = name
+        self.description = ""
+        self.periodicity = periodicity
+        self.creation_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.tracking_data = tracking_data
+        self.db_file = ":memory:"
+
+
+def bench_models(habits=100000, checkins_per_habit=1000, sample=1000):
+    """ Memory per habit and streak/status latency of the Habit model against the list-of-strings one.
+
+    The legacy model is only built for `sample` habits, since 100k habits x 1k string check-ins
+    would need several GB; its totals are scaled up from the sample.
+    """
+    start_day = datetime(2020, 1, 1, 8, 0)
+    history = [start_day + timedelta(days=day, minutes=day % 600) for day in range(checkins_per_habit)]
+    seconds = array("q", (to_epoch_seconds(checked_at) for checked_at in history))
+
+    gc.collect()
+    tracemalloc.start()
+    legacy = [_LegacyHabit(f"Habit {index}", "daily",
+                           [checked_at.strftime('%Y-%m-%d %H:%M:%S') for checked_at in history])
+              for index in range(min(sample, habits))]
+    legacy_bytes = tracemalloc.get_traced_memory()[0] / len(legacy)
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    user = User(1, "user@example.com", "user", "password", datetime.now())
+    for index in range(habits):
+        habit = Habit(1, f"Habit {index}", "", "daily", ":memory:")
+        habit.checkins = array("q", seconds)
+        user.add_habit(habit)
+    model_bytes = tracemalloc.get_traced_memory()[0] / habits
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for habit in legacy:
+        calendar = HabitCalendar(habit.periodicity, habit.tracking_data)
+        calendar.longest_streak(), calendar.is_on_track()
+    legacy_us = (time.perf_counter() - start) / len(legacy) * 1e6
+
+    sampled = user.habits[:len(legacy)]
+    start = time.perf_counter()
+    for habit in sampled:
+        habit.calculate_habit_streak(), habit.check_habit_status()
+    model_us = (time.perf_counter() - start) / len(sampled) * 1e6
+
+    names = [f"Habit {index}" for index in range(0, habits, max(1, habits // 1000))]
+    start = time.perf_counter()
+    for name in names:
+        user.get_habit(name)
+    lookup_us = (time.perf_counter() - start) / len(names) * 1e6
+
+    return {
+        "habits": habits,
+        "checkins": habits * checkins_per_habit,
+        "legacy_bytes_per_habit": round(legacy_bytes),
+        "model_bytes_per_habit": round(model_bytes),
+        "legacy_total_mb": round(legacy_bytes * habits / 2**20),
+        "model_total_mb": round(model_bytes * habits / 2**20),
+        "legacy_streak_and_status_us": round(legacy_us, 1),
+        "model_streak_and_status_us": round(model_us, 1),
+        "lookup_by_name_us": round(lookup_us, 2),
+    }
+
+
+def bench_analytics(habits=1000, checkins_per_habit=1000):
+    """ Analytics longest streaks with the Python loop versus the NumPy backend """
+    rng = random.Random(42)
+    start_day = datetime(2020, 1, 1, 8, 0)
+    habit_objects = []
+    for index in range(habits):
+        day, tracking_data = 0, []
+        for _ in range(checkins_per_habit):
+            day += 1 if rng.random() < 0.8 else rng.randint(2, 5)
+            tracking_data.append(start_day + timedelta(days=day))
+        habit = Habit(1, f"Habit {index}", "", "daily", ":memory:")
+        habit.tracking_data = tracking_data
+        habit_objects.append(habit)
+
+    start = time.perf_counter()
+    python_longest = [habit.calendar().longest_streak() for habit in habit_objects]
+    python_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = NumpyAnalytics(habit_objects)
+    load_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    numpy_longest = vectorized.get_longest_streaks()
+    numpy_elapsed = time.perf_counter() - start
+
+    return {
+        "habits": habits,
+        "checkins": habits * checkins_per_habit,
+        "python_seconds": round(python_elapsed, 3),
+        "numpy_load_seconds": round(load_elapsed, 3),
+        "numpy_seconds": round(numpy_elapsed, 3),
+        "identical_results": python_longest == numpy_longest,
+    }
+
+
+def bench_sharded_writes(users=8, checkins_per_user=500, shards=4):
+    """ Concurrent check-ins, one thread and one transaction per check-in per user, into one file and into shards """
+    result = {"users": users, "checkins": users * checkins_per_user}
+    for label, count in (("one_file", 1), (f"{shards}_shards", shards)):
+        with tempfile.TemporaryDirectory() as tmp:
+            with ShardRouter.from_directory(tmp, count, max_workers=users) as router:
+                router.migrate()
+                trackers = [router.tracker(user_id) for user_id in range(1, users + 1)]
+                for tracker in trackers:
+                    tracker.create_habit(tracker.user_id, "Exercise", "", "daily")
+
+                def write(tracker):
+                    for _ in range(checkins_per_user):
+                        tracker.mark_habit_as_done(tracker.user_id, "Exercise")
+
+                start = time.perf_counter()
+                list(router.executor.map(write, trackers))
+                elapsed = time.perf_counter() - start
+            close_all_pools()
+        result[f"{label}_per_sec"] = round(users * checkins_per_user / elapsed)
+    return result
+
+
+def bench_parallel_analytics(habits=2000, checkins_per_habit=500, workers=4):
+    """ Streak and completion report over every habit, in this process and on a pool of worker processes """
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "analytics.db")
+        Database(db_file).migrate()
+        close_all_pools()
+        result = generate(db_file, users=max(1, habits // 10), habits_per_user=min(10, habits),
+                          checkins_per_habit=checkins_per_habit)
+        for label, count in (("one_process", 1), (f"{workers}_workers", workers)):
+            start = time.perf_counter()
+            report = analyze(db_file, workers=count)
+            result[f"{label}_seconds"] = round(time.perf_counter() - start, 2)
+        result["longest_streak"] = report.longest_streaks[0][3] if report.longest_streaks else 0
+        result["cpus"] = os.cpu_count()
+    return result
+
+
+def bench_checkin_writer(count=4000, threads=8):
+    """ Check-ins from concurrent threads: one commit per call, against the group-committing CheckinWriter """
+    result = {"checkins": count, "threads": threads}
+    for label in ("per_call", FLUSHED, QUEUED):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_file = os.path.join(tmp, "writer.db")
+            _create_schema(db_file)
+            writer = None if label == "per_call" else CheckinWriter(db_file, label)
+            tracker = HabitTracker(1, db_file, writer=writer)
+
+            def check_in(calls):
+                for _ in range(calls):
+                    tracker.mark_habit_as_done(1, "Exercise")
+
+            workers = [threading.Thread(target=check_in, args=(count // threads,)) for _ in range(threads)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            if writer is not None:
+                writer.close()
+                result[f"{label}_commits"] = writer.commits
+            result[f"{label}_per_sec"] = round(count // threads * threads / (time.perf_counter() - start))
+            close_all_pools()
+    return result
+
+
+def _legacy_startup(db_file):
+    """ main.main() before startup(): wipe every table, re-seed, then one transaction per sample habit """
+    from main import SAMPLE_HABITS
+    db = Database(db_file)
+    db.initialize_database()
+    db.populate_tables()
+    for name, description, periodicity in SAMPLE_HABITS:
+        Habit(1, name, description, periodicity, db_file).create_habit(1, name, description, periodicity)
+
+
+def bench_startup(runs=10):
+    """ Opening an existing database at launch: the old wipe-and-reseed against main.startup(), in
+    process and as a fresh interpreter running until its first query """
+    from main import startup
+    result = {"runs": runs}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "main.db")
+        startup(db_file)
+        for label, function in (("legacy", _legacy_startup), ("startup", startup)):
+            start = time.perf_counter()
+            for _ in range(runs):
+                function(db_file)
+            result[f"{label}_ms"] = round((time.perf_counter() - start) / runs * 1e3, 2)
+        close_all_pools()
+
+        code = f"import main; main.startup({db_file!r})[1].get_all_habits()"
+        for label, command in (("python_only", "pass"), ("process_to_first_query", code)):
+            start = time.perf_counter()
+            for _ in range(runs):
+                subprocess.run([sys.executable, "-c", command], check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+            result[f"{label}_ms"] = round((time.perf_counter() - start) / runs * 1e3, 1)
+    return result
+
+
+def bench_cli(rows=200000, habits=100):
+    """ cli bulk-import and export of NDJSON: throughput and peak traced memory for a quarter and all of the rows """
+    result = {"rows": rows}
+    start_day = datetime(2020, 1, 1)
+    for label, count in (("quarter", rows // 4), ("full", rows)):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_file = os.path.join(tmp, "cli.db")
+            _create_schema(db_file, [(f"Habit {i}", "", "daily") for i in range(habits)])
+            input_file = os.path.join(tmp, "checkins.ndjson")
+            with open(input_file, "w") as file:
+                for i in range(count):
+                    checked_at = (start_day + timedelta(hours=i // habits * 13)).strftime('%Y-%m-%d %H:%M:%S')
+                    file.write(f'{{"habit": "Habit {i % habits}", "checked_at": "{checked_at}"}}\n')
+
+            for command, stdin in (("bulk-import", input_file), ("export", None)):
+                with open(stdin or os.devnull) as source, open(os.devnull, "w") as sink:
+                    tracemalloc.start()
+                    start = time.perf_counter()
+                    cli.main(["--db", db_file, command], source, sink, sink)
+                    elapsed = time.perf_counter() - start
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                result[f"{command}_{label}_per_sec"] = round(count / elapsed)
+                result[f"{command}_{label}_peak_kb"] = round(peak / 1024)
+            close_all_pools()
+    return result
+
+
+def bench_columnar(users=20, habits_per_user=10, checkins_per_habit=500):
+    """ Backing up and restoring the check-in history: a columnar file against a SQL dump from iterdump(),
+    and Analytics fed from the file against Analytics fed from the database """
+    result = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "source.db")
+        Database(db_file).migrate()
+        result.update(generate(db_file, users, habits_per_user, checkins_per_habit))
+        close_all_pools()
+
+        dump_file = os.path.join(tmp, "dump.sql")
+        start = time.perf_counter()
+        conn = sqlite3.connect(db_file)
+        with open(dump_file, "w") as file:
+            for line in _dump_without_search(conn):
+                file.write(line + "\n")
+        conn.close()
+        result["dump_export_s"] = round(time.perf_counter() - start, 3)
+        result["dump_bytes"] = os.path.getsize(dump_file)
+
+        columnar_file = os.path.join(tmp, "history.htck")
+        start = time.perf_counter()
+        columnar.export_history(db_file, columnar_file)
+        result["columnar_export_s"] = round(time.perf_counter() - start, 3)
+        result["columnar_bytes"] = os.path.getsize(columnar_file)
+
+        start = time.perf_counter()
+        conn = sqlite3.connect(os.path.join(tmp, "from_dump.db"))
+        with open(dump_file) as file:
+            conn.executescript(file.read())
+        with conn:
+            create_search_index(conn)
+        conn.close()
+        result["dump_restore_s"] = round(time.perf_counter() - start, 3)
+
+        restored = os.path.join(tmp, "from_columnar.db")
+        Database(restored).migrate()
+        start = time.perf_counter()
+        columnar.import_history(columnar_file, restored)
+        result["columnar_restore_s"] = round(time.perf_counter() - start, 3)
+
+        user_id = 1
+        start = time.perf_counter()
+        user = User(user_id, None, None, None, None)
+        tracker = HabitTracker(user_id, db_file)
+        for row in tracker.iter_all_habits(records=True):
+            habit = Habit(row.user_id, row.name, row.description, row.periodicity, db_file)
+            for checkin in tracker.iter_habit_tracking_by_id(row.id):
+                habit.add_checkin(checkin[2])
+            user.add_habit(habit)
+        from_db = [Analytics(user.habits).get_longest_streak_for_habit(habit.name) for habit in user.habits]
+        result["analytics_from_db_s"] = round(time.perf_counter() - start, 4)
+
+        start = time.perf_counter()
+        with columnar.ColumnarReader(columnar_file) as reader:
+            user = columnar.habits_from_file(reader, user_id)
+        from_file = [Analytics(user.habits).get_longest_streak_for_habit(habit.name) for habit in user.habits]
+        result["analytics_from_file_s"] = round(time.perf_counter() - start, 4)
+        result["analytics_match"] = from_db == from_file
+        close_all_pools()
+    return result
+
+
+def bench_search(habits=1000000, habits_per_user=10, queries=200):
+    """ Habit search latency: FTS5 prefix queries against LIKE scans, for one user's habits and for every user's """
+    rng = random.Random(7)
+    words = ["running", "reading", "meditation", "exercise", "journaling", "stretching", "cooking", "walking",
+             "swimming", "cycling", "drawing", "guitar", "piano", "yoga", "spanish", "coding", "sleep", "water"]
+    result = {"habits": habits}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "search.db")
+        Database(db_file).migrate()
+        close_all_pools()
+        conn = sqlite3.connect(db_file)
+        start = time.perf_counter()
+        with conn:
+            conn.executemany(
+                "INSERT INTO habits (user_id, name, description, periodicity) VALUES (?, ?, ?, 'daily')",
+                ((i // habits_per_user + 1, f"{rng.choice(words).title()} {i}",
+                  f"{rng.choice(words)} and {rng.choice(words)} every day") for i in range(habits)))
+        result["insert_with_index_s"] = round(time.perf_counter() - start, 2)
+
+        users = habits // habits_per_user
+        cases = [(rng.randint(1, users), rng.choice(words)[:rng.randint(3, 6)]) for _ in range(queries)]
+        # Like the FTS query, LIKE has to find every match to put the name matches first
+        like = ("SELECT id, name, description FROM habits WHERE {} (name LIKE ?1 OR description LIKE ?1) "
+                "ORDER BY name LIKE ?1 DESC, id LIMIT 10")
+        for scope in ("user", "all"):
+            start = time.perf_counter()
+            for user_id, prefix in cases:
+                search_habits(conn, user_id if scope == "user" else None, prefix, fuzzy=False)
+            result[f"fts_{scope}_ms"] = round((time.perf_counter() - start) / queries * 1000, 3)
+
+            start = time.perf_counter()
+            for user_id, prefix in cases:
+                if scope == "user":
+                    conn.execute(like.format("user_id = ?2 AND"), (f"%{prefix}%", user_id)).fetchall()
+                else:
+                    conn.execute(like.format(""), (f"%{prefix}%",)).fetchall()
+            result[f"like_{scope}_ms"] = round((time.perf_counter() - start) / queries * 1000, 3)
+
+        misses = [(user_id, "zq" + prefix) for user_id, prefix in cases[:20]]
+        start = time.perf_counter()
+        for user_id, text in misses:
+            search_habits(conn, None, text, fuzzy=False)
+        result["fts_all_no_match_ms"] = round((time.perf_counter() - start) / len(misses) * 1000, 3)
+        start = time.perf_counter()
+        for user_id, text in misses:
+            conn.execute(like.format(""), (f"%{text}%",)).fetchall()
+        result["like_all_no_match_ms"] = round((time.perf_counter() - start) / len(misses) * 1000, 3)
+        start = time.perf_counter()
+        for user_id, prefix in cases[:20]:
+            search_habits(conn, user_id, prefix[:2] + "x" + prefix[3:] if len(prefix) > 3 else prefix + "x")
+        result["fts_user_fuzzy_ms"] = round((time.perf_counter() - start) / 20 * 1000, 3)
+        conn.close()
+    return result
+
+
+def bench_period_keys(habits=2000, checkins_per_habit=500, repeat=5):
+    """ Weekly check-in counts over a 90 day range: the day_key/week_key columns versus parsing checked_at """
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "period_keys.db")
+        Database(db_file).migrate()
+        close_all_pools()
+        _populate_checkins(db_file, habits, checkins_per_habit)
+        conn = sqlite3.connect(db_file)
+        last_day = date.fromisoformat(conn.execute("SELECT MAX(checked_at) FROM habit_tracking").fetchone()[0][:10])
+        first_day = last_day - timedelta(days=89)
+        queries = {
+            "keys": ("""SELECT habit_id, week_key, COUNT(*) FROM habit_tracking WHERE day_key BETWEEN ? AND ?
+                        GROUP BY habit_id, week_key ORDER BY habit_id, week_key""",
+                     (period_ordinal(first_day, "daily"), period_ordinal(last_day, "daily"))),
+            "parsed": (f"""SELECT habit_id, {week_sql("checked_at")} AS week, COUNT(*) FROM habit_tracking
+                           WHERE {day_sql("checked_at")} BETWEEN ? AND ?
+                           GROUP BY habit_id, week ORDER BY habit_id, week""",
+                       (period_ordinal(first_day, "daily"), period_ordinal(last_day, "daily"))),
+        }
+        result = {"checkins": conn.execute("SELECT COUNT(*) FROM habit_tracking").fetchone()[0]}
+        answers = {}
+        for name, (sql, parameters) in queries.items():
+            began = time.perf_counter()
+            for _ in range(repeat):
+                answers[name] = conn.execute(sql, parameters).fetchall()
+            result[f"{name}_ms"] = round((time.perf_counter() - began) / repeat * 1e3, 2)
+        result["rows"] = len(answers["keys"])
+        result["identical_results"] = answers["keys"] == answers["parsed"]
+        conn.close()
+    return result
+
+
+def bench_compaction(habits=2000, checkins_per_habit=500, keep_days=90, batch_size=5000):
+    """ Archive all but the last keep_days days of check-ins while a writer keeps checking habits off """
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "compaction.db")
+        Database(db_file).migrate()
+        close_all_pools()
+        _populate_checkins(db_file, habits, checkins_per_habit)
+        with sqlite3.connect(db_file) as conn:
+            last_day = date.fromisoformat(conn.execute("SELECT MAX(checked_at) FROM habit_tracking").fetchone()[0][:10])
+        file_bytes = os.path.getsize(db_file)
+
+        stop = threading.Event()
+        waits = []
+
+        def writer():
+            tracker = HabitTracker(1, db_file)
+            while not stop.is_set():
+                began = time.perf_counter()
+                tracker.mark_habits_done_bulk([(1, random.randint(1, habits), None)])
+                waits.append(time.perf_counter() - began)
+                time.sleep(0.005)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            result = compact_checkins(db_file, last_day - timedelta(days=keep_days), batch_size=batch_size,
+                                      vacuum_seconds=60)
+        finally:
+            stop.set()
+            thread.join()
+        close_all_pools()
+        result["file_bytes_before"] = file_bytes
+        result["file_bytes_after"] = os.path.getsize(db_file)
+        result["concurrent_checkins"] = len(waits)
+        waits.sort()
+        for label, quantile in (("p50", 0.5), ("p99", 0.99), ("max", 1.0)):
+            result[f"{label}_checkin_wait_ms"] = round(waits[int(quantile * (len(waits) - 1))] * 1e3, 2) if waits else None
+        del result["archive"]
+    return result
+
+
+def bench_scheduler(habits=1000000, users=10000, checkins=100000):
+    """ DueScheduler over `habits` habits: load, three days of due/overdue events, check-in updates,
+    and a poll with nothing due against a scan of every habit """
+    rng = random.Random(11)
+    now = int(datetime(2024, 6, 1, 12, tzinfo=timezone.utc).timestamp())
+    today = now // 86400
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "scheduler.db")
+        Database(db_file).migrate()
+        close_all_pools()
+        conn = sqlite3.connect(db_file)
+        with conn:
+            # Filled directly: indexing a million habit names for search is not what is measured here
+            conn.execute("DROP TRIGGER habits_search_insert")
+            conn.executemany("INSERT INTO users (id, email, username, password, utc_offset) VALUES (?, '', '', '', ?)",
+                             ((user_id, rng.choice([-300, 0, 60, 540])) for user_id in range(1, users + 1)))
+            conn.executemany("INSERT INTO habits (id, user_id, name, description, periodicity) VALUES (?, ?, '', '', ?)",
+                             ((habit_id, habit_id % users + 1, "weekly" if habit_id % 5 == 0 else "daily")
+                              for habit_id in range(1, habits + 1)))
+            conn.executemany("INSERT INTO habit_streaks (habit_id, current_streak, longest_streak, last_period) "
+                             "VALUES (?, 1, 1, ?)",
+                             ((habit_id, (today + 3) // 7 - rng.randint(0, 1) if habit_id % 5 == 0
+                               else today - rng.randint(0, 1)) for habit_id in range(1, habits + 1)))
+        conn.close()
+
+        result = {"habits": habits}
+        began = time.perf_counter()
+        scheduler = DueScheduler.from_database(db_file, now=now)
+        result["load_s"] = round(time.perf_counter() - began, 2)
+        close_all_pools()
+
+        events = []
+        began = time.perf_counter()
+        for hour in range(1, 73):
+            scheduler.dispatch(events.append, now + hour * 3600)
+        elapsed = time.perf_counter() - began
+        result["events"] = len(events)
+        result["us_per_event"] = round(elapsed / max(len(events), 1) * 1e6, 2)
+
+        ids = [rng.randint(1, habits) for _ in range(checkins)]
+        began = time.perf_counter()
+        for habit_id in ids:
+            scheduler.checked_in(habit_id, (today + 6) // 7 if habit_id % 5 == 0 else today + 3)
+        result["us_per_checkin"] = round((time.perf_counter() - began) / checkins * 1e6, 2)
+
+        # With nothing due, a poll peeks at the top of the heap; without it, every habit is looked at
+        # for a due time or deadline passed since the previous poll
+        previous, quiet = now + 72 * 3600, scheduler.next_at() - 1
+        began = time.perf_counter()
+        for _ in range(1000):
+            scheduler.dispatch(events.append, quiet)
+        result["heap_poll_us"] = round((time.perf_counter() - began) / 1000 * 1e6, 2)
+        began = time.perf_counter()
+        found = [habit_id for habit_id, state in scheduler._habits.items()
+                 if any(previous < at <= quiet for at in scheduler._times(state))]
+        result["scan_poll_ms"] = round((time.perf_counter() - began) * 1e3, 1)
+        result["scan_found"] = len(found)
+    return result
+
+
+def bench_replica(habits=2000, checkins_per_habit=500, readers=4, seconds=10, max_staleness_ms=5000):
+    """ Longest streaks and worst habits read by `readers` threads while a writer checks habits off, against
+    the live database and against a ReadReplica no more than max_staleness_ms behind it """
+    result = {"checkins": habits * checkins_per_habit, "readers": readers}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "replica.db")
+        Database(db_file).migrate()
+        close_all_pools()
+        _populate_checkins(db_file, habits, checkins_per_habit)
+        with sqlite3.connect(db_file) as conn:
+            rebuild_streaks(conn)
+        for label in ("live", "replica"):
+            replica = None
+            if label == "replica":
+                replica = ReadReplica(db_file, max_staleness=max_staleness_ms / 1e3)
+                replica.refresh()
+                replica.start(interval=max_staleness_ms / 2e3)
+            stop = threading.Event()
+            writes, reads, errors, lags = [], [], [], []
+
+            def writer():
+                rng = random.Random(5)
+                tracker = HabitTracker(1, db_file)
+                while not stop.is_set():
+                    # One in ten check-ins is backfilled, leaving a streak for the next analytics read to rebuild
+                    day = None
+                    if rng.random() < 0.1:
+                        day = datetime(2020, 1, 1, 9, 0) + timedelta(days=rng.randint(1, checkins_per_habit))
+                    began = time.perf_counter()
+                    tracker.mark_habits_done_bulk([(1, rng.randint(1, habits), day)])
+                    writes.append(time.perf_counter() - began)
+                    time.sleep(0.002)
+
+            def reader():
+                tracker = HabitTracker(1, db_file, replica=replica)
+                while not stop.is_set():
+                    began = time.perf_counter()
+                    streaks = tracker.get_habits_with_longest_streak()
+                    worst = tracker.get_worst_streak_habit()
+                    reads.append(time.perf_counter() - began)
+                    if not streaks or (isinstance(worst, str) and worst.startswith("Error")):
+                        errors.append(worst)
+                    if replica is not None:
+                        lags.append(replica.lag())
+
+            threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+            for thread in threads:
+                thread.start()
+            time.sleep(seconds)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            for name, timings in (("checkin", writes), ("read", reads)):
+                timings.sort()
+                result[f"{label}_{name}s"] = len(timings)
+                for quantile_label, quantile in (("p50", 0.5), ("p99", 0.99), ("max", 1.0)):
+                    result[f"{label}_{name}_{quantile_label}_ms"] = \
+                        round(timings[int(quantile * (len(timings) - 1))] * 1e3, 2) if timings else None
+            result[f"{label}_read_errors"] = len(errors)
+            if replica is not None:
+                stats = replica.stats()
+                result["replica_refreshes"] = stats["refreshes"]
+                result["replica_restarts"] = stats["restarts"]
+                result["replica_refresh_ms"] = stats["last_refresh_ms"]
+                result["replica_max_lag_ms"] = round(max(lags) * 1e3, 1) if lags else None
+                replica.close()
+            close_all_pools()
+    return result
+
+
+BENCHMARKS = {
+    "checkins": bench_checkins,
+    "bulk_checkins": bench_bulk_checkins,
+    "longest_streak": bench_longest_streak,
+    "streak_lookup": bench_streak_lookup,
+    "rankings": bench_rankings,
+    "habit_lookup": bench_habit_lookup,
+    "async_checkins": bench_async_checkins,
+    "history_scan": bench_history_scan,
+    "models": bench_models,
+    "analytics": bench_analytics,
+    "sharded_writes": bench_sharded_writes,
+    "parallel_analytics": bench_parallel_analytics,
+    "checkin_writer": bench_checkin_writer,
+    "startup": bench_startup,
+    "cli": bench_cli,
+    "columnar": bench_columnar,
+    "search": bench_search,
+    "period_keys": bench_period_keys,
+    "compaction": bench_compaction,
+    "scheduler": bench_scheduler,
+    "replica": bench_replica,
+}
+
+
+if __name__ == "__main__":
+    name = sys.argv[1] if len(sys.argv) > 1 else "checkins"
+    if name not in BENCHMARKS:
+        sys.exit(f"Unknown benchmark '{name}'. Choose from: {', '.join(BENCHMARKS)}")
+    result = BENCHMARKS[name](*(int(arg) for arg in sys.argv[2:]))
+    for key, value in result.items():
+        print(f"{key}: {value}")
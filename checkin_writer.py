@@ -0,0 +1,173 @@
+""" Background writer that group-commits check-ins.
+
+HabitTracker.mark_habit_as_done commits once per check-in, so at peak times the write
+path is one transaction, and one WAL sync, per call. A CheckinWriter accepts check-ins
+into a bounded in-memory queue instead, and a background thread writes all the waiting
+ones, up to max_batch, in a single transaction. Check-ins that arrive while one batch
+commits make up the next, so batches grow with the load; max_delay can additionally hold
+each batch open for stragglers. How long a caller waits is the durability mode:
+
+    FLUSHED  mark_habit_as_done returns once the check-in's transaction has committed.
+    QUEUED   mark_habit_as_done returns as soon as the check-in is queued. A full queue
+             blocks callers for up to put_timeout seconds (backpressure), then raises
+             queue.Full. Queued check-ins are lost only if the process dies before close().
+
+close(), also run at interpreter exit, writes everything that was queued before it returns.
+"""
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from connection import get_pool
+from habit_tracker import HabitTracker
+from timekeys import parse_time
+
+FLUSHED = "flushed"
+QUEUED = "queued"
+
+_STOP = object()
+
+
+class CheckinWriter:
+    """ Queue check-ins and write them in group-committed transactions on a background thread.
+
+    Args:
+        db_file (str): The database file.
+        durability (str): FLUSHED or QUEUED, see the module docstring.
+        max_batch (int): Most check-ins written in one transaction.
+        max_delay (float): Seconds the first check-in of a batch waits for others to join it;
+            0 writes whatever is queued at once.
+        max_queue (int): Most check-ins waiting to be written; 0 for no limit.
+        put_timeout (float): Seconds a caller waits for room in a full queue, None to wait indefinitely.
+    """
+
+    def __init__(self, db_file, durability=FLUSHED, max_batch=500, max_delay=0.0, max_queue=10000,
+                 put_timeout=None):
+        if durability not in (FLUSHED, QUEUED):
+            raise ValueError(f"Unknown durability mode {durability!r}; use {FLUSHED!r} or {QUEUED!r}")
+        self.db_file = db_file
+        self.pool = get_pool(db_file)
+        self.durability = durability
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self.commits = 0
+        self.written = 0
+        self.closed = False
+        self._queue = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run, name="checkin-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, user_id, habit, checked_at=None):
+        """ Queue a check-in of a habit, given by name or id, and return a Future of its status message.
+
+        checked_at is a datetime, an ISO formatted string or None for now.
+        """
+        if self.closed:
+            raise sqlite3.ProgrammingError("Check-in writer is closed")
+        future = Future()
+        try:
+            record = (user_id, habit, parse_time(checked_at))
+        except (TypeError, ValueError):
+            future.set_result("Error marking habit as done: invalid timestamp")
+            return future
+        self._queue.put((record, future), timeout=self.put_timeout)
+        return future
+
+    def mark_habit_as_done(self, user_id, habit, checked_at=None, timeout=None):
+        """ Check a habit off; waits for the commit in FLUSHED mode, up to timeout seconds """
+        future = self.submit(user_id, habit, checked_at)
+        if self.durability == FLUSHED:
+            return future.result(timeout)
+        return "Habit check-in queued"
+
+    def flush(self, timeout=None):
+        """ Block until every check-in submitted so far has been written; False on timeout """
+        if self.closed:
+            return True
+        done = threading.Event()
+        self._queue.put((None, done))
+        return done.wait(timeout)
+
+    def _next_batch(self):
+        """ Wait for an entry, then collect more until max_batch, max_delay or a flush/stop marker """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch and batch[-1] is not _STOP and batch[-1][0] is not None:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+            self._write([entry for entry in batch if entry[0] is not None])
+            for record, marker in batch:
+                if record is None:
+                    marker.set()
+            if stop:
+                return
+
+    def _write(self, entries):
+        """ Write queued (record, future) entries in one transaction and resolve their futures """
+        if not entries:
+            return
+        try:
+            habit_ids = {}
+            with self.pool.transaction() as conn:
+                HabitTracker._resolve_habit_ids(conn, [record for record, _ in entries], habit_ids)
+                checkins, statuses = [], []
+                for (user_id, habit, checked_at), _ in entries:
+                    habit_id = habit_ids.get((user_id, habit))
+                    if habit_id is None:
+                        statuses.append("Error marking habit as done: unknown habit")
+                    else:
+                        checkins.append((habit_id, user_id, checked_at))
+                        statuses.append("Habit marked as done successfully")
+                rows = HabitTracker._localize(conn, checkins, {})
+                HabitTracker._insert_checkins(conn, rows)
+            self.commits += 1
+            self.written += len(rows)
+        except sqlite3.Error as e:
+            statuses = [f"Error marking habit as done: {e}"] * len(entries)
+        except Exception as e:
+            for _, future in entries:
+                future.set_exception(e)
+            return
+        for (_, future), status in zip(entries, statuses):
+            future.set_result(status)
+
+    def close(self):
+        """ Stop accepting check-ins, write the queued ones and stop the background thread """
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self._queue.put(_STOP)
+        self._thread.join()
+        # Check-ins submitted while the writer was stopping
+        leftovers = []
+        while True:
+            try:
+                leftovers.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._write([entry for entry in leftovers if entry is not _STOP and entry[0] is not None])
+        for entry in leftovers:
+            if entry is not _STOP and entry[0] is None:
+                entry[1].set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,281 @@
+""" Scriptable command line interface for cron jobs and pipelines.
+
+    python cli.py --user 1 checkin Exercise
+    python cli.py --user 1 bulk-import --input-format csv < checkins.csv
+    python cli.py --user 1 streaks --format csv
+    python cli.py --user 1 report
+    python cli.py --user 1 search "morning run"
+    python cli.py --user 1 export > checkins.ndjson
+    python cli.py compact --keep-days 365
+    python cli.py due --remind-before 120
+
+Input is read from stdin and results are written to stdout as NDJSON (one JSON object per
+line) or CSV with a header row. Both directions are streamed: bulk-import writes each
+chunk of records before reading the next, and export and report read check-ins in
+keyset batches, so memory use does not grow with the number of rows. Progress and
+summaries go to stderr. `python main.py <command> ...` runs the same commands.
+"""
+import argparse
+import csv
+import json
+import sys
+from datetime import date, datetime, timedelta, timezone
+from itertools import islice, repeat
+from analytics import Analytics
+from compaction import compact_checkins
+from database import Database
+from habit import Habit
+from habit_tracker import HabitTracker
+from history import iter_checkin_day_batches, iter_checkins, iter_habits
+from scheduler import DueScheduler
+
+FORMATS = ("ndjson", "csv")
+
+
+class _Output:
+    """ Writes dict rows as NDJSON or as CSV with a header taken from the first row's keys """
+
+    def __init__(self, stream, output_format):
+        self.stream = stream
+        self.format = output_format
+        self.rows = 0
+        self._csv = None
+
+    def write(self, row):
+        if self.format == "ndjson":
+            self.stream.write(json.dumps(row, default=str) + "\n")
+        else:
+            if self._csv is None:
+                self._csv = csv.DictWriter(self.stream, fieldnames=list(row))
+                self._csv.writeheader()
+            self._csv.writerow(row)
+        self.rows += 1
+
+
+def _read_rows(stream, input_format):
+    """ Yield input rows as dicts; an NDJSON line that is not a JSON object is yielded as is """
+    if input_format == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row if isinstance(row, dict) else line
+
+
+def _to_record(row, default_user_id):
+    """ The (user_id, habit, checked_at) record mark_habits_done_bulk expects for an input row.
+
+    Rows name the habit with "habit" or "habit_id"; "user_id" defaults to --user. Rows
+    that cannot be read, such as ones whose habit is a JSON list or object, are passed
+    through, for mark_habits_done_bulk to reject.
+    """
+    if not isinstance(row, dict):
+        return (row,)
+    try:
+        user_id = int(row.get("user_id") or default_user_id)
+        habit = int(row["habit_id"]) if row.get("habit_id") not in (None, "") else row["habit"]
+    except (KeyError, TypeError, ValueError):
+        return (row,)
+    if not isinstance(habit, (str, int)):
+        return (row,)
+    return user_id, habit, row.get("checked_at") or None
+
+
+def _progress(args, message):
+    print(message, file=args.stderr, flush=True)
+
+
+def checkin(args, tracker, out):
+    result = tracker.mark_habits_done_bulk([(args.user, args.habit, args.at)])
+    status = "ok" if result["inserted"] else result["rejected"][0][1]
+    out.write({"habit": args.habit, "checked_at": args.at, "status": status})
+    return 0 if result["inserted"] else 1
+
+
+def bulk_import(args, tracker, out):
+    rows = (_to_record(row, args.user) for row in _read_rows(args.stdin, args.input_format))
+    inserted = rejected = read = 0
+    while True:
+        # Hand the tracker one bounded slice at a time so rejects and progress stream out
+        records = list(islice(rows, args.chunk_size * 20))
+        if not records:
+            break
+        read += len(records)
+        result = tracker.mark_habits_done_bulk(records, args.chunk_size)
+        inserted += result["inserted"]
+        for record, reason in result["rejected"]:
+            rejected += 1
+            out.write({"record": record, "reason": reason})
+        if args.progress and read // args.progress != (read - len(records)) // args.progress:
+            _progress(args, f"read {read} rows: {inserted} inserted, {rejected} rejected")
+    _progress(args, f"done: {read} rows read, {inserted} inserted, {rejected} rejected")
+    return 0 if not rejected else 1
+
+
+def streaks(args, tracker, out):
+    if args.habit:
+        summary = tracker.get_streak(args.habit)
+        if summary is None or isinstance(summary, str):
+            _progress(args, summary or f"No habit found with name '{args.habit}'")
+            return 1
+        out.write(summary._asdict())
+        return 0
+    for row in tracker.get_habits_with_longest_streak():
+        out.write({"habit_id": row[0], "name": row[1], "periodicity": row[3], "longest_streak": row[5],
+                   "start": row[6], "end": row[7]})
+    return 0
+
+
+def report(args, tracker, out):
+    """ One row of Analytics figures per habit, loading one habit's check-ins at a time.
+
+    Check-ins that compaction folded into per-day counts are counted at the midnight their
+    day starts, so gaps next to compacted days may be off by up to a day.
+    """
+    for habit_row in tracker.iter_all_habits(records=True):
+        habit = Habit(habit_row.user_id, habit_row.name, habit_row.description, habit_row.periodicity,
+                      tracker.db_file)
+        for batch in iter_checkin_day_batches(tracker.pool, habit_row.id):
+            for _, day, checkins in batch:
+                habit.checkins.extend(repeat(day * 86400, checkins))
+        for checkin_row in tracker.iter_habit_tracking_by_id(habit_row.id):
+            habit.add_checkin(checkin_row[2])
+        analytics = Analytics([habit])
+        out.write({
+            "habit_id": habit_row.id,
+            "name": habit.name,
+            "periodicity": habit.periodicity,
+            "checkins": len(habit.checkins),
+            "longest_streak": analytics.get_longest_streak_for_habit(habit.name),
+            "longest_gap_days": analytics.get_longest_gap_for_habit(habit.name),
+            "completion_rate": round(analytics.get_completion_rate(habit.name), 4),
+            "status": habit.check_habit_status(),
+        })
+    return 0
+
+
+def search(args, tracker, out):
+    results = tracker.search_habits(args.text, args.limit)
+    if isinstance(results, str):
+        _progress(args, results)
+        return 1
+    for row in results:
+        out.write({"habit_id": row.habit_id, "name": row.name, "description": row.description,
+                   "score": round(row.score, 4), "fuzzy": row.fuzzy})
+    return 0
+
+
+def export(args, tracker, out):
+    """ Stream check-ins in (habit_id, checked_at) order, of the user's habits or, with --all-users, of all """
+    user_id = None if args.all_users else args.user
+    names = {row[1]: (row[0], row[2]) for row in iter_habits(tracker.pool, user_id)}
+    habit_ids = [None] if args.all_users else sorted(names)
+    for habit_id in habit_ids:
+        for checkin_id, checkin_habit_id, checked_at in iter_checkins(tracker.pool, habit_id):
+            owner, name = names.get(checkin_habit_id, (None, None))
+            out.write({"id": checkin_id, "user_id": owner, "habit_id": checkin_habit_id, "habit": name,
+                       "checked_at": checked_at})
+            if args.progress and out.rows % args.progress == 0:
+                _progress(args, f"exported {out.rows} check-ins")
+    _progress(args, f"done: {out.rows} check-ins exported")
+    return 0
+
+
+def compact(args, tracker, out):
+    """ Archive the check-ins older than --keep-days days and print the compaction report """
+    report = compact_checkins(args.db, date.today() - timedelta(days=args.keep_days), args.archive,
+                              args.batch_size, args.vacuum_seconds)
+    out.write(report)
+    _progress(args, f"done: {report['archived']} check-ins archived, {report['bytes_reclaimed']} bytes reclaimed")
+    return 0
+
+
+def _non_negative(value):
+    minutes = int(value)
+    if minutes < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative: {value}")
+    return minutes
+
+
+def due(args, tracker, out):
+    """ Every user's habits that are due now: their streak breaks unless they are checked off this period """
+    remind_before = None if args.remind_before is None else args.remind_before * 60
+    scheduler = DueScheduler.from_database(args.db, remind_before)
+    for event in scheduler.due_events():
+        out.write({"habit_id": event.habit_id, "user_id": event.user_id,
+                   "due_at": datetime.fromtimestamp(event.at, timezone.utc).isoformat()})
+    return 0
+
+
+COMMANDS = {
+    "checkin": checkin,
+    "bulk-import": bulk_import,
+    "streaks": streaks,
+    "report": report,
+    "search": search,
+    "export": export,
+    "compact": compact,
+    "due": due,
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="habit-tracker", description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="main_db.db", help="Database file")
+    parser.add_argument("--user", type=int, default=1, help="The user whose habits are used")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson", help="Output format")
+    parser.add_argument("--progress", type=int, default=0, metavar="ROWS",
+                        help="Report progress on stderr every ROWS rows")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("checkin", help="Check a habit off")
+    command.add_argument("habit", help="Habit name")
+    command.add_argument("--at", help="Check-in time as an ISO timestamp; defaults to now")
+
+    command = commands.add_parser("bulk-import", help="Import check-ins from stdin; prints the rejected rows")
+    command.add_argument("--input-format", choices=FORMATS, default="ndjson")
+    command.add_argument("--chunk-size", type=int, default=500, help="Check-ins written per transaction")
+
+    command = commands.add_parser("streaks", help="Longest streak of every habit, or the streaks of one")
+    command.add_argument("--habit", help="Only this habit, with its current streak")
+
+    commands.add_parser("report", help="Check-in count, streak, gap and completion figures per habit")
+
+    command = commands.add_parser("search", help="The user's habits matching words of their name or description")
+    command.add_argument("text", help="Words to search for; each matches as a case-insensitive prefix")
+    command.add_argument("--limit", type=int, default=10, help="Most habits listed")
+
+    command = commands.add_parser("export", help="Write check-ins to stdout")
+    command.add_argument("--all-users", action="store_true", help="Export every user's check-ins")
+
+    command = commands.add_parser("compact", help="Move old check-ins of every user to an archive database")
+    command.add_argument("--keep-days", type=int, default=365, help="Days of check-ins kept in the database")
+    command.add_argument("--archive", help="Archive database file; defaults to <db>.archive.db")
+    command.add_argument("--batch-size", type=int, default=5000, help="Check-ins moved per transaction")
+    command.add_argument("--vacuum-seconds", type=float, default=1.0,
+                         help="Time spent returning freed pages to the file system")
+
+    command = commands.add_parser("due", help="Habits of every user whose streak breaks unless checked off this period")
+    command.add_argument("--remind-before", type=_non_negative, metavar="MINUTES",
+                         help="Only list habits whose streak breaks within MINUTES; defaults to the whole period")
+    return parser
+
+
+def main(argv=None, stdin=None, stdout=None, stderr=None):
+    args = build_parser().parse_args(argv)
+    args.stdin = stdin or sys.stdin
+    args.stderr = stderr or sys.stderr
+    Database(args.db).ensure_schema()
+    tracker = HabitTracker(args.user, args.db)
+    out = _Output(stdout or sys.stdout, args.format)
+    return COMMANDS[args.command](args, tracker, out)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
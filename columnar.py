@@ -0,0 +1,341 @@
+""" Compact columnar files of check-in history, for backups and offline analysis.
+
+A file holds the habits table and the UTC offsets of their users as a JSON block followed
+by the check-ins in chunks, in (habit_id, checked_at, id) order. Each chunk stores four
+columns, id, habit_id, checked_at and utc_offset, each as deltas from the previous row
+in the narrowest little-endian integer width (1, 2, 4 or 8 bytes) that fits the chunk.
+checked_at is the user's wall-clock time as epoch seconds, the way Habit.checkins keeps
+it, and utc_offset (minutes east of UTC) makes it an instant again, so a restore gets
+back the same checked_epoch, day_key and week_key. Sorted like this, habit_id and
+offset deltas are mostly 0 and time deltas fit in a few bytes, so a check-in takes
+about 8 bytes instead of a SQL INSERT line. The per-day counts that compaction keeps of
+archived check-ins follow in day chunks of three columns, day, habit_id and checkins,
+in (habit_id, day) order. An index at the end of the file records the offset and
+habit_id range of every chunk, so a reader can jump to the chunks of one habit. ColumnarReader can memory-map the file and decode chunks on
+demand, and habits_from_file() hands the result to Analytics without touching SQLite.
+
+Layout (little-endian):
+
+    b"HTCK", u16 version, u16 0           header
+    u32 n, n bytes of JSON                {"habits": rows of history.HabitRecord fields,
+                                           "users": [user_id, utc_offset] pairs}
+    chunk*                                u32 rows, 4 x u8 widths,
+                                          4 x i64 first values, then the 4 delta columns
+    day chunk*                            u32 rows, 3 x u8 widths, u8 0,
+                                          3 x i64 first values, then the 3 delta columns
+    (u64 offset, u32 rows, i64 first habit_id, i64 last habit_id)*    chunk index, then
+                                                                       day chunk index
+    u32 chunks, u32 day chunks, u64 index offset, b"HTCK"             trailer
+
+checked_at is stored to the second, so timestamps come back formatted as
+'%Y-%m-%d %H:%M:%S' whatever their original spelling. Readers of Habit.checkins get the
+check-ins of a compacted day at the midnight it starts. Older files are still read:
+version 2 files have no day chunks and a trailer without their count, and version 1
+files, from before offsets, also have their habits' JSON rows alone, three columns per
+chunk and every offset taken to be 0.
+"""
+import heapq
+import json
+import mmap
+import struct
+from array import array
+from itertools import accumulate, repeat
+from connection import get_pool
+from habit import Habit, User
+from habit_cache import habit_cache
+from habit_calendar import from_epoch_seconds, to_epoch_seconds
+from history import CheckIn, HabitRecord, iter_checkin_batches, iter_checkin_day_batches, iter_habits
+from rollups import rebuild_rollups
+from streaks import rebuild_streaks
+from timekeys import user_offsets
+
+MAGIC = b"HTCK"
+VERSION = 3
+DEFAULT_CHUNK_ROWS = 65536
+
+_HEADER = struct.Struct("<4sHH")
+_CHUNK = struct.Struct("<IBBBBqqqq")
+# Day chunks; version 1 check-in chunks had the same three-column layout
+_DAY_CHUNK = _CHUNK_V1 = struct.Struct("<IBBBxqqq")
+_INDEX_ENTRY = struct.Struct("<QIqq")
+_TRAILER = struct.Struct("<IIQ4s")
+_TRAILER_V2 = struct.Struct("<IQ4s")
+_FORMATS = {1: "b", 2: "h", 4: "i", 8: "q"}
+
+
+def _width(deltas):
+    low, high = min(deltas), max(deltas)
+    for width, limit in ((1, 1 << 7), (2, 1 << 15), (4, 1 << 31)):
+        if -limit <= low and high < limit:
+            return width
+    return 8
+
+
+def _encode_column(values):
+    """ (first value, width, delta bytes) of a column; the first delta is always 0 """
+    deltas = [0]
+    deltas.extend(values[i] - values[i - 1] for i in range(1, len(values)))
+    width = _width(deltas)
+    return values[0], width, array(_FORMATS[width], deltas).tobytes()
+
+
+def _decode_column(buffer, first, width):
+    deltas = memoryview(buffer).cast(_FORMATS[width])
+    return array("q", accumulate(deltas, initial=first))[1:]
+
+
+def _write_chunk(file, chunk, index, columns):
+    """ Write a chunk of integer columns, the second being habit_id, and add it to index """
+    encoded = [_encode_column(values) for values in columns]
+    index.append((file.tell(), len(columns[0]), columns[1][0], columns[1][-1]))
+    file.write(chunk.pack(len(columns[0]), *(width for _, width, _ in encoded), *(first for first, _, _ in encoded)))
+    for _, _, data in encoded:
+        file.write(data)
+
+
+def export_history(db_file, path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """ Write the habits, check-ins and per-day counts of compacted check-ins of db_file to a
+    columnar file at path.
+
+    Check-ins without a checked_at are not exported.
+
+    Returns:
+        dict: The number of habits, check-ins, compacted days and chunks written and the
+        file size in bytes.
+
+    """
+    pool = get_pool(db_file)
+    habits = [list(row) for row in iter_habits(pool)]
+    with pool.connection() as conn:
+        offsets = sorted(user_offsets(conn, {habit[0] for habit in habits}).items())
+    index, day_index, rows, days = [], [], 0, 0
+    with open(path, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, 0))
+        metadata = json.dumps({"habits": habits, "users": offsets}, default=str).encode()
+        file.write(struct.pack("<I", len(metadata)))
+        file.write(metadata)
+        for batch in iter_checkin_batches(pool, batch_size=chunk_rows, offsets=True):
+            seconds = [to_epoch_seconds(row[2]) for row in batch]
+            _write_chunk(file, _CHUNK, index, [[row[0] for row in batch], [row[1] for row in batch], seconds,
+                                               [row[3] for row in batch]])
+            rows += len(batch)
+        for batch in iter_checkin_day_batches(pool, batch_size=chunk_rows):
+            # Reordered so habit_id is the second column, like in check-in chunks
+            _write_chunk(file, _DAY_CHUNK, day_index, [[row[1] for row in batch], [row[0] for row in batch],
+                                                       [row[2] for row in batch]])
+            days += len(batch)
+        index_offset = file.tell()
+        for entry in index + day_index:
+            file.write(_INDEX_ENTRY.pack(*entry))
+        file.write(_TRAILER.pack(len(index), len(day_index), index_offset, MAGIC))
+        size = file.tell()
+    return {"habits": len(habits), "checkins": rows, "checkin_days": days, "chunks": len(index) + len(day_index),
+            "bytes": size}
+
+
+class ColumnarReader:
+    """ Reads a file written by export_history.
+
+    Args:
+        path (str): The file.
+        use_mmap (bool): Memory-map the file, so only the chunks that are decoded are read
+            from disk, instead of reading it whole into memory.
+    """
+
+    def __init__(self, path, use_mmap=True):
+        self._file = open(path, "rb")
+        self._buffer = None
+        try:
+            if use_mmap:
+                self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._buffer = self._file.read()
+            magic, version, _ = _HEADER.unpack_from(self._buffer, 0)
+            if version < VERSION:
+                chunks, index_offset, trailer = _TRAILER_V2.unpack_from(self._buffer,
+                                                                        len(self._buffer) - _TRAILER_V2.size)
+                day_chunks = 0
+            else:
+                chunks, day_chunks, index_offset, trailer = _TRAILER.unpack_from(self._buffer,
+                                                                                 len(self._buffer) - _TRAILER.size)
+            if magic != MAGIC or trailer != MAGIC:
+                raise ValueError(f"{path} is not a check-in history file")
+            if version not in (1, 2, VERSION):
+                raise ValueError(f"{path} has unsupported version {version}")
+        except Exception:
+            self.close()
+            raise
+        self.version = version
+        (length,) = struct.unpack_from("<I", self._buffer, _HEADER.size)
+        start = _HEADER.size + 4
+        metadata = json.loads(bytes(self._buffer[start:start + length]))
+        if version == 1:
+            metadata = {"habits": metadata, "users": []}
+        self.habits = [HabitRecord._make(row) for row in metadata["habits"]]
+        # {user_id: utc_offset} of the habits' users; None is the server's time zone
+        self.user_offsets = dict(metadata["users"])
+        entries = [_INDEX_ENTRY.unpack_from(self._buffer, index_offset + i * _INDEX_ENTRY.size)
+                   for i in range(chunks + day_chunks)]
+        self.index, self.day_index = entries[:chunks], entries[chunks:]
+
+    def __len__(self):
+        return sum(entry[1] for entry in self.index)
+
+    def _read_columns(self, offset, chunk):
+        rows, *header = chunk.unpack_from(self._buffer, offset)
+        count = len(header) // 2
+        widths, firsts = header[:count], header[count:]
+        position = offset + chunk.size
+        columns = []
+        for width, first in zip(widths, firsts):
+            end = position + width * rows
+            columns.append(_decode_column(self._buffer[position:end], first, width))
+            position = end
+        return columns
+
+    def read_chunk(self, number):
+        """ The (ids, habit_ids, seconds, utc_offsets) columns of a chunk as arrays of 64-bit integers """
+        if self.version == 1:
+            columns = self._read_columns(self.index[number][0], _CHUNK_V1)
+            columns.append(array("q", bytes(8 * len(columns[0]))))
+            return tuple(columns)
+        return tuple(self._read_columns(self.index[number][0], _CHUNK))
+
+    def read_day_chunk(self, number):
+        """ The (days, habit_ids, checkins) columns of a day chunk as arrays of 64-bit integers """
+        return tuple(self._read_columns(self.day_index[number][0], _DAY_CHUNK))
+
+    def iter_checkin_days(self, habit_id=None):
+        """ Yield the (habit_id, day, checkins) counts of compacted check-ins, of every habit or of one """
+        for number, (_, _, first, last) in enumerate(self.day_index):
+            if habit_id is None or first <= habit_id <= last:
+                days, habit_ids, checkins = self.read_day_chunk(number)
+                for row in zip(habit_ids, days, checkins):
+                    if habit_id is None or row[0] == habit_id:
+                        yield row
+
+    def iter_chunks(self, habit_id=None):
+        """ Yield the columns of every chunk, or of the chunks holding habit_id's check-ins """
+        for number, (_, _, first, last) in enumerate(self.index):
+            if habit_id is None or first <= habit_id <= last:
+                yield self.read_chunk(number)
+
+    def iter_checkins(self):
+        """ Yield every check-in as a CheckIn with a datetime checked_at """
+        for ids, habit_ids, seconds, _ in self.iter_chunks():
+            for row in zip(ids, habit_ids, seconds):
+                yield CheckIn(row[0], row[1], from_epoch_seconds(row[2]))
+
+    def habit_checkins(self, habit_id):
+        """ Sorted epoch seconds of one habit's check-ins, in the form Habit.checkins keeps them """
+        checkins = array("q")
+        for _, habit_ids, seconds, _ in self.iter_chunks(habit_id):
+            for owner, second in zip(habit_ids, seconds):
+                if owner == habit_id:
+                    checkins.append(second)
+        compacted = array("q")
+        for _, day, count in self.iter_checkin_days(habit_id):
+            compacted.extend(repeat(day * 86400, count))
+        return _merge(compacted, checkins)
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _merge(compacted, checkins):
+    """ Sorted epoch seconds of both arrays; compacted days mostly come before the raw check-ins """
+    if not compacted:
+        return checkins
+    if not checkins or compacted[-1] <= checkins[0]:
+        return compacted + checkins
+    return array("q", heapq.merge(compacted, checkins))
+
+
+def habits_from_file(reader, user_id=None):
+    """ Habits with their check-ins read from a ColumnarReader, ready for Analytics.
+
+    Returns:
+        User: A User holding the habits of user_id, or of every user when user_id is None.
+
+    """
+    user = User(user_id, None, None, None, None)
+    wanted = {habit.id: habit for habit in reader.habits if user_id is None or habit.user_id == user_id}
+    for record in wanted.values():
+        habit = Habit(record.user_id, record.name, record.description, record.periodicity, None)
+        habit.creation_date = record.creation_date
+        user.add_habit(habit)
+    # One pass over the chunks that can hold the wanted habits, splitting rows by habit
+    checkins = {habit_id: array("q") for habit_id in wanted}
+    low, high = (min(wanted), max(wanted)) if wanted else (0, -1)
+    for number, (_, _, first, last) in enumerate(reader.index):
+        if last < low or first > high:
+            continue
+        _, habit_ids, seconds, _ = reader.read_chunk(number)
+        for owner, second in zip(habit_ids, seconds):
+            target = checkins.get(owner)
+            if target is not None:
+                target.append(second)
+    compacted = {habit_id: array("q") for habit_id in wanted}
+    for number, (_, _, first, last) in enumerate(reader.day_index):
+        if last < low or first > high:
+            continue
+        days, habit_ids, counts = reader.read_day_chunk(number)
+        for owner, day, count in zip(habit_ids, days, counts):
+            target = compacted.get(owner)
+            if target is not None:
+                target.extend(repeat(day * 86400, count))
+    for habit, habit_id in zip(user.habits, wanted):
+        habit.checkins = _merge(compacted[habit_id], checkins[habit_id])
+    return user
+
+
+def import_history(path, db_file):
+    """ Load a columnar file into a migrated database, keeping habit and check-in ids.
+
+    Rows whose id, or (habit_id, day) for compacted days, already exists are left as they are,
+    so importing a file twice is harmless. The file holds no user accounts: the users' UTC
+    offsets are set on the users that exist. The load is one transaction that, like a restore
+    from a SQL dump, inserts the check-ins with the habit_tracking triggers dropped, then
+    recomputes the streaks and rollups of the imported habits and puts the triggers back.
+
+    Returns:
+        dict: The number of habits, check-ins and compacted days read from the file.
+
+    """
+    pool = get_pool(db_file)
+    rows = days = 0
+    with ColumnarReader(path) as reader, pool.transaction() as conn:
+        triggers = conn.execute("SELECT name, sql FROM sqlite_master "
+                                "WHERE type = 'trigger' AND tbl_name = 'habit_tracking'").fetchall()
+        for name, _ in triggers:
+            conn.execute(f'DROP TRIGGER "{name}"')
+        conn.executemany("INSERT OR IGNORE INTO habits (user_id, id, name, description, periodicity, "
+                         "creation_date) VALUES (?, ?, ?, ?, ?, ?)", reader.habits)
+        conn.executemany("UPDATE users SET utc_offset = ? WHERE id = ?",
+                         [(utc_offset, user_id) for user_id, utc_offset in reader.user_offsets.items()])
+        for ids, habit_ids, seconds, offsets in reader.iter_chunks():
+            # datetime(..., 'unixepoch') spells the time the way export read it, '%Y-%m-%d %H:%M:%S'
+            conn.executemany("INSERT OR IGNORE INTO habit_tracking (id, habit_id, checked_at, utc_offset) "
+                             "VALUES (?, ?, datetime(?, 'unixepoch'), ?)", zip(ids, habit_ids, seconds, offsets))
+            rows += len(ids)
+        for number in range(len(reader.day_index)):
+            columns = reader.read_day_chunk(number)
+            conn.executemany("INSERT OR IGNORE INTO habit_checkin_days (day, habit_id, checkins) VALUES (?, ?, ?)",
+                             zip(*columns))
+            days += len(columns[0])
+        imported = [habit.id for habit in reader.habits]
+        rebuild_streaks(conn, imported)
+        rebuild_rollups(conn, imported)
+        for _, sql in triggers:
+            conn.execute(sql)
+        habits = len(reader.habits)
+    habit_cache(pool).clear()
+    return {"habits": habits, "checkins": rows, "checkin_days": days}
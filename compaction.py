@@ -0,0 +1,203 @@
+""" Retention: archive old check-ins and keep per-day counts in their place.
+
+habit_tracking keeps one row per check-in forever. compact_checkins() moves the check-ins
+of the days before a horizon into a habit_tracking table of a separate archive file,
+attached for the job, and folds them into habit_checkin_days: one (habit_id, day,
+checkins) row per habit and day. That is all the rollups and streaks are made of, and
+rebuild_rollups() and rebuild_streaks() read it along with the remaining raw rows, so
+rankings and streaks stay exact. The rollup and streak rows themselves are not touched:
+the habit_tracking triggers are dropped while archived rows are deleted. Readers of raw
+check-ins (history.iter_checkins, cli export) see the unarchived ones only; cli report and
+columnar files also read habit_checkin_days.
+
+The job works in batches of about batch_size rows. Each batch first copies its rows to
+the archive and commits, holding only a read transaction on the main database, then, in
+a second transaction, folds and deletes those rows whose archived copy is identical, so
+writers wait for one batch's delete at most and a crash can only leave rows that the
+next run archives again. The freed pages go back to the file
+system through incremental_vacuum(), in transactions of pages_per_step pages, for at most
+vacuum_seconds. That needs auto_vacuum=INCREMENTAL, which connection.py sets on new
+databases; enable_incremental_vacuum() converts an existing one with a full VACUUM.
+"""
+import os
+import time
+from connection import get_pool
+from habit_calendar import period_ordinal
+from streaks import iter_periods, summarize_periods
+
+COMPACTION_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS habit_checkin_days (
+            habit_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            checkins INTEGER NOT NULL,
+            PRIMARY KEY (habit_id, day)
+        ) WITHOUT ROWID''',
+]
+
+_ARCHIVE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS archive.habit_tracking (
+            id INTEGER PRIMARY KEY,
+            habit_id INTEGER NOT NULL,
+            checked_at TIMESTAMP,
+            utc_offset INTEGER NOT NULL DEFAULT 0,
+            day_key INTEGER,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+    "CREATE INDEX IF NOT EXISTS archive.idx_habit_tracking_habit_day ON habit_tracking (habit_id, day_key)",
+]
+
+# Rows of a batch whose archived copy matches them
+_ARCHIVED = """
+    FROM habit_tracking t
+    WHERE t.day_key < ? AND EXISTS (
+        SELECT 1 FROM archive.habit_tracking a
+        WHERE a.id = t.id AND a.habit_id = t.habit_id AND a.checked_at IS t.checked_at)
+"""
+
+
+def archive_path(db_file):
+    """ The default archive of a database file: main_db.db is archived to main_db.archive.db """
+    root, extension = os.path.splitext(db_file)
+    return f"{root}.archive{extension or '.db'}"
+
+
+def _database_bytes(conn):
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+def _measure(conn):
+    """ Milliseconds taken by the reads that grow with habit_tracking: a scan of every check-in and
+    the period read behind a full streak rebuild """
+    timings = {}
+    began = time.perf_counter()
+    conn.execute("SELECT COUNT(*), MAX(checked_epoch) FROM habit_tracking").fetchone()
+    timings["scan_ms"] = round((time.perf_counter() - began) * 1e3, 2)
+    began = time.perf_counter()
+    for _ in summarize_periods(iter_periods(conn)):
+        pass
+    timings["streaks_ms"] = round((time.perf_counter() - began) * 1e3, 2)
+    return timings
+
+
+def _batch_end(conn, cutoff, batch_size):
+    """ The day before which the next batch's check-ins lie: about batch_size rows, whole days """
+    row = conn.execute("SELECT day_key FROM habit_tracking WHERE day_key < ? ORDER BY day_key LIMIT 1 OFFSET ?",
+                       (cutoff, batch_size)).fetchone()
+    return cutoff if row is None else row[0] + 1
+
+
+def _fold(conn, end):
+    """ Count the archived check-ins before day end into habit_checkin_days and delete them, leaving
+    the rollups and streaks as they are; the number of check-ins deleted """
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master "
+                            "WHERE type = 'trigger' AND tbl_name = 'habit_tracking'").fetchall()
+    for name, _ in triggers:
+        conn.execute(f'DROP TRIGGER "{name}"')
+    conn.execute(f"""
+        INSERT INTO habit_checkin_days (habit_id, day, checkins)
+        SELECT t.habit_id, t.day_key, COUNT(*) {_ARCHIVED}
+        GROUP BY t.habit_id, t.day_key
+        ON CONFLICT (habit_id, day) DO UPDATE SET checkins = checkins + excluded.checkins
+    """, (end,))
+    deleted = conn.execute(f"DELETE FROM habit_tracking WHERE id IN (SELECT t.id {_ARCHIVED})", (end,)).rowcount
+    for _, sql in triggers:
+        conn.execute(sql)
+    return deleted
+
+
+def compact_checkins(db_file, before, archive_file=None, batch_size=5000, vacuum_seconds=1.0,
+                     pages_per_step=512, measure=True):
+    """ Archive the check-ins dated before a day and fold them into per-day counts.
+
+    Args:
+        db_file (str): A database migrated to the compaction schema.
+        before (date): Check-ins of earlier days, by their day_key, are archived.
+        archive_file (str): The archive database, created if needed; defaults to archive_path(db_file).
+        batch_size (int): Check-ins moved per transaction; a batch always ends at the end of a day.
+        vacuum_seconds (float): Time allowed for incremental_vacuum() afterwards; 0 skips it.
+        pages_per_step (int): Pages freed per incremental_vacuum() transaction.
+        measure (bool): Time a full check-in scan and the streak rebuild read before and after.
+
+    Returns:
+        dict: Check-ins archived, batches, seconds taken, database bytes before and after and
+        reclaimed, bytes still free inside the file and, if measured, the timings in ms.
+
+    """
+    pool = get_pool(db_file)
+    archive_file = archive_file or archive_path(db_file)
+    cutoff = period_ordinal(before, "daily")
+    report = {"archive": archive_file, "before": before.isoformat(), "archived": 0, "batches": 0}
+    with pool.connection() as conn:
+        report["bytes_before"] = _database_bytes(conn)
+        timings = _measure(conn) if measure else {}
+        began = time.perf_counter()
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_file,))
+        try:
+            conn.execute("PRAGMA archive.journal_mode = WAL")
+            conn.execute("PRAGMA archive.synchronous = NORMAL")
+            conn.execute("PRAGMA archive.cache_size = -8000")
+            for sql in _ARCHIVE_SCHEMA:
+                conn.execute(sql)
+            end = None
+            while end != cutoff:
+                end = _batch_end(conn, cutoff, batch_size)
+                # Only reads the main database, so writers are not locked out while the copy runs
+                with pool.transaction("DEFERRED"):
+                    conn.execute("""
+                        INSERT OR REPLACE INTO archive.habit_tracking (id, habit_id, checked_at, utc_offset, day_key)
+                        SELECT id, habit_id, checked_at, utc_offset, day_key FROM main.habit_tracking
+                        WHERE day_key < ?
+                    """, (end,))
+                with pool.transaction():
+                    report["archived"] += _fold(conn, end)
+                report["batches"] += 1
+        finally:
+            conn.execute("DETACH DATABASE archive")
+        report["compact_seconds"] = round(time.perf_counter() - began, 3)
+
+        began = time.perf_counter()
+        report["vacuum_pages"] = incremental_vacuum(pool, vacuum_seconds, pages_per_step) if vacuum_seconds else 0
+        report["vacuum_seconds"] = round(time.perf_counter() - began, 3)
+        report["bytes_after"] = _database_bytes(conn)
+        report["bytes_reclaimed"] = report["bytes_before"] - report["bytes_after"]
+        report["bytes_free"] = conn.execute("PRAGMA freelist_count").fetchone()[0] * \
+            conn.execute("PRAGMA page_size").fetchone()[0]
+        for name, value in timings.items():
+            report[f"{name}_before"] = value
+        for name, value in (_measure(conn) if measure else {}).items():
+            report[f"{name}_after"] = value
+    return report
+
+
+def incremental_vacuum(pool, max_seconds=1.0, pages_per_step=512):
+    """ Return free pages to the file system in transactions of pages_per_step pages, for at most
+    max_seconds, so writers get the database between steps; the number of pages freed.
+
+    Does nothing unless the database has auto_vacuum=INCREMENTAL.
+    """
+    freed = 0
+    deadline = time.monotonic() + max_seconds
+    with pool.connection() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free and time.monotonic() < deadline:
+            with pool.transaction():
+                conn.execute(f"PRAGMA incremental_vacuum({int(pages_per_step)})").fetchall()
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            freed += free - remaining
+            free = remaining
+        # Shrink the file now, if no reader holds the WAL, instead of at the next automatic checkpoint
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+    return freed
+
+
+def enable_incremental_vacuum(db_file):
+    """ Switch a database created before auto_vacuum=INCREMENTAL to it.
+
+    This is a full VACUUM: it rewrites the file and holds the write lock while it does.
+    """
+    with get_pool(db_file).connection() as conn:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
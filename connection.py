@@ -0,0 +1,210 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from instrumentation import InstrumentedConnection, record_acquire
+
+DEFAULT_PRAGMAS = {
+    # Only takes effect on a new database; lets compaction.py return freed pages a slice at a time
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -8000,
+}
+
+
+class ConnectionPool:
+    """ A bounded pool of long-lived SQLite connections for one database file.
+
+    A thread checks a connection out when it enters its outermost connection() or
+    transaction() block and hands it back when that block exits, so nested calls
+    made by the same thread share one connection (and one transaction).
+    """
+
+    def __init__(self, db_file, size=5, timeout=5.0, pragmas=None, health_check_interval=30.0, uri=False):
+        self.db_file = db_file
+        # db_file is a "file:" URI, e.g. of an in-memory database several connections share
+        self.uri = uri
+        # Every connection to ':memory:' is a separate database, so never open more than one
+        self.size = 1 if db_file == ":memory:" else size
+        self.timeout = timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.health_check_interval = health_check_interval
+        self.closed = False
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False, factory=InstrumentedConnection, uri=self.uri)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _checkout(self):
+        started = time.perf_counter()
+        try:
+            return self._acquire()
+        finally:
+            record_acquire(time.perf_counter() - started)
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self.closed:
+                    raise sqlite3.ProgrammingError("Connection pool is closed")
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    conn = last_used = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(
+                        f"Timed out waiting for a connection to {self.db_file} (pool size {self.size})")
+                self._cond.wait(remaining)
+
+        if conn is not None and time.monotonic() - last_used > self.health_check_interval:
+            if not self._is_healthy(conn):
+                conn.close()
+                conn = None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except sqlite3.Error:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def _checkin(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            if self.closed:
+                conn.close()
+                self._created -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """ Yield this thread's pooled connection, checking one out if needed """
+        local = self._local
+        if getattr(local, "conn", None) is not None:
+            yield local.conn
+            return
+
+        conn = self._checkout()
+        local.conn = conn
+        local.tx_depth = 0
+        try:
+            yield conn
+        finally:
+            local.conn = None
+            self._checkin(conn)
+
+    @contextmanager
+    def transaction(self, mode="IMMEDIATE"):
+        """ Run the block in a transaction that commits on success and rolls back on error.
+
+        Nested transaction() blocks on the same thread become savepoints of the outer one.
+        """
+        with self.connection() as conn:
+            local = self._local
+            depth = local.tx_depth
+            if depth == 0:
+                conn.execute(f"BEGIN {mode}")
+            else:
+                conn.execute(f"SAVEPOINT sp{depth}")
+            local.tx_depth = depth + 1
+            try:
+                yield conn
+            except BaseException:
+                if depth == 0:
+                    conn.rollback()
+                else:
+                    conn.execute(f"ROLLBACK TO sp{depth}")
+                    conn.execute(f"RELEASE sp{depth}")
+                raise
+            else:
+                if depth == 0:
+                    conn.commit()
+                else:
+                    conn.execute(f"RELEASE sp{depth}")
+            finally:
+                local.tx_depth = depth
+
+    def health_check(self):
+        """ Ping every idle connection, dropping the broken ones. Returns the number kept. """
+        with self._cond:
+            idle, self._idle = self._idle, []
+        healthy = []
+        for conn, last_used in idle:
+            if self._is_healthy(conn):
+                healthy.append((conn, last_used))
+            else:
+                conn.close()
+        with self._cond:
+            self._created -= len(idle) - len(healthy)
+            self._idle.extend(healthy)
+            self._cond.notify_all()
+        return len(healthy)
+
+    def stats(self):
+        with self._cond:
+            return {"size": self.size, "open": self._created, "idle": len(self._idle)}
+
+    def close(self):
+        """ Close idle connections; connections still checked out are closed on return """
+        with self._cond:
+            self.closed = True
+            for conn, _ in self._idle:
+                try:
+                    # Let SQLite refresh the planner statistics the indexes depend on
+                    conn.execute("PRAGMA optimize")
+                except sqlite3.Error:
+                    pass
+                conn.close()
+            self._created -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_file, **options):
+    """ Return the shared pool for db_file, creating it with the given options on first use """
+    key = db_file if db_file == ":memory:" else os.path.abspath(db_file)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.closed:
+            pool = _pools[key] = ConnectionPool(db_file, **options)
+        return pool
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -1,6 +1,85 @@
 import sqlite3
 import os
 from datetime import datetime, timedelta
+from connection import get_pool
+from habit_cache import habit_cache, habits_key
+from instrumentation import instrumented
+from compaction import COMPACTION_SCHEMA
+from history import DEFAULT_BATCH_SIZE, iter_checkins
+from rollups import create_rollup_tables
+from search import create_search_index
+from streaks import create_streak_table, recreate_streak_table
+from timekeys import add_period_keys, server_offset
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT NOT NULL,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+    '''CREATE TABLE IF NOT EXISTS habits (
+            user_id INTEGER NOT NULL,
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL,
+            periodicity TEXT NOT NULL,
+            creation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )''',
+    '''CREATE TABLE IF NOT EXISTS habit_tracking (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            habit_id INTEGER NOT NULL,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (habit_id) REFERENCES habits(id)
+        )''',
+    '''CREATE TABLE IF NOT EXISTS habit_type (
+            id INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            frequency INTEGER NOT NULL
+        )''',
+]
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_habits_user_name ON habits (user_id, name)",
+    "CREATE INDEX IF NOT EXISTS idx_habits_name ON habits (name)",
+    "CREATE INDEX IF NOT EXISTS idx_habit_tracking_habit_checked ON habit_tracking (habit_id, checked_at)",
+    "CREATE INDEX IF NOT EXISTS idx_habit_tracking_checked ON habit_tracking (checked_at, habit_id)",
+]
+
+# Habit names are looked up with COLLATE NOCASE, which only idx_habits_user_name_nocase
+# (search.py) can serve, so the BINARY name indexes only slowed down writes
+DROP_NAME_INDEXES = [
+    "DROP INDEX IF EXISTS idx_habits_user_name",
+    "DROP INDEX IF EXISTS idx_habits_name",
+]
+
+
+def _add_habits_user_id(conn):
+    """ Databases created before habits.user_id existed get the column added once """
+    columns = [col[1] for col in conn.execute("PRAGMA table_info(habits)")]
+    if 'user_id' not in columns:
+        conn.execute("ALTER TABLE habits ADD COLUMN user_id INTEGER")
+
+
+# Ordered (version, description, steps) triples. steps is a list of SQL statements or a
+# callable taking the connection; every step must be safe to run against a database that
+# already has the change, since databases older than schema_version may have parts of it.
+MIGRATIONS = [
+    (1, "Create base tables", SCHEMA),
+    (2, "Ensure habits.user_id exists", _add_habits_user_id),
+    (3, "Add lookup and range indexes", INDEXES),
+    (4, "Materialize habit streaks", create_streak_table),
+    (5, "Count streaks in day/week periods", recreate_streak_table),
+    (6, "Daily and weekly check-in rollups", create_rollup_tables),
+    (7, "Full-text habit search", create_search_index),
+    (8, "UTC offsets and period keys on check-ins", add_period_keys),
+    (9, "Per-day counts of compacted check-ins", COMPACTION_SCHEMA),
+    (10, "Drop the case-sensitive habit name indexes", DROP_NAME_INDEXES),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
 
 
 def generate_tracking_dates(periodicity):
@@ -22,65 +101,84 @@ def close_connection(conn):
         conn.close()
 
 
+@instrumented
 class Database:
     def __init__(self, db_file):
         self.db_file = db_file
+        self.pool = get_pool(db_file)
 
     def execute(self, sql):
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        conn.commit()
-        conn.close()
+        with self.pool.transaction() as conn:
+            conn.execute(sql)
+
+    def migrate(self):
+        """ Apply pending migrations in order and return the resulting schema version """
+        with self.pool.transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                                version INTEGER PRIMARY KEY,
+                                description TEXT NOT NULL,
+                                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                            )''')
+            version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+            for number, description, steps in MIGRATIONS:
+                if number <= version:
+                    continue
+                if callable(steps):
+                    steps(conn)
+                else:
+                    for sql in steps:
+                        conn.execute(sql)
+                conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                             (number, description))
+                version = number
+        return version
+
+    def schema_version(self):
+        """ The applied schema version, read without taking the write lock; 0 for a new database """
+        with self.pool.connection() as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='schema_version'").fetchone()
+            if exists is None:
+                return 0
+            return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+    def ensure_schema(self):
+        """ Migrate only if the schema is behind; returns the version found, 0 for a database without
+        schema_version, which may still hold the tables and data of the first releases """
+        version = self.schema_version()
+        if version < LATEST_VERSION:
+            self.migrate()
+        return version
+
+    def is_empty(self):
+        """ True if the database has no users and no habits, or not even their tables """
+        with self.pool.connection() as conn:
+            for table in ("users", "habits"):
+                exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+                if exists is not None and conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]:
+                    return False
+        return True
 
     def initialize_database(self):
         try:
             if os.path.exists(self.db_file):
                 print("Database file already exists. Deleting existing data...")
 
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-
-            cursor.execute("DELETE FROM habit_tracking")
-            cursor.execute("DELETE FROM habit_type")
-            cursor.execute("DELETE FROM habits")
-            cursor.execute("DELETE FROM users")
-
-            # Create tables if they don't exist
-            cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                    email TEXT NOT NULL,
-                                    username TEXT NOT NULL,
-                                    password TEXT NOT NULL,
-                                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                                )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS habits (
-                       user_id INTEGER NOT NULL,
-                       id INTEGER PRIMARY KEY AUTOINCREMENT,
-                       name TEXT NOT NULL,
-                       description TEXT NOT NULL,
-                       periodicity TEXT NOT NULL,
-                       creation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                       FOREIGN KEY (user_id) REFERENCES users(id)
-                   )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS habit_tracking (
-                                   id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                   habit_id INTEGER NOT NULL,
-                                   checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                   FOREIGN KEY (habit_id) REFERENCES habits(id)
-                               )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS habit_type (
-                                   id INTEGER PRIMARY KEY,
-                                   description TEXT NOT NULL,
-                                   frequency INTEGER NOT NULL
-                                )''')
-
-            # Commit changes and close connection
-            conn.commit()
-            conn.close()
+            # Create or upgrade the tables before clearing them
+            self.migrate()
+
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("DELETE FROM habit_tracking")
+                # Compacted check-ins are counted in the rollups but have no rows to delete
+                for table in ("habit_checkin_days", "habit_daily_counts", "habit_weekly_counts",
+                              "habit_checkin_totals"):
+                    cursor.execute(f"DELETE FROM {table}")
+                cursor.execute("DELETE FROM habit_type")
+                cursor.execute("DELETE FROM habits")
+                cursor.execute("DELETE FROM users")
+            habit_cache(self.pool).clear()
 
             return "Database initialized successfully"
         except sqlite3.Error as e:
@@ -90,84 +188,95 @@ class Database:
         """ Add admin user, add habit types: daily, weekly, add 6 habits for admin user"""
         try:
             # Check if data already exists
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM users")
-            count = cursor.fetchone()[0]
-
-            if count > 0:
-                print("Data already exists in the tables. Skipping population.")
-                return
-
-            # Insert admin user
-            sql = '''INSERT INTO users(email,username,password,created_at)
-                     VALUES('admin@gmail.com','admin','admin',strftime('%s','now'));'''
-            cursor.execute(sql)
-
-            # Insert habit types
-            sql = '''INSERT INTO habit_type(id,description,frequency)
-                     VALUES(1,'daily',1);'''
-            cursor.execute(sql)
-            sql = '''INSERT INTO habit_type(id,description,frequency)
-                     VALUES(2,'weekly',7);'''
-            cursor.execute(sql)
-
-            # Insert habits
-            habit_data = [
-                ('Drink 1 lt of water', 'Drink 1 liter of water every day', 1),
-                ('Walk 30 minutes', 'Walk 30 minutes every day', 1),
-                ('Read 20 pages', 'Read 20 pages of a book every day', 1),
-                ('Go to the pub', 'Go to the pub with friends every week', 2),
-                ('Swim', 'Swim every week', 2),
-                ('Have a shower', 'Have a shower every day', 1)
-            ]
-
-            for name, description, periodicity in habit_data:
-                cursor.execute('''INSERT INTO habits(name, description, creation_date, user_id, periodicity)
-                                  VALUES(1, ?,?, ?, strftime('%s','now'))''',
-                               (name, description, periodicity))
-
-                # Get the habit_id of the inserted habit
-                habit_id = cursor.lastrowid
-
-                # Generate predefined tracking data for each habit
-                tracking_dates = generate_tracking_dates(periodicity)
-                for checked_at in tracking_dates:
-                    cursor.execute('''INSERT INTO habit_tracking (habit_id, checked_at)
-                                      VALUES(?, ?)''',
-                                   (habit_id, checked_at))
-
-            conn.commit()
-            conn.close()
+            with self.pool.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT COUNT(*) FROM users")
+                count = cursor.fetchone()[0]
+
+                if count > 0:
+                    print("Data already exists in the tables. Skipping population.")
+                    return
+
+                # Insert admin user
+                sql = '''INSERT INTO users(email,username,password,created_at)
+                         VALUES('admin@gmail.com','admin','admin',CURRENT_TIMESTAMP);'''
+                cursor.execute(sql)
+
+                # Insert habit types
+                sql = '''INSERT INTO habit_type(id,description,frequency)
+                         VALUES(1,'daily',1);'''
+                cursor.execute(sql)
+                sql = '''INSERT INTO habit_type(id,description,frequency)
+                         VALUES(2,'weekly',7);'''
+                cursor.execute(sql)
+
+                # Insert habits
+                habit_data = [
+                    ('Drink 1 lt of water', 'Drink 1 liter of water every day', 1),
+                    ('Walk 30 minutes', 'Walk 30 minutes every day', 1),
+                    ('Read 20 pages', 'Read 20 pages of a book every day', 1),
+                    ('Go to the pub', 'Go to the pub with friends every week', 2),
+                    ('Swim', 'Swim every week', 2),
+                    ('Have a shower', 'Have a shower every day', 1)
+                ]
+
+                for name, description, periodicity in habit_data:
+                    cursor.execute('''INSERT INTO habits(user_id, name, description, periodicity, creation_date)
+                                      VALUES(1, ?, ?, ?, CURRENT_TIMESTAMP)''',
+                                   (name, description, "daily" if periodicity == 1 else "weekly"))
+
+                    # Get the habit_id of the inserted habit
+                    habit_id = cursor.lastrowid
+
+                    # Generate predefined tracking data for each habit
+                    tracking_dates = generate_tracking_dates(periodicity)
+                    for checked_at in tracking_dates:
+                        cursor.execute('''INSERT INTO habit_tracking (habit_id, checked_at, utc_offset)
+                                          VALUES(?, ?, ?)''',
+                                       (habit_id, checked_at, server_offset(checked_at)))
+            habit_cache(self.pool).clear()
 
             print("Tables populated successfully.")
         except sqlite3.Error as e:
             print(f"Error populating tables: {e}")
 
+    def create_habits(self, user_id, habits):
+        """ Add (name, description, periodicity) habits for a user in a single transaction """
+        try:
+            with self.pool.transaction() as conn:
+                conn.executemany("INSERT INTO habits (user_id, name, description, periodicity, creation_date) "
+                                 "VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+                                 [(user_id,) + tuple(habit) for habit in habits])
+            habit_cache(self.pool).invalidate(lambda key: key[1] in (user_id, None))
+            return "Habits created successfully"
+        except sqlite3.Error as e:
+            return f"Error creating habits: {e}"
+
     def get_habits_by_user_id(self, user_id):
+        def load():
+            with self.pool.connection() as conn:
+                return tuple(conn.execute("SELECT * FROM habits WHERE user_id=?", (user_id,)))
+
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM habits WHERE user_id=?", (user_id,))
-            habits = cursor.fetchall()
-            conn.close()
-            return habits
+            return list(habit_cache(self.pool).get_or_load(habits_key(user_id), load))
         except sqlite3.Error as e:
             print(f"Error getting habits by user ID: {e}")
             return []
 
     def get_habit_tracking_by_habit_id(self, habit_id):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM habit_tracking WHERE habit_id=?", (habit_id,))
-            tracking = cursor.fetchall()
-            conn.close()
-            return tracking
+            with self.pool.connection() as conn:
+                cursor = conn.execute("SELECT id, habit_id, checked_at FROM habit_tracking WHERE habit_id=?", (habit_id,))
+                return cursor.fetchall()
         except sqlite3.Error as e:
             print(f"Error getting habit tracking by habit ID: {e}")
             return []
 
+    def iter_habit_tracking(self, habit_id=None, batch_size=DEFAULT_BATCH_SIZE, after=None, records=False):
+        """ Stream check-ins, of one habit or all of them, in (habit_id, checked_at, id) order.
+        See history.iter_checkin_batches. """
+        return iter_checkins(self.pool, habit_id, batch_size, after, records)
+
     def create_connection(self):
         """ Create a database connection to the SQLite database specified by db_file """
         try:
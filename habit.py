@@ -1,8 +1,15 @@
 import sqlite3
-from datetime import datetime, timedelta
+from array import array
+from bisect import insort
+from datetime import datetime
+from connection import get_pool
+from habit_cache import invalidate_habit
+from habit_calendar import HabitCalendar, PERIODICITIES, from_epoch_seconds, to_epoch_seconds
 
 
 class User:
+    __slots__ = ("user_id", "email", "username", "password", "created_at", "habits", "_habits_by_name")
+
     def __init__(self, user_id, email, username, password, created_at):
         self.user_id = user_id
         self.email = email
@@ -10,95 +17,97 @@ class User:
         self.password = password
         self.created_at = created_at
         self.habits = []
+        # name -> first added habit with that name, so lookups by name need not scan the list
+        self._habits_by_name = {}
 
     def add_habit(self, habit):
         self.habits.append(habit)
+        self._habits_by_name.setdefault(habit.name, habit)
 
     def remove_habit(self, habit):
         self.habits.remove(habit)
+        if self._habits_by_name.get(habit.name) is habit:
+            del self._habits_by_name[habit.name]
+            for other in self.habits:
+                if other.name == habit.name:
+                    self._habits_by_name[habit.name] = other
+                    break
+
+    def get_habit(self, name):
+        return self._habits_by_name.get(name)
 
     def get_all_habits(self):
         return self.habits
 
 
 class Habit:
+    """ A habit and its check-ins.
+
+    Check-ins are kept in `checkins`, an array of epoch seconds sorted on insert, rather
+    than as a list of strings; `tracking_data` reads and replaces them as datetimes.
+    """
+    __slots__ = ("user_id", "name", "description", "periodicity", "creation_date", "db_file", "checkins")
+
     def __init__(self, user_id,  name, description, periodicity, db_file):
         self.user_id = user_id
         self.name = name
         self.description = description
         self.periodicity = periodicity
         self.creation_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.tracking_data = []
+        self.checkins = array('q')
         self.db_file = db_file
 
-    def create_habit(self, user_id, name, description, periodicity):
-        try:
-            # Connect to the database
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
+    @property
+    def tracking_data(self):
+        return [from_epoch_seconds(second) for second in self.checkins]
 
-            # Ensure that the 'user_id' column exists in the 'habits' table
-            cursor.execute("PRAGMA table_info(habits)")
-            columns = [col[1] for col in cursor.fetchall()]
-            if 'user_id' not in columns:
-                cursor.execute("ALTER TABLE habits ADD COLUMN user_id INTEGER")
+    @tracking_data.setter
+    def tracking_data(self, checkins):
+        self.checkins = array('q', sorted(to_epoch_seconds(checked_at) for checked_at in checkins or ()))
 
-            # Insert the habit into the database
-            cursor.execute("INSERT INTO habits (user_id, name, description, periodicity, creation_date) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
-                           (user_id, name, description, periodicity))
+    def add_checkin(self, checked_at):
+        """ Record a check-in given as a datetime, date or ISO formatted string """
+        second = to_epoch_seconds(checked_at)
+        checkins = self.checkins
+        if not checkins or second >= checkins[-1]:
+            checkins.append(second)
+        else:
+            insort(checkins, second)
 
-            # Commit the transaction and close the connection
-            conn.commit()
-            conn.close()
+    def create_habit(self, user_id, name, description, periodicity):
+        try:
+            with get_pool(self.db_file).transaction() as conn:
+                # Insert the habit into the database
+                conn.execute("INSERT INTO habits (user_id, name, description, periodicity, creation_date) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+                             (user_id, name, description, periodicity))
+            invalidate_habit(get_pool(self.db_file), name, user_id)
 
             return "Habit created successfully"
         except sqlite3.Error as e:
             return f"Error creating habit: {e}"
 
     def check_off_task(self):
-        completed_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.tracking_data.append(completed_time)
+        self.add_checkin(datetime.now())
 
-    def calculate_habit_streak(self):
-        if not self.tracking_data:
-            return 0
-
-        self.tracking_data.sort()
-        current_streak = 1
-        longest_streak = 1
-
-        for i in range(1, len(self.tracking_data)):
-            time_diff = datetime.strptime(self.tracking_data[i], '%Y-%m-%d %H:%M:%S') - \
-                        datetime.strptime(self.tracking_data[i - 1], '%Y-%m-%d %H:%M:%S')
-
-            if time_diff == timedelta(days=1) or time_diff == timedelta(weeks=1):
-                current_streak += 1
-            else:
-                current_streak = 1
+    def calendar(self):
+        return HabitCalendar.from_epoch_seconds(self.periodicity, self.checkins)
 
-            if current_streak > longest_streak:
-                longest_streak = current_streak
-
-        return longest_streak
+    def calculate_habit_streak(self):
+        """ Longest run of consecutive days (daily habits) or weeks (weekly habits) with a check-in """
+        return self.calendar().longest_streak()
 
     def retrieve_tracking_data(self):
         return self.tracking_data
 
     def check_habit_status(self):
-        if not self.tracking_data:
+        if not self.checkins:
             return "No tracking data available"
 
-        last_tracking_date = datetime.strptime(self.tracking_data[-1], '%Y-%m-%d %H:%M:%S')
-        time_since_last_tracking = datetime.now() - last_tracking_date
-
-        if self.periodicity == "daily":
-            periodicity_days = 1
-        elif self.periodicity == "weekly":
-            periodicity_days = 7
-        else:
+        if self.periodicity not in PERIODICITIES:
             return "Invalid periodicity"
 
-        if time_since_last_tracking <= timedelta(days=periodicity_days):
+        # The streak survives as long as the current or the previous period was checked off
+        if self.calendar().is_on_track():
             return "Habit is on track"
         else:
             return "Habit needs to be tracked"
@@ -113,16 +122,15 @@ class Habit:
 
     def delete_habit(self):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM habits WHERE name=?", (self.name,))
-            conn.commit()
-            conn.close()
+            pool = get_pool(self.db_file)
+            with pool.transaction() as conn:
+                conn.execute("DELETE FROM habits WHERE user_id=? AND name=? COLLATE NOCASE", (self.user_id, self.name))
+            invalidate_habit(pool, self.name, self.user_id)
             self.name = None
             self.description = None
             self.periodicity = None
             self.creation_date = None
-            self.tracking_data = None
+            self.checkins = array('q')
             return "Habit deleted successfully"
         except sqlite3.Error as e:
             return f"Error deleting habit: {e}"
@@ -0,0 +1,125 @@
+""" Read-through cache for habit definitions.
+
+Habits are read on every menu choice but rarely change, so HabitTracker and Database
+keep the rows of get_habit_info, get_all_habits and get_habits_by_user_id in an LRU
+cache shared by everything that uses the same connection pool. Entries expire after a
+TTL and every write to the habits table invalidates the entries it could have changed.
+"""
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = 1024
+DEFAULT_TTL = 60.0
+
+
+class LRUCache:
+    """ A thread-safe mapping bounded to maxsize entries that each live for ttl seconds """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        """ Return the cached value for key, calling loader() to fill it on a miss.
+
+        The loader runs outside the lock; its result is only stored if nothing was
+        invalidated meanwhile, so a slow read can never re-insert a value a concurrent
+        write has already made stale.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            generation = self._generation
+
+        value = loader()
+
+        with self._lock:
+            if generation == self._generation and self.maxsize > 0:
+                self._entries[key] = (value, self.clock() + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, predicate):
+        """ Drop every entry whose key matches predicate. Returns the number dropped. """
+        with self._lock:
+            self._generation += 1
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions, "expirations": self.expirations}
+
+
+def _fold(name):
+    """ Habit names compare like SQLite's NOCASE collation: ASCII letters ignore case, others do not """
+    return name.encode().lower().decode() if isinstance(name, str) else name
+
+
+def habit_key(user_id, name):
+    return ("habit", user_id, _fold(name))
+
+
+def habits_key(user_id):
+    """ Key of a user's habit list; user_id None stands for the habits of every user """
+    return ("habits", user_id)
+
+
+def invalidate_habit(pool, name, user_id=None):
+    """ Drop the cached rows a write to habit `name` may have changed.
+
+    Writes that select habits by name alone (user_id None) may touch any user's habit,
+    so they drop that name for every user and every cached habit list.
+    """
+    def affected(key):
+        if key[0] == "habit":
+            return key[2] == _fold(name) and (user_id is None or key[1] == user_id)
+        return user_id is None or key[1] in (user_id, None)
+
+    return habit_cache(pool).invalidate(affected)
+
+
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def habit_cache(pool, **options):
+    """ Return the habit cache shared by users of pool, creating it with the given options on first use """
+    with _caches_lock:
+        cache = _caches.get(pool)
+        if cache is None:
+            cache = _caches[pool] = LRUCache(**options)
+        return cache
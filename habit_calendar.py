@@ -0,0 +1,191 @@
+""" Per-habit calendars with one bit per period.
+
+Daily habits are bucketed by calendar day and weekly habits by Monday-based (ISO) week,
+both numbered from 1970-01-01. A habit's calendar is a Python int used as a bitmap whose
+bit i stands for period origin + i, so streak, "on track" and completion queries are bit
+operations over memory proportional to the number of periods, however many times a habit
+was checked in within each of them.
+"""
+from datetime import date, datetime, timedelta
+
+EPOCH = date(1970, 1, 1)
+_EPOCH_DATETIME = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+DAILY = "daily"
+WEEKLY = "weekly"
+
+# Habits store their periodicity as 'daily'/'weekly' or as the habit_type ids 1/2
+PERIODICITIES = {"daily": DAILY, "weekly": WEEKLY, 1: DAILY, 2: WEEKLY, "1": DAILY, "2": WEEKLY}
+
+
+def is_weekly(periodicity):
+    return PERIODICITIES.get(periodicity) == WEEKLY
+
+
+def to_datetime(value):
+    """ Accept check-ins as datetimes, dates or ISO formatted strings """
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        return datetime.combine(value, datetime.min.time())
+    return value
+
+
+def to_epoch_seconds(value):
+    """ Whole seconds between 1970-01-01 00:00 and a naive check-in time """
+    return (to_datetime(value) - _EPOCH_DATETIME) // _SECOND
+
+
+def from_epoch_seconds(seconds):
+    return _EPOCH_DATETIME + timedelta(seconds=seconds)
+
+
+def period_ordinal(checked_at, periodicity):
+    """ Number of the day, or of the Monday-based week, containing checked_at since 1970-01-01 """
+    day = (to_datetime(checked_at).date() - EPOCH).days
+    return (day + 3) // 7 if is_weekly(periodicity) else day
+
+
+def epoch_period(second, periodicity):
+    """ period_ordinal of a check-in given as epoch seconds """
+    day = second // 86400
+    return (day + 3) // 7 if is_weekly(periodicity) else day
+
+
+def period_start(ordinal, periodicity):
+    """ First day of the period numbered by period_ordinal """
+    return EPOCH + timedelta(days=ordinal * 7 - 3 if is_weekly(periodicity) else ordinal)
+
+
+class HabitCalendar:
+    """ The set of periods in which a habit was checked in at least once """
+
+    def __init__(self, periodicity, checkins=()):
+        self.periodicity = WEEKLY if is_weekly(periodicity) else DAILY
+        self.origin = 0
+        self.bits = 0
+        for checked_at in checkins:
+            self.add(checked_at)
+
+    @classmethod
+    def from_epoch_seconds(cls, periodicity, seconds):
+        """ Build a calendar from sorted check-ins given as epoch seconds, e.g. Habit.checkins """
+        calendar = cls(periodicity)
+        if not seconds:
+            return calendar
+        weekly = calendar.periodicity == WEEKLY
+        origin = epoch_period(seconds[0], calendar.periodicity)
+        bitmap = bytearray((epoch_period(seconds[-1], calendar.periodicity) - origin) // 8 + 1)
+        # Setting bits in a bytearray and converting once avoids building a new int per check-in
+        for second in seconds:
+            offset = second // 86400
+            if weekly:
+                offset = (offset + 3) // 7
+            offset -= origin
+            bitmap[offset >> 3] |= 1 << (offset & 7)
+        calendar.origin = origin
+        calendar.bits = int.from_bytes(bitmap, "little")
+        return calendar
+
+    @classmethod
+    def from_periods(cls, periodicity, ordinals):
+        """ Build a calendar from period ordinals in any order, duplicates allowed """
+        calendar = cls(periodicity)
+        ordinals = list(ordinals)
+        if not ordinals:
+            return calendar
+        origin = min(ordinals)
+        bitmap = bytearray((max(ordinals) - origin) // 8 + 1)
+        for ordinal in ordinals:
+            offset = ordinal - origin
+            bitmap[offset >> 3] |= 1 << (offset & 7)
+        calendar.origin = origin
+        calendar.bits = int.from_bytes(bitmap, "little")
+        return calendar
+
+    def add(self, checked_at):
+        self.add_period(period_ordinal(checked_at, self.periodicity))
+
+    def add_period(self, ordinal):
+        if not self.bits:
+            self.origin = ordinal
+        elif ordinal < self.origin:
+            self.bits <<= self.origin - ordinal
+            self.origin = ordinal
+        self.bits |= 1 << (ordinal - self.origin)
+
+    def __len__(self):
+        return bin(self.bits).count("1")
+
+    def __contains__(self, checked_at):
+        offset = period_ordinal(checked_at, self.periodicity) - self.origin
+        return offset >= 0 and bool(self.bits >> offset & 1)
+
+    def periods(self):
+        """ Yield the ordinals of the checked periods in order """
+        bits, ordinal = self.bits, self.origin
+        while bits:
+            skip = (bits & -bits).bit_length() - 1
+            bits >>= skip + 1
+            ordinal += skip
+            yield ordinal
+            ordinal += 1
+
+    @property
+    def first_period(self):
+        return self.origin if self.bits else None
+
+    @property
+    def last_period(self):
+        return self.origin + self.bits.bit_length() - 1 if self.bits else None
+
+    def longest_run(self):
+        """ (length, first period) of the longest run of consecutive periods, earliest on ties """
+        runs, length = self.bits, 0
+        while True:
+            # Bit i of `longer` is set when periods i .. i + length are all checked
+            longer = runs & (runs >> 1)
+            length += 1
+            if not longer:
+                break
+            runs = longer
+        if not self.bits:
+            return 0, None
+        return length, self.origin + (runs & -runs).bit_length() - 1
+
+    def current_run(self):
+        """ (length, first period) of the run that ends at the last checked period """
+        if not self.bits:
+            return 0, None
+        top = self.bits.bit_length() - 1
+        gaps = ~self.bits & ((1 << top) - 1)
+        start = gaps.bit_length()
+        return top - start + 1, self.origin + start
+
+    def longest_streak(self):
+        return self.longest_run()[0]
+
+    def current_streak(self, as_of=None):
+        """ Length of the streak still alive at as_of: it may end in the current or previous period """
+        if not self.is_on_track(as_of):
+            return 0
+        return self.current_run()[0]
+
+    def is_on_track(self, as_of=None):
+        """ Whether the habit was checked in during the period containing as_of or the one before """
+        if not self.bits:
+            return False
+        now = period_ordinal(as_of or datetime.now(), self.periodicity)
+        return self.last_period >= now - 1
+
+    def completion_rate(self, start=None, end=None):
+        """ Share of periods between start and end (default: first to last check-in) that were checked """
+        if not self.bits:
+            return 0.0
+        first = self.first_period if start is None else period_ordinal(start, self.periodicity)
+        last = self.last_period if end is None else period_ordinal(end, self.periodicity)
+        if last < first:
+            return 0.0
+        low, high = max(first, self.origin) - self.origin, last - self.origin
+        checked = bin((self.bits >> low) & ((1 << (high - low + 1)) - 1)).count("1") if high >= low else 0
+        return checked / (last - first + 1)
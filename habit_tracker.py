@@ -1,56 +1,108 @@
 import sqlite3
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from itertools import islice
 from database import Database
 from habit import Habit
+from connection import get_pool
+from habit_cache import habit_cache, habit_key, habits_key, invalidate_habit
+from instrumentation import instrumented
+from history import DEFAULT_BATCH_SIZE, iter_checkins, iter_habits
+from habit_calendar import HabitCalendar, period_start
+from rollups import rank_habits
+from search import search_habits
+from streaks import StreakSummary, refresh_stale_streaks
+from timekeys import local_time, parse_time, user_offsets
 
 
+def _is_record(record):
+    """ Whether a bulk check-in is a (user_id, habit, checked_at) triple with a user and habit to look up """
+    return (isinstance(record, (tuple, list)) and len(record) == 3
+            and isinstance(record[0], (int, str)) and isinstance(record[1], (int, str)))
+
+
+def _period_datetime(ordinal, periodicity):
+    """ The datetime at which a habit_calendar period starts """
+    if ordinal is None:
+        return None
+    return datetime.combine(period_start(ordinal, periodicity), datetime.min.time())
+
+
+@instrumented
 class HabitTracker:
-    def __init__(self, user_id, db_file):
+    def __init__(self, user_id, db_file, writer=None, replica=None):
+        """ writer, an optional checkin_writer.CheckinWriter, group-commits mark_habit_as_done check-ins;
+        replica, an optional replica.ReadReplica of db_file, serves the rankings and longest streaks """
         self.user_id = user_id
         self.db_file = db_file
+        self.pool = get_pool(db_file)
+        self.cache = habit_cache(self.pool)
+        self.writer = writer
+        self.replica = replica
+
+    @contextmanager
+    def _analytics_connection(self, streaks=False):
+        """ The replica's snapshot if there is one, else a pooled connection, after rebuilding the stale
+        streaks if the reads need them """
+        if self.replica is not None:
+            with self.replica.connection() as conn:
+                yield conn
+            return
+        if streaks:
+            refresh_stale_streaks(self.pool)
+        with self.pool.connection() as conn:
+            yield conn
 
     def get_habit_tracking_by_id(self, habit_id):
-        query = "SELECT * FROM habit_tracking WHERE habit_id = ?"
-        parameters = (habit_id,)
+        query = ("SELECT t.id, t.habit_id, t.checked_at FROM habit_tracking t JOIN habits h ON h.id = t.habit_id "
+                 "WHERE t.habit_id = ? AND h.user_id = ?")
+        parameters = (habit_id, self.user_id)
         return self._execute_query(query, parameters)
 
+    def iter_habit_tracking_by_id(self, habit_id, batch_size=DEFAULT_BATCH_SIZE, after=None, records=False):
+        """ Stream a habit's check-ins in checked_at order, batch_size rows per query; nothing
+        when the habit belongs to another user """
+        with self.pool.connection() as conn:
+            owned = conn.execute("SELECT 1 FROM habits WHERE id = ? AND user_id = ?",
+                                 (habit_id, self.user_id)).fetchone()
+        if owned is None:
+            return iter(())
+        return iter_checkins(self.pool, habit_id, batch_size, after, records)
+
     def _execute_query(self, query, parameters=None):
-        conn = None
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            if parameters:
-                cursor.execute(query, parameters)
-            else:
-                cursor.execute(query)
-            return cursor.fetchall()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                if parameters:
+                    cursor.execute(query, parameters)
+                else:
+                    cursor.execute(query)
+                return cursor.fetchall()
         except sqlite3.Error as e:
             print(f"Error executing query: {e}")
             return None
-        finally:
-            if conn:
-                conn.close()
 
     def create_habit(self, user_id, name, description, periodicity):
+        if user_id != self.user_id:
+            return f"Error creating habit: user {user_id} is not the tracker's user"
         habit = Habit(user_id, name, description, periodicity, self.db_file)
         return habit.create_habit(user_id, name, description, periodicity)
 
     def get_habit_info(self, name):
+        def load():
+            with self.pool.connection() as conn:
+                cursor = conn.execute(
+                    "SELECT id, user_id, name, description, periodicity, creation_date FROM habits WHERE user_id=? AND name=? COLLATE NOCASE",
+                    (self.user_id, name))
+                return cursor.fetchone()
+
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, user_id, name, description, periodicity, creation_date FROM habits WHERE name=?",
-                           (name,))
-            habit_info = cursor.fetchone()
-            conn.close()
-            return habit_info
+            return self.cache.get_or_load(habit_key(self.user_id, name), load)
         except sqlite3.Error as e:
             return f"Error getting habit info: {e}"
 
     def update_habit(self, name, new_name=None, new_description=None, new_periodicity=None):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
             update_query = "UPDATE habits SET"
             update_values = []
             if new_name:
@@ -63,161 +115,274 @@ class HabitTracker:
                 update_query += " periodicity=?,"
                 update_values.append(new_periodicity)
             # Remove the trailing comma and add the condition for the WHERE clause
-            update_query = update_query.rstrip(",") + " WHERE name=?"
-            update_values.append(name)
-            cursor.execute(update_query, tuple(update_values))
-            conn.commit()
-            conn.close()
+            update_query = update_query.rstrip(",") + " WHERE user_id=? AND name=? COLLATE NOCASE"
+            update_values.extend((self.user_id, name))
+            with self.pool.transaction() as conn:
+                conn.execute(update_query, tuple(update_values))
+            invalidate_habit(self.pool, name, self.user_id)
+            if new_name:
+                invalidate_habit(self.pool, new_name, self.user_id)
             return "Habit updated successfully"
         except sqlite3.Error as e:
             return f"Error updating habit: {e}"
 
     def remove_habit(self, name):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM habits WHERE name=?", (name,))
-            conn.commit()
-            conn.close()
+            with self.pool.transaction() as conn:
+                conn.execute("DELETE FROM habits WHERE user_id=? AND name=? COLLATE NOCASE", (self.user_id, name))
+            invalidate_habit(self.pool, name, self.user_id)
             return "Habit removed successfully"
         except sqlite3.Error as e:
             return f"Error removing habit: {e}"
 
     def get_all_habits(self):
+        def load():
+            with self.pool.connection() as conn:
+                return tuple(conn.execute("SELECT * FROM habits WHERE user_id=?", (self.user_id,)))
+
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM habits")
-            all_habits = cursor.fetchall()
-            conn.close()
-            return all_habits
+            # Hand out a fresh list so callers cannot modify the cached rows
+            return list(self.cache.get_or_load(habits_key(self.user_id), load))
         except sqlite3.Error as e:
             return f"Error getting all habits: {e}"
 
+    def iter_all_habits(self, batch_size=DEFAULT_BATCH_SIZE, records=False):
+        """ Stream the user's habits in id order without loading, or caching, them all """
+        return iter_habits(self.pool, self.user_id, batch_size=batch_size, records=records)
+
+    def search_habits(self, text, limit=10):
+        """ The user's habits whose name or description matches text, best first, as search.SearchResult
+        tuples; words match as case-insensitive prefixes, with a fuzzy retry when nothing matches """
+        try:
+            with self.pool.connection() as conn:
+                return search_habits(conn, self.user_id, text, limit)
+        except sqlite3.Error as e:
+            return f"Error searching habits: {e}"
+
     def mark_habit_as_done(self, user_id, name):
+        if self.writer is not None:
+            return self.writer.mark_habit_as_done(self.user_id, name)
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute("INSERT INTO habit_tracking (habit_id, checked_at) "
-                           "SELECT id, ? FROM habits WHERE name=? AND user_id=?",
-                           (current_time, name, self.user_id))
-            conn.commit()
-            conn.close()
+            with self.pool.transaction() as conn:
+                checked_at, utc_offset = local_time(None, user_offsets(conn, [self.user_id])[self.user_id])
+                conn.execute("INSERT INTO habit_tracking (habit_id, checked_at, utc_offset) "
+                             "SELECT id, ?, ? FROM habits WHERE user_id=? AND name=? COLLATE NOCASE",
+                             (checked_at, utc_offset, self.user_id, name))
             return "Habit marked as done successfully"
         except sqlite3.Error as e:
             return f"Error marking habit as done: {e}"
 
+    def mark_habits_done_bulk(self, records, chunk_size=500):
+        """ Record many check-ins, writing each chunk in a single transaction.
+
+        Args:
+            records (iterable): (user_id, habit, checked_at) tuples. habit is a habit name or id and
+                checked_at a datetime, an ISO formatted string or None for the current time; naive
+                times are the user's local time (see timekeys.local_time).
+            chunk_size (int): Number of check-ins written per transaction.
+
+        Returns:
+            dict: "inserted", the number of rows written, and "rejected", a list of
+            (record, reason) pairs for the records that were skipped. A chunk whose
+            transaction fails is rolled back and its records are rejected with the error.
+
+        """
+        inserted = 0
+        rejected = []
+        habit_ids = {}
+        offsets = {}
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            chunk_rejected = []
+            try:
+                with self.pool.transaction() as conn:
+                    self._resolve_habit_ids(conn, chunk, habit_ids)
+                    checkins = []
+                    for record in chunk:
+                        if not _is_record(record):
+                            chunk_rejected.append((record, "Malformed record"))
+                            continue
+                        user_id, habit, checked_at = record
+                        habit_id = habit_ids.get((user_id, habit))
+                        if habit_id is None:
+                            chunk_rejected.append((record, "Unknown habit"))
+                            continue
+                        try:
+                            checkins.append((habit_id, user_id, parse_time(checked_at)))
+                        except (TypeError, ValueError):
+                            chunk_rejected.append((record, "Invalid timestamp"))
+                    rows = self._localize(conn, checkins, offsets)
+                    self._insert_checkins(conn, rows)
+            except sqlite3.Error as e:
+                rejected.extend((record, f"Database error: {e}") for record in chunk)
+                continue
+            rejected.extend(chunk_rejected)
+            inserted += len(rows)
+        return {"inserted": inserted, "rejected": rejected}
+
+    @staticmethod
+    def _resolve_habit_ids(conn, chunk, habit_ids):
+        """ Map the chunk's unseen (user_id, name or id) keys to habit ids with one query per key type """
+        names, ids = set(), set()
+        for record in chunk:
+            if not _is_record(record):
+                continue
+            key = (record[0], record[1])
+            if key in habit_ids:
+                continue
+            if isinstance(record[1], int):
+                ids.add(key)
+            else:
+                names.add(key)
+
+        if names:
+            values = ", ".join("(?, ?)" for _ in names)
+            cursor = conn.execute(f"""
+                WITH wanted(user_id, name) AS (VALUES {values})
+                SELECT w.user_id, w.name, MIN(h.id) FROM habits h
+                JOIN wanted w ON h.user_id = w.user_id AND h.name = w.name COLLATE NOCASE
+                GROUP BY w.user_id, w.name
+            """, [value for key in names for value in key])
+            for user_id, name, habit_id in cursor:
+                habit_ids[(user_id, name)] = habit_id
+        if ids:
+            placeholders = ", ".join("?" for _ in ids)
+            cursor = conn.execute(f"SELECT user_id, id FROM habits WHERE id IN ({placeholders})",
+                                  [habit_id for _, habit_id in ids])
+            for user_id, habit_id in cursor:
+                habit_ids[(user_id, habit_id)] = habit_id
+
+        # Remember misses too, so unknown habits are not looked up again in later chunks
+        for key in names | ids:
+            habit_ids.setdefault(key, None)
+
+    @staticmethod
+    def _localize(conn, checkins, offsets):
+        """ (habit_id, checked_at, utc_offset) rows of (habit_id, user_id, datetime) check-ins, in the time
+        zone of each user; offsets caches the users' UTC offsets across calls """
+        missing = {user_id for _, user_id, _ in checkins} - offsets.keys()
+        if missing:
+            offsets.update(user_offsets(conn, missing))
+        return [(habit_id,) + local_time(value, offsets[user_id]) for habit_id, user_id, value in checkins]
+
+    @staticmethod
+    def _insert_checkins(conn, rows):
+        """ Insert (habit_id, checked_at, utc_offset) rows inside the caller's transaction """
+        conn.executemany("INSERT INTO habit_tracking (habit_id, checked_at, utc_offset) VALUES (?, ?, ?)", rows)
+
+    def set_utc_offset(self, minutes):
+        """ Record check-ins of the user in the time zone `minutes` east of UTC; None for the server's zone """
+        try:
+            with self.pool.transaction() as conn:
+                updated = conn.execute("UPDATE users SET utc_offset=? WHERE id=?", (minutes, self.user_id)).rowcount
+            if not updated:
+                return "Error updating time zone: unknown user"
+            return "Time zone updated successfully"
+        except sqlite3.Error as e:
+            return f"Error updating time zone: {e}"
+
     def get_worst_streak_habit(self):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-
-            # Select the habit with the worst streak
-            cursor.execute("""
-                SELECT name FROM habits WHERE id = (
-                    SELECT habit_id FROM habit_tracking
-                    GROUP BY habit_id
-                    ORDER BY COUNT(*) ASC
-                    LIMIT 1
-                )
-            """)
-
-            habit = cursor.fetchone()
-            conn.close()
-            return habit[0] if habit else None
+            with self._analytics_connection() as conn:
+                # The habit with the fewest check-ins, counted from the rollups
+                habit = rank_habits(conn, limit=1, best=False, user_id=self.user_id)
+            return habit[0][1] if habit else None
         except sqlite3.Error as e:
             return f"Error getting habit with worst streak: {e}"
 
     def get_worst_habit_last_month(self):
         try:
-            last_month = datetime.now() - timedelta(days=30)
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT name FROM habits WHERE id = (
-                    SELECT habit_id FROM habit_tracking 
-                    WHERE checked_at >= ? 
-                    GROUP BY habit_id 
-                    ORDER BY COUNT(*) DESC 
-                    LIMIT 1
-                )
-            """, (last_month,))
-            habit = cursor.fetchone()
-            conn.close()
-            return habit[0] if habit else None
+            with self._analytics_connection() as conn:
+                today = local_time(None, user_offsets(conn, [self.user_id])[self.user_id])[0]
+                last_month = date.fromisoformat(today[:10]) - timedelta(days=30)
+                habit = rank_habits(conn, start=last_month, limit=1, best=False, user_id=self.user_id)
+            return habit[0][1] if habit else None
         except sqlite3.Error as e:
             return f"Error getting worst habit last month: {e}"
 
-    def calculate_streak(self, habit_tracking):
+    def get_habit_ranking(self, start=None, end=None, limit=10, best=True):
+        """ The user's `limit` habits with the most (best=True) or fewest check-ins between the start
+        and end dates, both inclusive and optional, as (habit_id, name, checkins) tuples """
+        try:
+            with self._analytics_connection() as conn:
+                return rank_habits(conn, start, end, limit, best, self.user_id)
+        except sqlite3.Error as e:
+            return f"Error ranking habits: {e}"
+
+    def calculate_streak(self, habit_tracking, periodicity="daily"):
         """ Calculate the longest streak and its date range for a habit.
 
         Args:
             habit_tracking (list): A list of dictionaries representing habit tracking entries.
+            periodicity (str): "daily" or "weekly"; a streak is a run of consecutive days or weeks
+                with at least one check-in.
 
         Returns:
-            tuple: A tuple containing the longest streak, the start date, and the end date.
+            tuple: A tuple containing the longest streak and the datetimes at which its first
+            and last period start.
 
         """
-        if not habit_tracking:
+        calendar = HabitCalendar(periodicity, (tracking["checked_at"] for tracking in habit_tracking))
+        longest_streak, first_period = calendar.longest_run()
+        if not longest_streak:
             return 0, None, None
+        return (longest_streak, _period_datetime(first_period, periodicity),
+                _period_datetime(first_period + longest_streak - 1, periodicity))
 
-        longest_streak = current_streak = 1
-        longest_start = longest_end = current_start = habit_tracking[0]["checked_at"]
-        previous_day = current_start
-
-        for tracking in habit_tracking[1:]:
-            if tracking["checked_at"] - previous_day == timedelta(days=1):
-                current_streak += 1
-                if current_streak > longest_streak:
-                    longest_streak = current_streak
-                    longest_start = current_start
-                    longest_end = tracking["checked_at"]
-            else:
-                current_streak = 1
-                current_start = tracking["checked_at"]
-
-            previous_day = tracking["checked_at"]
-
-        return longest_streak, longest_start, longest_end
+    def get_streak(self, name):
+        """ Return the StreakSummary of the user's habit, read from habit_streaks by primary key.
 
-    def get_habits_with_longest_streak(self):
+        Its periods are given as the datetimes at which they start.
+        """
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-
-            cursor.execute("SELECT id, name, description, periodicity, creation_date FROM habits")
-            habits = cursor.fetchall()
-
-            habit_streaks = []
-
-            for habit in habits:
-                habit_id, name, description, periodicity, created_at = habit
-                cursor.execute("""
-                    SELECT checked_at FROM habit_tracking 
-                    WHERE habit_id = ?
-                    ORDER BY checked_at
-                """, (habit_id,))
-
-                habit_tracking = cursor.fetchall()
-
-                if habit_tracking:
-                    habit_tracking = [
-                        {"checked_at": datetime.fromisoformat(check_in[0])}
-                        for check_in in habit_tracking
-                    ]
+            refresh_stale_streaks(self.pool)
+            with self.pool.connection() as conn:
+                row = conn.execute("""
+                    SELECT s.habit_id, s.current_streak, s.current_start, s.longest_streak,
+                           s.longest_start, s.longest_end, s.last_period, h.periodicity
+                    FROM habits h
+                    JOIN habit_streaks s ON s.habit_id = h.id
+                    WHERE h.user_id = ? AND h.name = ? COLLATE NOCASE
+                """, (self.user_id, name)).fetchone()
+            if row is None:
+                return None
+            periodicity = row[7]
+            return StreakSummary(row[0], row[1], _period_datetime(row[2], periodicity), row[3],
+                                 _period_datetime(row[4], periodicity), _period_datetime(row[5], periodicity),
+                                 _period_datetime(row[6], periodicity))
+        except sqlite3.Error as e:
+            return f"Error getting habit streak: {e}"
 
-                    streak_length, start_date, end_date = self.calculate_streak(habit_tracking)
+    def get_habits_with_longest_streak(self):
+        """ Return each of the user's tracked habits with its longest streak of consecutive days or weeks.
 
-                    if streak_length > 0:
-                        habit_streaks.append((
-                            habit_id, name, description, periodicity,
-                            created_at, streak_length, start_date, end_date
-                        ))
+        The streaks come from the habit_streaks table, which is kept up to date on every check-in, or
+        from the replica's snapshot of it.
 
-            habit_streaks.sort(key=lambda x: x[1], reverse=True)
+        Returns:
+            list: (habit_id, name, description, periodicity, created_at, streak_length,
+            start_date, end_date) tuples, longest streak first and equal streaks by name.
 
-            conn.close()
+        """
+        try:
+            with self._analytics_connection(streaks=True) as conn:
+                cursor = conn.execute("""
+                    SELECT h.id, h.name, h.description, h.periodicity, h.creation_date,
+                           s.longest_streak, s.longest_start, s.longest_end
+                    FROM habit_streaks s
+                    JOIN habits h ON h.id = s.habit_id
+                    WHERE h.user_id = ?
+                    ORDER BY h.id
+                """, (self.user_id,))
+                habit_streaks = [
+                    row[:6] + (_period_datetime(row[6], row[3]), _period_datetime(row[7], row[3]))
+                    for row in cursor
+                ]
+
+            habit_streaks.sort(key=lambda x: (-x[5], x[1], x[0]))
 
             return habit_streaks
 
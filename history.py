@@ -0,0 +1,117 @@
+""" Streaming readers for habits and check-in history.
+
+The get_* methods of Database and HabitTracker return whole result sets as lists. The
+readers here yield the same rows, or typed records, one batch at a time so reports and
+exports can walk millions of check-ins in flat memory. Every batch is its own keyset
+query, "rows after the last key seen, in key order, LIMIT batch_size", answered from the
+(habit_id, checked_at) index, so no connection or read transaction is held between
+batches, later batches cost as little as the first, and a walk can resume from a key.
+"""
+from collections import namedtuple
+from datetime import datetime
+from rollups import has_compacted_checkins
+
+CheckIn = namedtuple("CheckIn", ["id", "habit_id", "checked_at"])
+HabitRecord = namedtuple("HabitRecord", ["user_id", "id", "name", "description", "periodicity", "creation_date"])
+
+DEFAULT_BATCH_SIZE = 1000
+
+_CHECKINS = "SELECT id, habit_id, checked_at FROM habit_tracking"
+_CHECKINS_WITH_OFFSETS = "SELECT id, habit_id, checked_at, utc_offset FROM habit_tracking"
+_CHECKIN_DAYS = "SELECT habit_id, day, checkins FROM habit_checkin_days"
+# Spelled out because databases upgraded by migration 2 have user_id as their last column
+_HABITS = "SELECT user_id, id, name, description, periodicity, creation_date FROM habits"
+
+
+def checkin_key(row):
+    """ Keyset position of a habit_tracking row or CheckIn: (habit_id, checked_at, id) """
+    checked_at = row[2]
+    if isinstance(checked_at, datetime):
+        checked_at = checked_at.strftime('%Y-%m-%d %H:%M:%S')
+    return row[1], checked_at, row[0]
+
+
+def _batches(pool, query, arguments, next_query, fixed, key, batch_size):
+    """ Yield result batches; after the first, next_query runs with fixed + the key of the last row read """
+    while True:
+        with pool.connection() as conn:
+            batch = conn.execute(query, arguments + (batch_size,)).fetchmany(batch_size)
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+        query, arguments = next_query, fixed + key(batch[-1])
+
+
+def iter_checkin_batches(pool, habit_id=None, batch_size=DEFAULT_BATCH_SIZE, after=None, offsets=False):
+    """ Yield lists of habit_tracking rows ordered by (habit_id, checked_at, id).
+
+    Args:
+        pool (ConnectionPool): Pool of the database to read.
+        habit_id (int): Only read this habit's check-ins; None reads every habit's.
+        batch_size (int): Rows per batch, which bounds memory use.
+        after (tuple): checkin_key() of the row to resume after; None starts at the beginning.
+        offsets (bool): Add each row's utc_offset as a fourth column.
+
+    Check-ins without a checked_at have no place in the key order and are skipped.
+    """
+    checkins = _CHECKINS_WITH_OFFSETS if offsets else _CHECKINS
+    if habit_id is None:
+        first = f"{checkins} WHERE checked_at IS NOT NULL ORDER BY habit_id, checked_at, id LIMIT ?"
+        following = (f"{checkins} WHERE (habit_id, checked_at, id) > (?, ?, ?) "
+                     "ORDER BY habit_id, checked_at, id LIMIT ?")
+        fixed, key = (), checkin_key
+    else:
+        first = f"{checkins} WHERE habit_id = ? AND checked_at IS NOT NULL ORDER BY checked_at, id LIMIT ?"
+        following = f"{checkins} WHERE habit_id = ? AND (checked_at, id) > (?, ?) ORDER BY checked_at, id LIMIT ?"
+        fixed, key = (habit_id,), lambda row: checkin_key(row)[1:]
+
+    if after is None:
+        return _batches(pool, first, fixed, following, fixed, key, batch_size)
+    after = tuple(after) if habit_id is None else tuple(after)[1:]
+    return _batches(pool, following, fixed + after, following, fixed, key, batch_size)
+
+
+def iter_checkins(pool, habit_id=None, batch_size=DEFAULT_BATCH_SIZE, after=None, records=False):
+    """ Yield the rows of iter_checkin_batches one at a time, as CheckIn records with a datetime
+    checked_at when records is True """
+    for batch in iter_checkin_batches(pool, habit_id, batch_size, after):
+        if records:
+            for row_id, row_habit_id, checked_at in batch:
+                yield CheckIn(row_id, row_habit_id, datetime.fromisoformat(checked_at))
+        else:
+            yield from batch
+
+
+def iter_checkin_day_batches(pool, habit_id=None, batch_size=DEFAULT_BATCH_SIZE):
+    """ Yield lists of (habit_id, day, checkins) rows of habit_checkin_days ordered by (habit_id, day):
+    the per-day counts compaction keeps of archived check-ins, of one habit or of every habit """
+    with pool.connection() as conn:
+        if not has_compacted_checkins(conn):
+            return
+    if habit_id is None:
+        first = f"{_CHECKIN_DAYS} ORDER BY habit_id, day LIMIT ?"
+        following = f"{_CHECKIN_DAYS} WHERE (habit_id, day) > (?, ?) ORDER BY habit_id, day LIMIT ?"
+        fixed, key = (), lambda row: row[:2]
+    else:
+        first = f"{_CHECKIN_DAYS} WHERE habit_id = ? ORDER BY day LIMIT ?"
+        following = f"{_CHECKIN_DAYS} WHERE habit_id = ? AND day > ? ORDER BY day LIMIT ?"
+        fixed, key = (habit_id,), lambda row: row[1:2]
+    yield from _batches(pool, first, fixed, following, fixed, key, batch_size)
+
+
+def iter_habits(pool, user_id=None, batch_size=DEFAULT_BATCH_SIZE, records=False):
+    """ Yield habits rows in id order, or HabitRecords when records is True, a batch at a time """
+    if user_id is None:
+        first = f"{_HABITS} ORDER BY id LIMIT ?"
+        following = f"{_HABITS} WHERE id > ? ORDER BY id LIMIT ?"
+        fixed = ()
+    else:
+        first = f"{_HABITS} WHERE user_id = ? ORDER BY id LIMIT ?"
+        following = f"{_HABITS} WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?"
+        fixed = (user_id,)
+    for batch in _batches(pool, first, fixed, following, fixed, lambda row: (row[1],), batch_size):
+        if records:
+            yield from map(HabitRecord._make, batch)
+        else:
+            yield from batch
@@ -0,0 +1,368 @@
+""" Per-call instrumentation of the tracker's public methods.
+
+Once enabled, every call of a public HabitTracker or Database method produces a
+CallRecord: the SQL statements it executed with their parameters and timings, the rows
+they returned and changed, the SQLite virtual machine steps they took, wall and CPU
+time, and how long the call waited for a pooled connection. Records go to a sink:
+
+    MemorySink       counters and latency histograms per method, plus recent records
+    JsonLinesSink    one JSON object per call and per slow query
+    PrometheusSink   a MemorySink that renders the Prometheus text exposition format
+
+With slow_query_ms set, statements slower than that are also passed to the sink with
+their EXPLAIN QUERY PLAN. SQLite does not report how many rows a statement scanned, so
+vm_steps, counted with a progress handler every VM_STEP_INTERVAL instructions, stands in
+for it; the query plan then shows whether the work was a SCAN or an index SEARCH.
+
+Instrumentation is off by default and costs one attribute lookup per call and per
+statement while off.
+"""
+import functools
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+
+VM_STEP_INTERVAL = 1000
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+_active = None
+_local = threading.local()
+
+
+class StatementRecord:
+    __slots__ = ("sql", "parameters", "seconds", "rows_returned")
+
+    def __init__(self, sql, parameters):
+        self.sql = sql
+        self.parameters = parameters
+        self.seconds = 0.0
+        self.rows_returned = 0
+
+    def as_dict(self):
+        return {"sql": self.sql, "ms": round(self.seconds * 1e3, 4), "rows_returned": self.rows_returned}
+
+
+class CallRecord:
+    """ What one call of an instrumented method did """
+
+    def __init__(self, method):
+        self.method = method
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.acquire_seconds = 0.0
+        self.statements = []
+        self.rows_changed = 0
+        self.vm_steps = 0
+        self.error = None
+        self._connections = {}
+
+    @property
+    def rows_returned(self):
+        return sum(statement.rows_returned for statement in self.statements)
+
+    def _tick(self):
+        self.vm_steps += VM_STEP_INTERVAL
+        return 0
+
+    def as_dict(self):
+        return {
+            "method": self.method,
+            "wall_ms": round(self.wall_seconds * 1e3, 4),
+            "cpu_ms": round(self.cpu_seconds * 1e3, 4),
+            "acquire_ms": round(self.acquire_seconds * 1e3, 4),
+            "statements": [statement.as_dict() for statement in self.statements],
+            "rows_returned": self.rows_returned,
+            "rows_changed": self.rows_changed,
+            "vm_steps": self.vm_steps,
+            "error": self.error,
+        }
+
+
+def current_call():
+    """ The CallRecord of the instrumented call running on this thread, if any """
+    return getattr(_local, "call", None)
+
+
+def record_acquire(seconds):
+    """ Called by the connection pool with the time a checkout waited """
+    call = getattr(_local, "call", None)
+    if call is not None:
+        call.acquire_seconds += seconds
+
+
+class _RecordingCursor(sqlite3.Cursor):
+    """ Records its statements, and the rows and time spent fetching them, in the current call """
+    statement = None
+
+    def _execute(self, method, sql, parameters):
+        call = getattr(_local, "call", None)
+        if call is None:
+            self.statement = None
+            return getattr(super(), method)(sql, parameters)
+        conn = self.connection
+        if id(conn) not in call._connections:
+            call._connections[id(conn)] = (conn, conn.total_changes)
+            conn.set_progress_handler(call._tick, VM_STEP_INTERVAL)
+        statement = self.statement = StatementRecord(sql, parameters if method == "execute" else None)
+        call.statements.append(statement)
+        start = time.perf_counter()
+        try:
+            return getattr(super(), method)(sql, parameters)
+        finally:
+            statement.seconds += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        return self._execute("execute", sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self._execute("executemany", sql, parameters)
+
+    def _count(self, rows, start):
+        statement = self.statement
+        if statement is not None:
+            statement.rows_returned += rows
+            statement.seconds += time.perf_counter() - start
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._count(0, start)
+            raise
+        self._count(1, start)
+        return row
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._count(row is not None, start)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._count(len(rows), start)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._count(len(rows), start)
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """ Connection class of pooled connections; hands out recording cursors while a call is instrumented """
+
+    def cursor(self, factory=None):
+        if factory is None and getattr(_local, "call", None) is not None:
+            factory = _RecordingCursor
+        return super().cursor() if factory is None else super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        if getattr(_local, "call", None) is None:
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        if getattr(_local, "call", None) is None:
+            return super().executemany(sql, parameters)
+        return self.cursor().executemany(sql, parameters)
+
+
+class MemorySink:
+    """ Aggregates calls into per-method counters and latency histograms, keeping the latest records """
+
+    def __init__(self, keep=1000, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.methods = {}
+        self.records = deque(maxlen=keep)
+        self.slow_queries = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def record(self, call):
+        with self._lock:
+            metrics = self.methods.get(call.method)
+            if metrics is None:
+                metrics = self.methods[call.method] = {
+                    "calls": 0, "errors": 0, "statements": 0, "rows_returned": 0, "rows_changed": 0,
+                    "vm_steps": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "acquire_seconds": 0.0,
+                    "buckets": [0] * len(self.buckets),
+                }
+            metrics["calls"] += 1
+            metrics["errors"] += call.error is not None
+            metrics["statements"] += len(call.statements)
+            metrics["rows_returned"] += call.rows_returned
+            metrics["rows_changed"] += call.rows_changed
+            metrics["vm_steps"] += call.vm_steps
+            metrics["wall_seconds"] += call.wall_seconds
+            metrics["cpu_seconds"] += call.cpu_seconds
+            metrics["acquire_seconds"] += call.acquire_seconds
+            for index, bound in enumerate(self.buckets):
+                if call.wall_seconds <= bound:
+                    metrics["buckets"][index] += 1
+            self.records.append(call)
+
+    def slow_query(self, entry):
+        with self._lock:
+            self.slow_queries.append(entry)
+
+    def snapshot(self):
+        with self._lock:
+            return {method: dict(metrics, buckets=list(metrics["buckets"]))
+                    for method, metrics in self.methods.items()}
+
+
+class JsonLinesSink:
+    """ Appends one JSON object per call and per slow query to a file path or open text file """
+
+    def __init__(self, target):
+        self._file = open(target, "a") if isinstance(target, str) else target
+        self._owned = isinstance(target, str)
+        self._lock = threading.Lock()
+
+    def _write(self, entry):
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def record(self, call):
+        self._write(dict(call.as_dict(), type="call"))
+
+    def slow_query(self, entry):
+        self._write(dict(entry, type="slow_query"))
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+
+
+class PrometheusSink(MemorySink):
+    """ A MemorySink whose render() returns the metrics in the Prometheus text format """
+
+    PREFIX = "habit_tracker"
+
+    def render(self):
+        metrics = self.snapshot()
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {self.PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {self.PREFIX}_{name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{key}="{value_}"' for key, value_ in labels)
+                lines.append(f"{self.PREFIX}_{name}{suffix}{{{label_text}}} {value}")
+
+        for name, key, help_text in (
+                ("calls_total", "calls", "Calls of instrumented methods."),
+                ("errors_total", "errors", "Calls that raised or returned an error."),
+                ("statements_total", "statements", "SQL statements executed."),
+                ("rows_returned_total", "rows_returned", "Rows fetched from SQL statements."),
+                ("rows_changed_total", "rows_changed", "Rows inserted, updated or deleted."),
+                ("vm_steps_total", "vm_steps", "SQLite virtual machine steps, a proxy for rows scanned."),
+                ("cpu_seconds_total", "cpu_seconds", "CPU time spent in calls."),
+                ("acquire_seconds_total", "acquire_seconds", "Time spent waiting for a pooled connection.")):
+            family(name, "counter", help_text,
+                   [("", [("method", method)], values[key]) for method, values in sorted(metrics.items())])
+
+        samples = []
+        for method, values in sorted(metrics.items()):
+            for bound, count in zip(self.buckets, values["buckets"]):
+                samples.append(("_bucket", [("method", method), ("le", bound)], count))
+            samples.append(("_bucket", [("method", method), ("le", "+Inf")], values["calls"]))
+            samples.append(("_sum", [("method", method)], values["wall_seconds"]))
+            samples.append(("_count", [("method", method)], values["calls"]))
+        family("call_seconds", "histogram", "Wall time of calls.", samples)
+        family("slow_queries_total", "counter", "Statements slower than the slow query threshold.",
+               [("", [], len(self.slow_queries))])
+        return "\n".join(lines) + "\n"
+
+
+class Instrumentation:
+    def __init__(self, sink=None, slow_query_ms=None, explain=True):
+        self.sink = sink if sink is not None else MemorySink()
+        self.slow_query_ms = slow_query_ms
+        self.explain = explain
+
+    def finish(self, call, pool):
+        for conn, changes in call._connections.values():
+            conn.set_progress_handler(None, 0)
+            call.rows_changed += conn.total_changes - changes
+        call._connections = {}
+        self.sink.record(call)
+        if self.slow_query_ms is None:
+            return
+        for statement in call.statements:
+            if statement.seconds * 1e3 < self.slow_query_ms:
+                continue
+            entry = dict(statement.as_dict(), method=call.method, parameters=statement.parameters)
+            if self.explain and pool is not None:
+                entry["plan"] = explain_query_plan(pool, statement.sql, statement.parameters)
+            self.sink.slow_query(entry)
+
+
+def explain_query_plan(pool, sql, parameters):
+    """ The EXPLAIN QUERY PLAN details of a statement, or None for statements that have no plan """
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")):
+        return None
+    try:
+        with pool.connection() as conn:
+            return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, parameters or ())]
+    except sqlite3.Error:
+        return None
+
+
+def enable(sink=None, slow_query_ms=None, explain=True):
+    """ Start recording calls of instrumented methods; returns the active Instrumentation """
+    global _active
+    _active = Instrumentation(sink, slow_query_ms, explain)
+    return _active
+
+
+def disable():
+    global _active
+    _active = None
+
+
+def instrumented(cls):
+    """ Class decorator: record every call of the class's public methods when instrumentation is enabled.
+
+    A call made while another instrumented call is running on the same thread is part of
+    the outer call's record. The pool of the instance, if it has one, serves EXPLAIN QUERY PLAN.
+    """
+    for name, method in list(vars(cls).items()):
+        # iter_* methods only build a generator; the statements run later, outside the call
+        if name.startswith(("_", "iter_")) or not callable(method):
+            continue
+        setattr(cls, name, _wrap(f"{cls.__name__}.{name}", method))
+    return cls
+
+
+def _wrap(qualified_name, method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = _active
+        if instrumentation is None or getattr(_local, "call", None) is not None:
+            return method(self, *args, **kwargs)
+        call = _local.call = CallRecord(qualified_name)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            result = method(self, *args, **kwargs)
+        except Exception as e:
+            call.error = repr(e)
+            raise
+        else:
+            # The tracker reports most failures as returned "Error ..." strings
+            if isinstance(result, str) and result.startswith("Error"):
+                call.error = result
+            return result
+        finally:
+            call.wall_seconds = time.perf_counter() - wall
+            call.cpu_seconds = time.thread_time() - cpu
+            _local.call = None
+            instrumentation.finish(call, getattr(self, "pool", None))
+    return wrapper
@@ -0,0 +1,80 @@
+""" Seeded synthetic data for load tests and benchmarks.
+
+generate() fills a migrated database with N users x M habits x about K check-ins per
+habit. The data is skewed the way real trackers are: most habits are daily, users
+differ in how consistent they are, streaks break and restart, check-in times cluster
+around a preferred hour, and weekly habits are checked off once or twice a week. The
+same seed always produces the same database.
+"""
+import random
+import sqlite3
+from datetime import datetime, timedelta
+from timekeys import local_time
+
+WEEKLY_SHARE = 0.3
+START = datetime(2023, 1, 1)
+
+
+def habit_name(user_id, index):
+    return f"Habit {user_id}-{index}"
+
+
+def _checkins(rng, periodicity, count, adherence):
+    """ About `count` check-ins for one habit, as (checked_at, utc_offset) pairs in time order, in the
+    server's time zone, which is the zone of users without a utc_offset """
+    hour = rng.choice([6, 7, 8, 12, 18, 20, 21])
+    day = rng.randint(0, 30)
+    for _ in range(count):
+        if periodicity == "weekly":
+            # Usually once a week, sometimes twice, with the odd missed week
+            day += rng.choice([7, 7, 7, 3, 4, 14]) if rng.random() < adherence else rng.randint(8, 28)
+        elif rng.random() < adherence:
+            day += 1
+        else:
+            # A broken streak: a gap of a couple of days, occasionally a long break
+            day += rng.randint(2, 4) if rng.random() < 0.9 else rng.randint(7, 30)
+        minute = int(rng.gauss(0, 45))
+        yield local_time(START + timedelta(days=day, hours=hour, minutes=minute))
+
+
+def generate(db_file, users=10, habits_per_user=10, checkins_per_habit=100, seed=42, chunk_size=10000):
+    """ Insert the synthetic users, habits and check-ins into db_file, which must already be migrated.
+
+    Returns:
+        dict: The number of users, habits and check-ins written.
+
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.execute("BEGIN")
+        first_user = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM users").fetchone()[0]
+        habit_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM habits").fetchone()[0]
+        rows, checkins, habits = [], 0, 0
+        for user_id in range(first_user, first_user + users):
+            conn.execute("INSERT INTO users (id, email, username, password, created_at) VALUES (?, ?, ?, '', ?)",
+                         (user_id, f"user{user_id}@example.com", f"user{user_id}", START.isoformat(' ')))
+            # Some users are far more consistent than others
+            consistency = rng.betavariate(5, 2)
+            for index in range(1, habits_per_user + 1):
+                habit_id += 1
+                habits += 1
+                periodicity = "weekly" if rng.random() < WEEKLY_SHARE else "daily"
+                conn.execute("INSERT INTO habits (id, user_id, name, description, periodicity, creation_date) "
+                             "VALUES (?, ?, ?, '', ?, ?)",
+                             (habit_id, user_id, habit_name(user_id, index), periodicity, START.isoformat(' ')))
+                count = max(0, int(rng.gauss(checkins_per_habit, checkins_per_habit / 4)))
+                adherence = min(0.98, max(0.3, rng.gauss(consistency, 0.1)))
+                for checked_at, utc_offset in _checkins(rng, periodicity, count, adherence):
+                    rows.append((habit_id, checked_at, utc_offset))
+                if len(rows) >= chunk_size:
+                    conn.executemany("INSERT INTO habit_tracking (habit_id, checked_at, utc_offset) VALUES (?, ?, ?)",
+                                     rows)
+                    checkins += len(rows)
+                    rows = []
+        conn.executemany("INSERT INTO habit_tracking (habit_id, checked_at, utc_offset) VALUES (?, ?, ?)", rows)
+        checkins += len(rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return {"users": users, "habits": habits, "checkins": checkins}
@@ -1,48 +1,63 @@
+import sys
 from datetime import datetime
-import questionary
-from habit_tracker import HabitTracker
 from database import Database
-from tabulate import tabulate
 from habit import User, Habit
-from analytics import Analytics
+from habit_tracker import HabitTracker
+
+DB_FILE = "main_db.db"
+
+SAMPLE_HABITS = [
+    ("Exercise", "Hit the gym.", "daily"),
+    ("Reading", "Read for at least 30 minutes.", "weekly"),
+    ("Meditation", "Practice mindfulness meditation.", "weekly"),
+    ("Writing", "Write in your journal or blog.", "daily"),
+    ("Walking", "for at least an hour.", "daily"),
+    ("Coffee", "with the friends", "weekly"),
+    ("Grocery Shopping", "Write a list", "weekly"),
+    ("Clothes Shopping", "Online", "weekly"),
+    ("Laundry", "Make appointment", "weekly"),
+    ("Look for a job", "at least for an hour.", "daily")
+]
+
+
+def startup(db_file=DB_FILE, user_id=1):
+    """ Open the database without touching existing data: the schema is migrated only when it is
+    behind, and the sample user and habits are added only to a new database.
+
+    Returns:
+        tuple: The logged-in User, with their habits, and a HabitTracker for them.
+
+    """
+    db = Database(db_file)
+    # Databases of the first releases have no schema_version table but do have data
+    new = db.is_empty()
+    db.ensure_schema()
+    if new:
+        db.populate_tables()
+        db.create_habits(user_id, SAMPLE_HABITS)
+    user_logged_in = User(user_id, "user@example.com", "username", "password", datetime.now())
+    for row in db.get_habits_by_user_id(user_id):
+        user_logged_in.add_habit(Habit(user_id, row[2], row[3], row[4], db_file))
+    return user_logged_in, HabitTracker(user_id, db_file)
 
 
 def main():
-    db = Database("main_db.db")
-    db.initialize_database()
-    db.populate_tables()
-    user_logged_in = User(1, "user@example.com", "username", "password", datetime.now())
-    user_id = 1
-    habits_to_create = [
-        ("Exercise", "Hit the gym.", "daily"),
-        ("Reading", "Read for at least 30 minutes.", "weekly"),
-        ("Meditation", "Practice mindfulness meditation.", "weekly"),
-        ("Writing", "Write in your journal or blog.", "daily"),
-        ("Walking", "for at least an hour.", "daily"),
-        ("Coffee", "with the friends", "weekly"),
-        ("Grocery Shopping", "Write a list", "weekly"),
-        ("Clothes Shopping", "Online", "weekly"),
-        ("Laundry", "Make appointment", "weekly"),
-        ("Look for a job", "at least for an hour.", "daily")
-    ]
-
-    for habit_data in habits_to_create:
-        name, description, periodicity = habit_data
-        habit = Habit(user_logged_in.user_id, name, description, periodicity, "main_db.db")
-        habit.create_habit(user_logged_in.user_id, name, description, periodicity)
-        user_logged_in.add_habit(habit)
-
-    # Creates an instance of HabitTracker
-    tracker = HabitTracker(user_logged_in.user_id, "main_db.db")
+    # The interactive front end is only needed here, so importing this module stays cheap
+    import questionary
+    from tabulate import tabulate
+    from analytics import Analytics
+
+    user_logged_in, tracker = startup()
 
     # Start an instance of Analytics with the user's habits
-    analytics = Analytics(user_logged_in.habits)
+    analytics = Analytics(user_logged_in)
     while True:
         choice = questionary.select(
             "Welcome back Admin! What would you like to do?",
             choices=[
                 "Add a new habit",
                 "Get habit info",
+                "Search habits",
                 "Update a habit",
                 "Remove a habit",
                 "List of all habits",
@@ -76,6 +91,18 @@ def main():
                 print(f"No habit found with name '{name}'")
                 print("Habit not found.")
 
+        elif choice == "Search habits":
+            text = questionary.text("Search for:").ask()
+            results = tracker.search_habits(text)
+            if isinstance(results, str):
+                print(results)
+            elif results:
+                headers = ["Habit ID", "Habit Name", "Description"]
+                print(tabulate([(row.habit_id, row.name, row.description) for row in results], headers=headers,
+                               tablefmt="grid"))
+            else:
+                print(f"No habit matches '{text}'")
+
         elif choice == "Update a habit":
             name = questionary.text("Enter the name of the habit to update:").ask()
             new_name = questionary.text("Enter the new name of the habit:").ask()
@@ -127,4 +154,8 @@ def main():
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Subcommands run the non-interactive CLI, e.g. python main.py export > checkins.ndjson
+        from cli import main as cli_main
+        sys.exit(cli_main())
     main()
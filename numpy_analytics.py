@@ -0,0 +1,137 @@
+""" NumPy backend for analytics.Analytics.
+
+All check-ins are loaded once into one contiguous int64 array of epoch seconds, copied
+straight from each Habit's sorted checkins array, with offsets marking where each habit's
+slice starts, plus a sorted array of the distinct day/week ordinals each habit was checked
+in. Streaks, gaps, completion rates and per-period counts are then computed with diff/cumsum
+style array operations instead of a Python loop per check-in, with the same period
+semantics as habit_calendar.HabitCalendar.
+
+numpy is optional: the module imports without it, but NumpyAnalytics raises ImportError.
+"""
+from analytics import Analytics
+from habit_calendar import is_weekly, period_start
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without numpy installed
+    np = None
+
+DAY = 86_400  # seconds
+
+
+class NumpyAnalytics(Analytics):
+    """ Drop-in replacement for Analytics backed by NumPy arrays.
+
+    Call reload() after changing the habits' tracking data.
+    """
+
+    def __init__(self, habits):
+        if np is None:
+            raise ImportError("NumpyAnalytics requires numpy, install it with 'pip install numpy'")
+        super().__init__(habits)
+        self.reload()
+
+    def reload(self):
+        """ (Re)build the arrays from the habits' tracking data """
+        lengths = [len(habit.checkins) for habit in self.habits]
+        self._index = {}
+        for position, habit in enumerate(self.habits):
+            self._index.setdefault(habit.name, position)
+        self._offsets = np.zeros(len(self.habits) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self._offsets[1:])
+
+        self._seconds = np.concatenate(
+            [np.frombuffer(habit.checkins, dtype=np.int64) for habit in self.habits] or [np.zeros(0, np.int64)])
+        self._owner = np.repeat(np.arange(len(self.habits)), lengths)
+
+        # Gaps between neighbouring check-ins; pairs spanning two habits are masked out
+        days_apart = np.diff(self._seconds) // DAY
+        same_habit = self._owner[1:] == self._owner[:-1]
+        self._gaps = np.where(same_habit, days_apart, np.iinfo(np.int64).min)
+
+        day = self._seconds // DAY
+        weekly = np.array([is_weekly(habit.periodicity) for habit in self.habits], dtype=bool)
+        self._periods = np.where(weekly[self._owner], (day + 3) // 7, day)
+
+        # Distinct checked periods of each habit, in order, with their own offsets
+        order = np.lexsort((self._periods, self._owner))
+        periods, owner = self._periods[order], self._owner[order]
+        distinct = np.ones(periods.size, dtype=bool)
+        distinct[1:] = (owner[1:] != owner[:-1]) | (periods[1:] != periods[:-1])
+        self._distinct_periods = periods[distinct]
+        self._distinct_owner = owner[distinct]
+        self._distinct_offsets = np.zeros(len(self.habits) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self._distinct_owner, minlength=len(self.habits)), out=self._distinct_offsets[1:])
+        self._consecutive = ((self._distinct_owner[1:] == self._distinct_owner[:-1])
+                             & (np.diff(self._distinct_periods) == 1))
+
+    @staticmethod
+    def _runs(consecutive):
+        """ (first pair index, length) of every run of consecutive period pairs """
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], consecutive.astype(np.int8), [0]))))
+        starts, ends = edges[::2], edges[1::2]
+        return starts, ends - starts
+
+    def _slice(self, habit_name):
+        position = self._index.get(habit_name)
+        if position is None:
+            return None, None
+        return position, slice(self._offsets[position], self._offsets[position + 1])
+
+    def _longest_streaks(self):
+        """ Array of the longest run of consecutive periods of each habit, by position in self.habits """
+        # A habit with any check-in has a streak of at least one period; a run of n
+        # consecutive pairs is a streak of n + 1 periods
+        longest = (np.diff(self._distinct_offsets) > 0).astype(np.int64)
+        starts, lengths = self._runs(self._consecutive)
+        np.maximum.at(longest, self._distinct_owner[starts], lengths + 1)
+        return longest
+
+    def get_longest_streaks(self):
+        """Return the longest run of consecutive periods of every habit, in the order of self.habits,
+        in one vectorized pass; habits may share a name, so the list is not keyed by it."""
+        return [int(length) for length in self._longest_streaks()]
+
+    def get_longest_streak(self):
+        """Return the longest run of consecutive periods (days or weeks) checked off by any habit."""
+        longest = self._longest_streaks()
+        return int(longest.max()) if longest.size else 0
+
+    def get_longest_streak_for_habit(self, habit_name):
+        """Return the longest run of consecutive periods checked off for a given habit."""
+        position = self._index.get(habit_name)
+        if position is None:
+            return 0
+        start, stop = self._distinct_offsets[position], self._distinct_offsets[position + 1]
+        if stop == start:
+            return 0
+        _, lengths = self._runs(self._consecutive[start:stop - 1])
+        return int(lengths.max()) + 1 if lengths.size else 1
+
+    def get_longest_gap_for_habit(self, habit_name):
+        """Return the longest gap, in whole days, between consecutive check-ins of a habit."""
+        position, span = self._slice(habit_name)
+        if position is None or span.stop - span.start < 2:
+            return 0
+        return int(self._gaps[span.start:span.stop - 1].max())
+
+    def get_completion_rate(self, habit_name):
+        """Return the share of periods, from the first check-in to the last, with at least one check-in."""
+        position = self._index.get(habit_name)
+        if position is None:
+            return 0.0
+        start, stop = self._distinct_offsets[position], self._distinct_offsets[position + 1]
+        if stop == start:
+            return 0.0
+        span = int(self._distinct_periods[stop - 1] - self._distinct_periods[start]) + 1
+        return int(stop - start) / span
+
+    def get_period_counts(self, habit_name):
+        """Return the number of check-ins per day (daily habits) or week (weekly habits), keyed by period start."""
+        position, span = self._slice(habit_name)
+        if position is None:
+            return {}
+        periodicity = self.habits[position].periodicity
+        ordinals, counts = np.unique(self._periods[span], return_counts=True)
+        return {period_start(int(ordinal), periodicity): int(count) for ordinal, count in zip(ordinals, counts)}
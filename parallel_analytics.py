@@ -0,0 +1,178 @@
+""" Streak and completion statistics for every habit, computed on a process pool.
+
+analyze() splits the habits into contiguous ranges of habit id, or of user id, holding
+about the same number of check-ins each (sized from the habit_checkin_totals rollup).
+Every range is handed to a worker process that opens its own read-only connection,
+streams the range's check-ins in index order, merged with the per-day counts compaction
+left in habit_checkin_days, and builds one HabitCalendar per habit.
+The partial results (counts, top-K longest streaks and histograms, all integers) are
+merged in range order with total-order tie breaks, so the report does not depend on
+the number of workers or on which worker finishes first.
+
+Each range is read in its own transaction, so check-ins written while analyze() runs
+may be counted in some ranges and not in others.
+"""
+import heapq
+import multiprocessing
+import pathlib
+import sqlite3
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import groupby
+from habit_calendar import HabitCalendar, is_weekly, period_start
+from rollups import has_compacted_checkins, week_of
+
+AnalyticsReport = namedtuple("AnalyticsReport", [
+    "habits",                # number of habits
+    "tracked_habits",        # habits with at least one dated check-in
+    "checkins",              # dated check-ins
+    "on_track",              # habits checked in during the current or previous period
+    "completion_rate",       # checked periods / periods from first to last check-in, over all habits
+    "longest_streaks",       # top-K (habit_id, user_id, name, length, start date), longest first
+    "streak_histogram",      # {longest streak length: number of habits}
+    "completion_histogram",  # {decile 0-9: number of habits whose completion rate falls in it}
+])
+
+_KEYS = {"habit": "id", "user": "user_id"}
+
+
+def _connect_read_only(db_file):
+    return sqlite3.connect(f"{pathlib.Path(db_file).resolve().as_uri()}?mode=ro", uri=True)
+
+
+def partition_ranges(conn, partitions, by="habit"):
+    """ Split habit ids (by="habit") or user ids (by="user") into at most `partitions` inclusive
+    (low, high) ranges with about the same number of check-ins each """
+    column = _KEYS[by]
+    weights = conn.execute(f"""
+        SELECT h.{column}, SUM(COALESCE(t.checkins, 0) + 1)
+        FROM habits h LEFT JOIN habit_checkin_totals t ON t.habit_id = h.id
+        WHERE h.{column} IS NOT NULL
+        GROUP BY h.{column}
+        ORDER BY h.{column}
+    """).fetchall()
+    total = sum(weight for _, weight in weights)
+    ranges, low, seen = [], None, 0
+    for key, weight in weights:
+        if low is None:
+            low = key
+        seen += weight
+        # Close the range once it reaches its share of the weight
+        if seen * partitions >= total * (len(ranges) + 1):
+            ranges.append((low, key))
+            low = None
+    return ranges
+
+
+def _analyze_range(db_file, by, low, high, top_k, as_of):
+    """ Worker: the partial statistics of the habits in one range """
+    conn = _connect_read_only(db_file)
+    try:
+        conn.execute("BEGIN")
+        habits = {row[0]: row[1:] for row in conn.execute(
+            f"SELECT id, user_id, name, periodicity FROM habits WHERE {_KEYS[by]} BETWEEN ? AND ?", (low, high))}
+        if by == "habit":
+            scope = "habit_id BETWEEN ? AND ?"
+        else:
+            scope = "habit_id IN (SELECT id FROM habits WHERE user_id BETWEEN ? AND ?)"
+        # (habit_id, day, week, check-ins) rows
+        rows = conn.execute(f"""
+            SELECT habit_id, day_key, week_key, 1 FROM habit_tracking
+            WHERE {scope} ORDER BY habit_id
+        """, (low, high))
+        if has_compacted_checkins(conn):
+            rows = heapq.merge(rows, conn.execute(f"""
+                SELECT habit_id, day, {week_of("day")}, checkins FROM habit_checkin_days
+                WHERE {scope} ORDER BY habit_id
+            """, (low, high)), key=lambda row: row[0])
+
+        stats = {"habits": len(habits), "tracked_habits": 0, "checkins": 0, "on_track": 0,
+                 "checked_periods": 0, "span_periods": 0, "top": [],
+                 "streak_histogram": Counter(), "completion_histogram": Counter()}
+        for habit_id, group in groupby(rows, key=lambda row: row[0]):
+            if habit_id not in habits:
+                continue
+            user_id, name, periodicity = habits[habit_id]
+            column = 2 if is_weekly(periodicity) else 1
+            group = [row for row in group if row[column] is not None]
+            if not group:
+                continue
+            days = [row[column] for row in group]
+            calendar = HabitCalendar.from_periods(periodicity, days)
+            length, first = calendar.longest_run()
+            checked, span = len(calendar), calendar.last_period - calendar.first_period + 1
+
+            stats["tracked_habits"] += 1
+            stats["checkins"] += sum(row[3] for row in group)
+            stats["on_track"] += calendar.is_on_track(as_of)
+            stats["checked_periods"] += checked
+            stats["span_periods"] += span
+            stats["streak_histogram"][length] += 1
+            stats["completion_histogram"][min(9, checked * 10 // span)] += 1
+            stats["top"].append((-length, habit_id, user_id, name, period_start(first, periodicity)))
+        stats["top"] = heapq.nsmallest(top_k, stats["top"])
+        conn.execute("COMMIT")
+        return stats
+    finally:
+        conn.close()
+
+
+def analyze(db_file, workers=None, partitions=None, by="habit", top_k=10, as_of=None):
+    """ Compute an AnalyticsReport of every habit in db_file.
+
+    Args:
+        db_file (str): The database file; in-memory databases cannot be shared with workers.
+        workers (int): Worker processes, by default one per CPU; 1 runs in this process.
+        partitions (int): Number of ranges, by default four per worker so a slow range
+            does not hold up the rest.
+        by (str): "habit" to partition by habit id, "user" to keep each user's habits together.
+        top_k (int): Length of the longest-streak list.
+        as_of (datetime): The time the on-track count is computed for; defaults to now.
+
+    Returns:
+        AnalyticsReport: The same report whatever the number of workers and partitions.
+
+    """
+    if by not in _KEYS:
+        raise ValueError(f"Cannot partition by {by!r}; use 'habit' or 'user'")
+    if db_file == ":memory:":
+        raise ValueError("analyze() needs a database file the worker processes can open")
+    workers = workers or multiprocessing.cpu_count()
+    as_of = as_of or datetime.now()
+    conn = _connect_read_only(db_file)
+    try:
+        ranges = partition_ranges(conn, partitions or workers * 4, by)
+    finally:
+        conn.close()
+
+    jobs = [(db_file, by, low, high, top_k, as_of) for low, high in ranges]
+    if workers == 1:
+        results = [_analyze_range(*job) for job in jobs]
+    else:
+        # spawn rather than fork, so workers never inherit the parent's SQLite handles
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(_analyze_range, *zip(*jobs))) if jobs else []
+    return _merge(results, top_k)
+
+
+def _merge(results, top_k):
+    totals = Counter()
+    streak_histogram, completion_histogram = Counter(), Counter()
+    for stats in results:
+        for name in ("habits", "tracked_habits", "checkins", "on_track", "checked_periods", "span_periods"):
+            totals[name] += stats[name]
+        streak_histogram.update(stats["streak_histogram"])
+        completion_histogram.update(stats["completion_histogram"])
+    top = heapq.nsmallest(top_k, (entry for stats in results for entry in stats["top"]))
+    return AnalyticsReport(
+        habits=totals["habits"],
+        tracked_habits=totals["tracked_habits"],
+        checkins=totals["checkins"],
+        on_track=totals["on_track"],
+        completion_rate=totals["checked_periods"] / totals["span_periods"] if totals["span_periods"] else 0.0,
+        longest_streaks=[(habit_id, user_id, name, -length, start)
+                         for length, habit_id, user_id, name, start in top],
+        streak_histogram=dict(sorted(streak_histogram.items())),
+        completion_histogram=dict(sorted(completion_histogram.items())),
+    )
@@ -0,0 +1,214 @@
+""" Benchmark harness for the whole tracker.
+
+Builds a seeded synthetic database with loadgen, times every HabitTracker, Database and
+Analytics operation against it and writes p50/p99 latency, throughput and peak RSS as
+JSON. Two result files, e.g. from two commits, can then be compared:
+
+    python perf_suite.py run --users 100 --habits 10 --checkins 200 --output before.json
+    python perf_suite.py run --users 100 --habits 10 --checkins 200 --output after.json
+    python perf_suite.py compare before.json after.json --threshold 0.2
+
+compare exits with status 1 when any operation's p50 grew by more than the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from analytics import Analytics
+from connection import close_all_pools
+from database import Database
+from habit import Habit, User
+from habit_tracker import HabitTracker
+from loadgen import generate, habit_name
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """ Peak resident set size of this process in MB, or None where the platform cannot tell """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def time_operation(operation, arguments):
+    """ Call operation once per argument tuple and summarize the latencies """
+    latencies = []
+    for args in arguments:
+        start = time.perf_counter()
+        operation(*args)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "calls": len(latencies),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1e3, 4),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1e3, 4),
+        "mean_ms": round(total / len(latencies) * 1e3, 4),
+        "ops_per_sec": round(len(latencies) / total, 1) if total else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _load_user(database, user_id):
+    """ A User with its Habits and their check-ins, as Analytics expects them """
+    user = User(user_id, f"user{user_id}@example.com", f"user{user_id}", "", datetime.now())
+    for row in database.get_habits_by_user_id(user_id):
+        habit = Habit(row[0], row[2], row[3], row[4], database.db_file)
+        habit.tracking_data = [checked_at for _, _, checked_at in database.iter_habit_tracking(row[1])]
+        user.add_habit(habit)
+    return user
+
+
+def run_suite(users=20, habits_per_user=10, checkins_per_habit=100, repeat=200, seed=42, db_file=None):
+    """ Generate the data set and time every operation; returns the JSON-ready result """
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = db_file or os.path.join(tmp, "suite.db")
+        database = Database(db_file)
+        database.migrate()
+        start = time.perf_counter()
+        dataset = generate(db_file, users, habits_per_user, checkins_per_habit, seed)
+        dataset["generate_seconds"] = round(time.perf_counter() - start, 3)
+
+        rng = random.Random(seed)
+        user_ids = [rng.randint(1, users) for _ in range(repeat)]
+        names = [habit_name(user_id, rng.randint(1, habits_per_user)) for user_id in user_ids]
+        with database.pool.connection() as conn:
+            habit_ids = [row[0] for row in conn.execute(
+                "SELECT id FROM habits ORDER BY random() LIMIT ?", (repeat,))]
+        trackers = {user_id: HabitTracker(user_id, db_file) for user_id in set(user_ids)}
+        tracker = trackers[user_ids[0]]
+        # Operations that read every habit run fewer times so the suite stays quick
+        few = max(3, repeat // 20)
+        user = _load_user(database, user_ids[0])
+        analytics = Analytics(user)
+        habit_names = [habit.name for habit in user.habits] or [names[0]]
+        picks = [(rng.choice(habit_names),) for _ in range(repeat)]
+
+        operations = {
+            "HabitTracker.get_habit_info": (tracker.get_habit_info, [(n,) for n in names]),
+            "HabitTracker.get_all_habits": (tracker.get_all_habits, [()] * few),
+            "HabitTracker.get_habit_tracking_by_id": (tracker.get_habit_tracking_by_id,
+                                                      [(i,) for i in habit_ids]),
+            "HabitTracker.get_streak": (lambda u, n: trackers[u].get_streak(n), list(zip(user_ids, names))),
+            "HabitTracker.get_habits_with_longest_streak": (tracker.get_habits_with_longest_streak, [()] * few),
+            "HabitTracker.get_worst_streak_habit": (tracker.get_worst_streak_habit, [()] * few),
+            "HabitTracker.get_worst_habit_last_month": (tracker.get_worst_habit_last_month, [()] * few),
+            "Database.get_habits_by_user_id": (database.get_habits_by_user_id, [(u,) for u in user_ids]),
+            "Database.get_habit_tracking_by_habit_id": (database.get_habit_tracking_by_habit_id,
+                                                        [(i,) for i in habit_ids]),
+            "Database.iter_habit_tracking": (lambda i: sum(1 for _ in database.iter_habit_tracking(i)),
+                                             [(i,) for i in habit_ids]),
+            "Analytics.get_longest_streak": (analytics.get_longest_streak, [()] * few),
+            "Analytics.get_longest_streak_for_habit": (analytics.get_longest_streak_for_habit, picks),
+            "Analytics.get_longest_gap_for_habit": (analytics.get_longest_gap_for_habit, picks),
+            "Analytics.get_completion_rate": (analytics.get_completion_rate, picks),
+            "Analytics.get_period_counts": (analytics.get_period_counts, picks),
+            # Writes last, so the reads above all see the generated data set
+            "HabitTracker.mark_habit_as_done": (lambda u, n: trackers[u].mark_habit_as_done(u, n),
+                                                list(zip(user_ids, names))),
+            "HabitTracker.mark_habits_done_bulk": (
+                tracker.mark_habits_done_bulk,
+                [([(u, n, None) for u, n in zip(user_ids, names)],) for _ in range(few)]),
+            "HabitTracker.update_habit": (lambda n: tracker.update_habit(n, new_description="Updated"),
+                                          [(n,) for n in names]),
+            "HabitTracker.create_habit": (lambda u, i: trackers[u].create_habit(u, f"Suite {i}", "", "daily"),
+                                          [(u, i) for i, u in enumerate(user_ids)]),
+            "HabitTracker.remove_habit": (lambda u, i: trackers[u].remove_habit(f"Suite {i}"),
+                                          [(u, i) for i, u in enumerate(user_ids)]),
+        }
+        results = {name: time_operation(operation, arguments) for name, (operation, arguments) in operations.items()}
+        close_all_pools()
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": seed,
+            "repeat": repeat,
+        },
+        "dataset": dataset,
+        "operations": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(before, after, threshold=0.2):
+    """ Per operation p50 ratios of after to before, and the operations that regressed beyond threshold """
+    rows, regressions = [], []
+    for name, new in after["operations"].items():
+        old = before["operations"].get(name)
+        if old is None or not old["p50_ms"]:
+            continue
+        ratio = new["p50_ms"] / old["p50_ms"]
+        rows.append((name, old["p50_ms"], new["p50_ms"], ratio))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Generate a data set, time every operation and print or save JSON")
+    run.add_argument("--users", type=int, default=20)
+    run.add_argument("--habits", type=int, default=10, help="Habits per user")
+    run.add_argument("--checkins", type=int, default=100, help="Average check-ins per habit")
+    run.add_argument("--repeat", type=int, default=200, help="Calls per operation")
+    run.add_argument("--seed", type=int, default=42)
+    run.add_argument("--output", help="Write the JSON here instead of to stdout")
+    check = commands.add_parser("compare", help="Compare two result files")
+    check.add_argument("before")
+    check.add_argument("after")
+    check.add_argument("--threshold", type=float, default=0.2, help="Allowed relative p50 slowdown")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        result = run_suite(args.users, args.habits, args.checkins, args.repeat, args.seed)
+        text = json.dumps(result, indent=2)
+        if args.output:
+            with open(args.output, "w") as file:
+                file.write(text + "\n")
+        else:
+            print(text)
+        return 0
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+    rows, regressions = compare(before, after, args.threshold)
+    for name, old, new, ratio in rows:
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:50} {old:10.4f} ms -> {new:10.4f} ms  x{ratio:.2f}{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+""" Read replicas: analytics against a snapshot of the database instead of the live file.
+
+An analytics call on the live database first rebuilds the habit_streaks rows the triggers
+marked stale, in a write transaction, and then reads while check-ins are being written,
+so under load it queues behind writers, makes them queue behind it, and can fail with
+"database is locked" once the timeout runs out. A ReadReplica copies the database with
+the SQLite online backup API (sqlite3.Connection.backup), pages_per_step pages per step,
+into a new in-memory database or a secondary file, rebuilds the stale streak rows in the
+copy, once per refresh instead of once per read, and then swaps the copy in. Readers see
+one consistent snapshot and never touch the live file, and the copy only ever reads it:
+writing the rebuilt rows back would put the replica in the writers' queue again. Each
+reader thread checks its own read-only connection to the copy out of a ConnectionPool of
+max_readers connections, so reads of one snapshot run side by side instead of taking
+turns; an in-memory copy is a named memdb database that all of them open.
+
+A write committed between two steps makes SQLite restart the copy from the first page,
+so with a writer committing every few milliseconds a step-wise copy may never finish:
+after max_restarts restarts the copy is redone in a single step. In WAL mode that step
+is one read transaction, which writers do not wait for either; it only holds back
+checkpoints while it runs.
+
+A snapshot is refreshed when a read finds it older than max_staleness seconds, and every
+interval seconds after start(). PRAGMA data_version tells whether anything was committed
+since the last copy; if nothing was, the snapshot is only marked fresh again. lag() is
+the age of the snapshot in seconds, stats() also counts the check-ins it is missing.
+"""
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from connection import ConnectionPool
+from instrumentation import InstrumentedConnection
+from streaks import rebuild_streaks
+
+_SNAPSHOT_PRAGMAS = {"query_only": "ON", "temp_store": "MEMORY"}
+# Numbers the in-memory copies, whose names are shared by every connection in the process
+_memory_copies = itertools.count()
+
+
+class _Restarted(Exception):
+    pass
+
+
+class _Snapshot:
+    def __init__(self, pool, owner, taken_at, version):
+        # Read-only connections to the copy, one per reading thread
+        self.pool = pool
+        # The connection the copy was made on, if still open: an in-memory copy lives as long as it does
+        self.owner = owner
+        # time.monotonic() when the live database was last known to hold exactly this data
+        self.taken_at = taken_at
+        self.version = version
+        self.readers = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def read(self):
+        """ Yield a connection to the copy, or None once the snapshot has been retired """
+        with self._cond:
+            retired = self.closed
+            if not retired:
+                self.readers += 1
+        if retired:
+            yield None
+            return
+        try:
+            with self.pool.connection() as conn:
+                yield conn
+        finally:
+            with self._cond:
+                self.readers -= 1
+                self._cond.notify_all()
+
+    def retire(self, wait=False):
+        """ Hand out no more connections and close them as they come back; with wait, first let the
+        reads in progress finish """
+        with self._cond:
+            self.closed = True
+            if wait:
+                self._cond.wait_for(lambda: self.readers == 0)
+        self.pool.close()
+        if self.owner is not None:
+            self.owner.close()
+
+
+class ReadReplica:
+    """ A snapshot of db_file that is refreshed with the backup API and serves analytics reads.
+
+    Args:
+        db_file (str): The live database.
+        path (str): Where the snapshot lives: ':memory:' or a file, which is replaced on every refresh.
+        max_staleness (float): Seconds after which a read refreshes the snapshot first; None never does.
+        pages_per_step (int): Pages copied per backup step; -1 copies everything in one step.
+        max_restarts (int): Restarts of a step-wise copy after which it is redone in one step.
+        max_readers (int): Connections to the snapshot, and so reads served at the same time.
+    """
+
+    def __init__(self, db_file, path=":memory:", max_staleness=5.0, pages_per_step=1024, max_restarts=2,
+                 max_readers=8):
+        self.db_file = db_file
+        self.path = path
+        self.max_staleness = max_staleness
+        self.pages_per_step = pages_per_step
+        self.max_restarts = max_restarts
+        self.max_readers = max_readers
+        self.refreshes = 0
+        self.skipped = 0
+        self.restarts = 0
+        self.last_refresh_ms = None
+        self.last_error = None
+        self._source = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        # Held while a file snapshot is replaced, which readers of the old one wait for
+        self._swap_lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = None
+        self._thread = None
+
+    def lag(self):
+        """ Seconds since the snapshot last matched the live database; None before the first refresh """
+        snapshot = self._snapshot
+        return None if snapshot is None else time.monotonic() - snapshot.taken_at
+
+    def _open(self, path, uri=False):
+        conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, factory=InstrumentedConnection,
+                               uri=uri)
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _copy(self):
+        """ Back the live database up into a new database and bring its stale streaks up to date """
+        target_path = self.path if self.path == ":memory:" else f"{self.path}.tmp"
+        if target_path != ":memory:" and os.path.exists(target_path):
+            os.remove(target_path)
+        target = self._open(target_path)
+        try:
+            self._backup(target)
+            stale = [row[0] for row in target.execute("SELECT habit_id FROM habit_streaks WHERE stale = 1")]
+            if stale:
+                target.execute("BEGIN")
+                rebuild_streaks(target, stale)
+                target.execute("COMMIT")
+        except BaseException:
+            target.close()
+            raise
+        return target
+
+    def _backup(self, target):
+        """ Copy in steps of pages_per_step pages, or in one step once the copy keeps restarting """
+        remaining = [None]
+        restarts = [0]
+
+        def progress(status, left, total):
+            # Each step copies at least one page, so no fewer pages left means the copy started over
+            if remaining[0] is not None and left >= remaining[0]:
+                restarts[0] += 1
+                if restarts[0] > self.max_restarts:
+                    raise _Restarted
+            remaining[0] = left
+
+        try:
+            self._source.backup(target, pages=self.pages_per_step, progress=progress)
+        except _Restarted:
+            self._source.backup(target, pages=-1)
+        finally:
+            self.restarts += restarts[0]
+
+    def _share(self, target):
+        """ Move an in-memory copy into a memdb database that other connections open by name. A backup
+        keeps the live file's header, which marks a WAL database and which memdb cannot open, so the
+        copy is first marked a rollback-journal database (header bytes 18 and 19) """
+        image = bytearray(target.serialize())
+        image[18:20] = b"\x01\x01"
+        target.deserialize(image)
+        name = f"file:/habit-replica-{os.getpid()}-{next(_memory_copies)}?vfs=memdb"
+        owner = self._open(name, uri=True)
+        try:
+            target.backup(owner)
+        except BaseException:
+            owner.close()
+            raise
+        finally:
+            target.close()
+        return owner, name
+
+    def _publish(self, target, taken_at, version):
+        """ Swap a new copy in. Reads in progress finish on an old in-memory copy; an old file is only
+        replaced once they are done """
+        old = self._snapshot
+        if self.path == ":memory:":
+            target, name = self._share(target)
+            pool = ConnectionPool(name, size=self.max_readers, pragmas=_SNAPSHOT_PRAGMAS, uri=True)
+            self._snapshot = _Snapshot(pool, target, taken_at, version)
+            if old is not None:
+                old.retire()
+            return
+        with self._swap_lock:
+            if old is not None:
+                old.retire(wait=True)
+            target.close()
+            os.replace(f"{self.path}.tmp", self.path)
+            pool = ConnectionPool(self.path, size=self.max_readers, pragmas=_SNAPSHOT_PRAGMAS)
+            self._snapshot = _Snapshot(pool, None, taken_at, version)
+
+    def refresh(self, max_age=None):
+        """ Take a new snapshot unless the current one is at most max_age seconds old or nothing was
+        committed since it was taken; True if the database was copied """
+        with self._refresh_lock:
+            lag = self.lag()
+            if lag is not None and max_age is not None and lag <= max_age:
+                return False
+            checked_at = time.monotonic()
+            version = self._source.execute("PRAGMA data_version").fetchone()[0]
+            if self._snapshot is not None and self._snapshot.version == version:
+                self._snapshot.taken_at = checked_at
+                self.skipped += 1
+                return False
+            began = time.perf_counter()
+            self._publish(self._copy(), checked_at, version)
+            self.last_refresh_ms = round((time.perf_counter() - began) * 1e3, 2)
+            self.refreshes += 1
+            return True
+
+    @contextmanager
+    def connection(self):
+        """ Yield a read-only connection to a snapshot no older than max_staleness seconds.
+
+        Nested calls on one thread share the snapshot of the outermost one.
+        """
+        local = self._local
+        if getattr(local, "conn", None) is not None:
+            yield local.conn
+            return
+        while True:
+            lag = self.lag()
+            # Checked before refresh() too, so reads do not wait for a background refresh they do not need
+            if lag is None or (self.max_staleness is not None and lag > self.max_staleness):
+                self.refresh(self.max_staleness)
+            snapshot = self._snapshot
+            with snapshot.read() as conn:
+                if conn is None:
+                    # Retired by a refresh: wait until a replaced file is swapped in, then read the new copy
+                    with self._swap_lock:
+                        pass
+                    continue
+                local.conn = conn
+                try:
+                    yield conn
+                finally:
+                    local.conn = None
+                return
+
+    def start(self, interval=1.0):
+        """ Refresh the snapshot every interval seconds on a background thread """
+        if self._thread is not None:
+            return
+        self._stop = threading.Event()
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.refresh()
+                    self.last_error = None
+                except sqlite3.Error as e:
+                    self.last_error = str(e)
+
+        self._thread = threading.Thread(target=run, name="read-replica", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        """ Lag in seconds and in check-ins not in the snapshot yet, and refresh counts and time """
+        result = {"lag_s": self.lag(), "refreshes": self.refreshes, "skipped": self.skipped, "restarts": self.restarts,
+                  "last_refresh_ms": self.last_refresh_ms, "last_error": self.last_error, "checkins_behind": None}
+        snapshot = self._snapshot
+        if snapshot is not None:
+            live = self._source.execute("SELECT COALESCE(MAX(id), 0) FROM habit_tracking").fetchone()[0]
+            with snapshot.read() as conn:
+                if conn is not None:
+                    copied = conn.execute("SELECT COALESCE(MAX(id), 0) FROM habit_tracking").fetchone()[0]
+                    result["checkins_behind"] = live - copied
+        return result
+
+    def close(self):
+        self.stop()
+        with self._refresh_lock:
+            snapshot, self._snapshot = self._snapshot, None
+            if snapshot is not None:
+                snapshot.retire(wait=True)
+            self._source.close()
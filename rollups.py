@@ -0,0 +1,222 @@
+""" Per-day and per-week check-in counts for ranking queries.
+
+habit_daily_counts and habit_weekly_counts hold the number of check-ins of each habit
+per day and per Monday-based week, numbered as in habit_calendar, and
+habit_checkin_totals the number per habit, counted by the day_key and week_key columns
+of habit_tracking (see timekeys.py). Triggers keep them exact on every insert, delete
+and update of habit_tracking, so best/worst rankings over any date range read at
+most a dozen daily rows plus one weekly row per week and habit, or one row per habit for
+all time, instead of grouping every check-in in the range. Rebuilds also count the
+check-ins that compaction.py moved out of habit_tracking into habit_checkin_days.
+"""
+from habit_calendar import EPOCH
+
+
+def day_sql(column):
+    """ SQL computing the habit_calendar day ordinal of a timestamp column; NULL when it is not a date """
+    return f"CAST(strftime('%s', date({column})) AS INTEGER) / 86400"
+
+
+def week_of(day):
+    """ SQL computing the habit_calendar week ordinal of a day ordinal """
+    # Offset so SQLite's truncating division floors for dates before 1970
+    return f"({day} + 7000003) / 7 - 1000000"
+
+
+def week_sql(column):
+    return week_of(day_sql(column))
+
+
+def has_period_keys(conn):
+    """ Whether habit_tracking has the day_key and week_key columns; databases are migrated to
+    them after the rollups and streaks are created, which then parse checked_at instead """
+    return any(column[1] == "day_key" for column in conn.execute("PRAGMA table_xinfo(habit_tracking)"))
+
+
+def has_compacted_checkins(conn):
+    """ Whether compaction has folded check-ins into habit_checkin_days """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'habit_checkin_days'").fetchone() is None:
+        return False
+    return conn.execute("SELECT 1 FROM habit_checkin_days LIMIT 1").fetchone() is not None
+
+
+def _rollups(row=None, keys=True):
+    """ (table, period column, period expression) of each rollup for a habit_tracking row, NEW,
+    OLD or None for the table's own columns; the totals table has no period """
+    prefix = f"{row}." if row else ""
+    if keys:
+        day, week = f"{prefix}day_key", f"{prefix}week_key"
+    else:
+        day, week = day_sql(f"{prefix}checked_at"), week_sql(f"{prefix}checked_at")
+    return (("habit_daily_counts", "day", day),
+            ("habit_weekly_counts", "week", week),
+            ("habit_checkin_totals", None, day))
+
+
+def _add(row, sign, keys):
+    """ Trigger statements adding sign (+1/-1) check-ins of `row` (NEW or OLD) to the rollups """
+    statements = []
+    for table, key, expression in _rollups(row, keys):
+        columns = f"{key}, habit_id" if key else "habit_id"
+        values = f"{expression}, {row}.habit_id" if key else f"{row}.habit_id"
+        match = f"{key} = {expression} AND habit_id = {row}.habit_id" if key else f"habit_id = {row}.habit_id"
+        # Check-ins without a valid date are left out of every rollup
+        if sign > 0:
+            statements.append(f"""
+                INSERT INTO {table} ({columns}, checkins)
+                SELECT {values}, 1 WHERE {expression} IS NOT NULL
+                ON CONFLICT ({columns}) DO UPDATE SET checkins = checkins + 1;""")
+        else:
+            statements.append(f"""
+                UPDATE {table} SET checkins = checkins - 1 WHERE {match} AND {expression} IS NOT NULL;
+                DELETE FROM {table} WHERE {match} AND checkins <= 0;""")
+    return "".join(statements)
+
+
+_ROLLUP_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS habit_daily_counts (
+            day INTEGER NOT NULL,
+            habit_id INTEGER NOT NULL,
+            checkins INTEGER NOT NULL,
+            PRIMARY KEY (day, habit_id)
+        ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS habit_weekly_counts (
+            week INTEGER NOT NULL,
+            habit_id INTEGER NOT NULL,
+            checkins INTEGER NOT NULL,
+            PRIMARY KEY (week, habit_id)
+        ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS habit_checkin_totals (
+            habit_id INTEGER PRIMARY KEY,
+            checkins INTEGER NOT NULL
+        )''',
+]
+
+
+def rollup_schema(keys=True):
+    """ The rollup tables and the triggers maintaining them, from the period keys or from checked_at """
+    return _ROLLUP_TABLES + [
+        f'''CREATE TRIGGER IF NOT EXISTS habit_tracking_rollup_insert AFTER INSERT ON habit_tracking
+            BEGIN {_add("NEW", 1, keys)}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS habit_tracking_rollup_delete AFTER DELETE ON habit_tracking
+            BEGIN {_add("OLD", -1, keys)}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS habit_tracking_rollup_update AFTER UPDATE OF habit_id, checked_at ON habit_tracking
+            BEGIN {_add("OLD", -1, keys)} {_add("NEW", 1, keys)}
+            END''',
+    ]
+
+
+ROLLUP_SCHEMA = rollup_schema()
+
+
+# Bounds standing in for an open-ended range, far outside any real day ordinal
+_MIN_DAY = -10 ** 9
+_MAX_DAY = 10 ** 9
+
+
+def _ordinal(day):
+    return (day - EPOCH).days
+
+
+def rank_habits(conn, start=None, end=None, limit=1, best=False, user_id=None):
+    """ Rank habits by their number of check-ins between two dates, from the rollups.
+
+    Args:
+        conn: A connection to the database.
+        start (date): First day counted, or None for no lower bound.
+        end (date): Last day counted, or None for no upper bound.
+        limit (int): Number of habits returned.
+        best (bool): Most check-ins first if True, fewest first otherwise.
+        user_id (int): Only rank this user's habits; None ranks every habit.
+
+    Returns:
+        list: (habit_id, name, checkins) tuples. Only habits checked in at least once in the
+        range are ranked, and ties are broken by habit id.
+
+    """
+    if start is None and end is None:
+        counts = "SELECT habit_id, checkins FROM habit_checkin_totals"
+        parameters = []
+    else:
+        counts, parameters = _range_counts(start, end)
+
+    where = ""
+    if user_id is not None:
+        where = "WHERE h.user_id = ?"
+        parameters.append(user_id)
+    parameters.append(limit)
+    return conn.execute(f"""
+        WITH counts(habit_id, checkins) AS ({counts})
+        SELECT c.habit_id, h.name, SUM(c.checkins) AS total
+        FROM counts c JOIN habits h ON h.id = c.habit_id
+        {where}
+        GROUP BY c.habit_id
+        ORDER BY total {"DESC" if best else "ASC"}, c.habit_id
+        LIMIT ?
+    """, parameters).fetchall()
+
+
+def _range_counts(start, end):
+    """ A query of (habit_id, checkins) rows that sum to each habit's check-ins between start and end """
+    first_day = _MIN_DAY if start is None else _ordinal(start)
+    last_day = _MAX_DAY if end is None else _ordinal(end)
+    # Week w spans days 7w - 3 .. 7w + 3; count the weeks lying wholly inside the range
+    # from the weekly table and only the partial weeks at either end from the daily one
+    first_week = -((-(first_day + 3)) // 7)
+    last_week = (last_day - 3) // 7
+    if first_week <= last_week:
+        counts = """
+            SELECT habit_id, checkins FROM habit_weekly_counts WHERE week BETWEEN ? AND ?
+            UNION ALL
+            SELECT habit_id, checkins FROM habit_daily_counts WHERE day BETWEEN ? AND ?
+            UNION ALL
+            SELECT habit_id, checkins FROM habit_daily_counts WHERE day BETWEEN ? AND ?"""
+        parameters = [first_week, last_week, first_day, 7 * first_week - 4, 7 * last_week + 4, last_day]
+    else:
+        counts = "SELECT habit_id, checkins FROM habit_daily_counts WHERE day BETWEEN ? AND ?"
+        parameters = [first_day, last_day]
+    return counts, parameters
+
+
+def rebuild_rollups(conn, habit_ids=None):
+    """ Recompute the rollups from habit_tracking and habit_checkin_days, for the given habits or all of them """
+    if habit_ids is None:
+        chunks, scope = [[]], ""
+    else:
+        habit_ids = list(habit_ids)
+        chunks = [habit_ids[start:start + 500] for start in range(0, len(habit_ids), 500)]
+    keys = has_period_keys(conn)
+    compacted = has_compacted_checkins(conn)
+    for chunk in chunks:
+        if habit_ids is not None:
+            scope = f"habit_id IN ({', '.join('?' for _ in chunk)})"
+        for table, key, expression in _rollups(keys=keys):
+            conn.execute(f"DELETE FROM {table}" + (f" WHERE {scope}" if scope else ""), chunk)
+            columns = f"{key}, habit_id" if key else "habit_id"
+            group = f"{expression}, habit_id" if key else "habit_id"
+            conn.execute(f"""
+                INSERT INTO {table} ({columns}, checkins)
+                SELECT {group}, COUNT(*) FROM habit_tracking
+                WHERE {expression} IS NOT NULL {f"AND {scope}" if scope else ""}
+                GROUP BY {group}
+            """, chunk)
+            if compacted:
+                period = {"day": "day", "week": week_of("day")}.get(key)
+                group = f"{period}, habit_id" if key else "habit_id"
+                conn.execute(f"""
+                    INSERT INTO {table} ({columns}, checkins)
+                    SELECT {group}, SUM(checkins) FROM habit_checkin_days
+                    WHERE {scope or "true"}
+                    GROUP BY {group}
+                    ON CONFLICT ({columns}) DO UPDATE SET checkins = checkins + excluded.checkins
+                """, chunk)
+
+
+def create_rollup_tables(conn):
+    """ Migration step: create the rollups with their triggers and fill them from existing check-ins """
+    for sql in rollup_schema(has_period_keys(conn)):
+        conn.execute(sql)
+    rebuild_rollups(conn)
+
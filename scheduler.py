@@ -0,0 +1,197 @@
+""" Due-now reminders for every habit, from a heap of deadlines.
+
+A streak survives while the current or the previous period is checked off (see
+Habit.check_habit_status). So a habit last checked off in period p falls due when period
+p + 1 starts, in its user's time zone, and its streak breaks when period p + 2 starts.
+DueScheduler keeps, for every habit, a heap entry for the next of these two moments, which
+records whether it is the DUE or the OVERDUE one. It is
+built in O(n) from habit_streaks.last_period, and due_events() pops the entries whose time
+has passed as DUE and OVERDUE events, in O(log n) each. A check-in pushes a new entry for
+its habit in O(log n) too; the entry it replaces stays in the heap and is skipped when it
+reaches the top, since it was computed for an older last period.
+
+The scheduler lives in memory. sync() reads the check-ins written since the last load or
+sync, by id, so one process can follow the check-ins of many writers.
+"""
+import heapq
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from connection import get_pool
+from habit_calendar import EPOCH, is_weekly
+from streaks import refresh_stale_streaks
+
+DUE = "due"
+OVERDUE = "overdue"
+
+ScheduleEvent = namedtuple("ScheduleEvent", ["kind", "at", "habit_id", "user_id", "last_period"])
+
+_HabitState = namedtuple("_HabitState", ["user_id", "weekly", "utc_offset", "last_period"])
+
+
+def period_start_epoch(ordinal, weekly, utc_offset=None):
+    """ Epoch second at which a day or week period starts for a user utc_offset minutes east of UTC;
+    None is the server's local time zone """
+    day = ordinal * 7 - 3 if weekly else ordinal
+    if utc_offset is None:
+        return int(datetime.combine(EPOCH + timedelta(days=day), datetime.min.time()).timestamp())
+    return day * 86400 - utc_offset * 60
+
+
+class DueScheduler:
+    """ A heap of the next due time or deadline of every habit with a check-in.
+
+    Args:
+        remind_before (int): Seconds before the deadline at which a habit falls due, instead of
+            when the period after its last check-in starts; None for the period start. 0 makes the
+            DUE event coincide with the OVERDUE one.
+    """
+
+    def __init__(self, remind_before=None):
+        if remind_before is not None and remind_before < 0:
+            raise ValueError(f"remind_before must not be negative, got {remind_before}")
+        self.remind_before = remind_before
+        self.last_checkin_id = 0
+        self._habits = {}
+        self._heap = []
+
+    @classmethod
+    def from_database(cls, db_file, remind_before=None, now=None):
+        scheduler = cls(remind_before)
+        scheduler.load(get_pool(db_file), now)
+        return scheduler
+
+    def __len__(self):
+        return len(self._habits)
+
+    def _times(self, state):
+        """ (due, deadline) epoch seconds of a habit """
+        deadline = period_start_epoch(state.last_period + 2, state.weekly, state.utc_offset)
+        due = period_start_epoch(state.last_period + 1, state.weekly, state.utc_offset)
+        if self.remind_before is not None:
+            due = max(due, deadline - self.remind_before)
+        return due, deadline
+
+    def _entry(self, habit_id, state, now):
+        """ The heap entry of a habit's next event after now, or None once its streak is broken """
+        due, deadline = self._times(state)
+        if deadline <= now:
+            return None
+        # A habit that is already due stays in the heap so its DUE event is still emitted
+        return due, habit_id, state.last_period, DUE
+
+    def load(self, pool, now=None):
+        """ Rebuild the heap from habit_streaks; habits whose streak broke before now are left out
+        until their next check-in """
+        now = time.time() if now is None else now
+        refresh_stale_streaks(pool)
+        with pool.transaction("DEFERRED") as conn:
+            self.last_checkin_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM habit_tracking").fetchone()[0]
+            rows = conn.execute("""
+                SELECT s.habit_id, h.user_id, h.periodicity, u.utc_offset, s.last_period
+                FROM habit_streaks s
+                JOIN habits h ON h.id = s.habit_id
+                LEFT JOIN users u ON u.id = h.user_id
+                WHERE s.last_period IS NOT NULL
+            """)
+            self._habits = {}
+            heap = []
+            for habit_id, user_id, periodicity, utc_offset, last_period in rows:
+                state = _HabitState(user_id, is_weekly(periodicity), utc_offset, last_period)
+                self._habits[habit_id] = state
+                entry = self._entry(habit_id, state, now)
+                if entry is not None:
+                    heap.append(entry)
+        heapq.heapify(heap)
+        self._heap = heap
+
+    def add(self, habit_id, user_id, periodicity, last_period, utc_offset=None):
+        """ Start tracking a habit, or replace what is known about it """
+        state = _HabitState(user_id, is_weekly(periodicity), utc_offset, last_period)
+        self._habits[habit_id] = state
+        self._push(habit_id, state)
+
+    def forget(self, habit_id):
+        """ Stop tracking a deleted habit; its heap entries are skipped from now on """
+        self._habits.pop(habit_id, None)
+
+    def checked_in(self, habit_id, period):
+        """ Record a check-in in period (a habit_calendar ordinal); False if the habit is unknown """
+        state = self._habits.get(habit_id)
+        if state is None:
+            return False
+        if period > state.last_period:
+            state = state._replace(last_period=period)
+            self._habits[habit_id] = state
+            self._push(habit_id, state)
+        return True
+
+    def _push(self, habit_id, state):
+        heapq.heappush(self._heap, (self._times(state)[0], habit_id, state.last_period, DUE))
+        # Superseded entries are only dropped when they reach the top; rebuild once they dominate
+        if len(self._heap) > 2 * len(self._habits) + 1024:
+            self._heap = [entry for entry in self._heap if self._is_current(entry)]
+            heapq.heapify(self._heap)
+
+    def _is_current(self, entry):
+        state = self._habits.get(entry[1])
+        return state is not None and state.last_period == entry[2]
+
+    def sync(self, pool):
+        """ Apply the check-ins written since the last load or sync; the number applied """
+        applied = 0
+        unknown = {}
+        with pool.connection() as conn:
+            rows = conn.execute("SELECT t.id, t.habit_id, t.day_key, t.week_key FROM habit_tracking t "
+                                "WHERE t.id > ? ORDER BY t.id", (self.last_checkin_id,)).fetchall()
+            for checkin_id, habit_id, day_key, week_key in rows:
+                self.last_checkin_id = checkin_id
+                if day_key is None:
+                    continue
+                state = self._habits.get(habit_id)
+                if state is None:
+                    unknown.setdefault(habit_id, []).append((day_key, week_key))
+                    continue
+                self.checked_in(habit_id, week_key if state.weekly else day_key)
+                applied += 1
+            # First check-ins of habits that were not tracked yet
+            unknown_ids = list(unknown)
+            for start in range(0, len(unknown_ids), 500):
+                chunk = unknown_ids[start:start + 500]
+                for habit_id, user_id, periodicity, utc_offset in conn.execute(f"""
+                    SELECT h.id, h.user_id, h.periodicity, u.utc_offset FROM habits h
+                    LEFT JOIN users u ON u.id = h.user_id
+                    WHERE h.id IN ({', '.join('?' for _ in chunk)})
+                """, chunk):
+                    weekly = is_weekly(periodicity)
+                    periods = [week if weekly else day for day, week in unknown[habit_id]]
+                    self.add(habit_id, user_id, periodicity, max(periods), utc_offset)
+                    applied += len(periods)
+        return applied
+
+    def next_at(self):
+        """ Epoch second of the next event, or None when no habit has one """
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def due_events(self, now=None):
+        """ Yield the DUE and OVERDUE events up to now in time order, removing them from the heap """
+        now = time.time() if now is None else now
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            at, habit_id, last_period, kind = heapq.heappop(heap)
+            state = self._habits.get(habit_id)
+            if state is None or state.last_period != last_period:
+                continue
+            if kind == DUE:
+                heapq.heappush(heap, (self._times(state)[1], habit_id, last_period, OVERDUE))
+            yield ScheduleEvent(kind, at, habit_id, state.user_id, last_period)
+
+    def dispatch(self, callback, now=None):
+        """ Call callback(event) for every event up to now; the number of events """
+        count = 0
+        for event in self.due_events(now):
+            callback(event)
+            count += 1
+        return count
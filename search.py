@@ -0,0 +1,168 @@
+""" Full-text search over habit names and descriptions.
+
+habit_search is an FTS5 table with one row per habit, keyed by habit id, that triggers on
+habits keep in step with every insert, delete and rename. Besides the name and the
+description it holds an `owner` token, u<user_id>, so a search scoped to one user is a
+single FTS5 query instead of a match over every user's habits followed by a filter.
+Matching is case- and accent-insensitive and every query word is a prefix, so "run"
+finds "Running". Searches over every user are ranked by bm25 with the name weighing more
+than the description. bm25 reads every user's matches to weigh the query words, so a
+search scoped to one user fetches that user's matches unranked, which only touches the
+user's rows, and orders them by the same column weights: words found in the name first.
+When nothing matches, each query word is replaced by the closest indexed
+words sharing its first letter (read from the habit_search_vocab table), so a typo like
+"excercise" still finds "Exercise".
+"""
+import difflib
+import re
+import unicodedata
+from collections import namedtuple
+
+SearchResult = namedtuple("SearchResult", ["habit_id", "user_id", "name", "description", "score", "fuzzy"])
+
+# bm25 column weights: owner, name, description
+_WEIGHTS = (0.0, 10.0, 1.0)
+_WORD = re.compile(r"\w+")
+# Longest prefix length in the habit_search prefix index
+_INDEXED_PREFIX = 3
+
+SEARCH_SCHEMA = [
+    # Prefix indexes make 2 and 3 character prefix queries as cheap as whole words
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS habit_search USING fts5(
+            owner, name, description,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )''',
+    "CREATE VIRTUAL TABLE IF NOT EXISTS habit_search_vocab USING fts5vocab(habit_search, 'col')",
+    '''CREATE TRIGGER IF NOT EXISTS habits_search_insert AFTER INSERT ON habits
+        BEGIN
+            INSERT INTO habit_search (rowid, owner, name, description)
+            VALUES (NEW.id, 'u' || NEW.user_id, NEW.name, NEW.description);
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS habits_search_delete AFTER DELETE ON habits
+        BEGIN
+            DELETE FROM habit_search WHERE rowid = OLD.id;
+        END''',
+    '''CREATE TRIGGER IF NOT EXISTS habits_search_update AFTER UPDATE OF id, user_id, name, description ON habits
+        BEGIN
+            DELETE FROM habit_search WHERE rowid = OLD.id;
+            INSERT INTO habit_search (rowid, owner, name, description)
+            VALUES (NEW.id, 'u' || NEW.user_id, NEW.name, NEW.description);
+        END''',
+    # Exact name lookups ignore ASCII case, as habit names are typed in by hand
+    "CREATE INDEX IF NOT EXISTS idx_habits_user_name_nocase ON habits (user_id, name COLLATE NOCASE)",
+]
+
+
+def rebuild_search_index(conn):
+    """ Refill habit_search from the habits table """
+    conn.execute("DELETE FROM habit_search")
+    conn.execute("INSERT INTO habit_search (rowid, owner, name, description) "
+                 "SELECT id, 'u' || user_id, name, description FROM habits")
+
+
+def create_search_index(conn):
+    """ Migration step: create the search table and its triggers and index the existing habits """
+    for sql in SEARCH_SCHEMA:
+        conn.execute(sql)
+    rebuild_search_index(conn)
+
+
+def _words(text):
+    """ Lower-cased words of text with their accents dropped, as the tokenizer indexes them """
+    text = "".join(char for char in unicodedata.normalize("NFKD", text or "") if not unicodedata.combining(char))
+    return [word.lower() for word in _WORD.findall(text)]
+
+
+def _scoped(user_id, expression):
+    """ Restrict an FTS5 expression over name and description to the habits of user_id, unless None """
+    expression = f"{{name description}} : ({expression})"
+    return expression if user_id is None else f'owner : "u{int(user_id)}" AND {expression}'
+
+
+def _score(groups, name, description):
+    """ Sum, over the groups of alternative prefixes, of the weights of the columns holding a word that
+    starts with one of the group's prefixes; None unless every group is found in name or description """
+    score = 0.0
+    columns = [(weight, _words(text)) for weight, text in zip(_WEIGHTS[1:], (name, description))]
+    for group in groups:
+        found = [weight for weight, tokens in columns if any(token.startswith(group) for token in tokens)]
+        if not found:
+            return None
+        score += sum(found)
+    return score
+
+
+def _rank_user(conn, user_id, expression, groups, limit):
+    """ The user's habits matching expression and every group of prefixes, ranked by _score, then habit id """
+    rows = conn.execute("SELECT rowid, CAST(substr(owner, 2) AS INTEGER), name, description "
+                        "FROM habit_search WHERE habit_search MATCH ?", (_scoped(user_id, expression),))
+    ranked = []
+    for row in rows:
+        score = _score(groups, row[2], row[3])
+        if score is not None:
+            ranked.append(row + (score,))
+    return sorted(ranked, key=lambda row: (-row[4], row[0]))[:limit]
+
+
+def _rank_all(conn, expression, limit):
+    weights = ", ".join(map(str, _WEIGHTS))
+    return conn.execute(f"""
+        SELECT rowid, CAST(substr(owner, 2) AS INTEGER), name, description, -bm25(habit_search, {weights})
+        FROM habit_search
+        WHERE habit_search MATCH ?
+        ORDER BY bm25(habit_search, {weights}), rowid
+        LIMIT ?
+    """, (_scoped(None, expression), limit)).fetchall()
+
+
+def _closest_terms(conn, word, cutoff):
+    """ Indexed name and description words that start like word and are spelled close to it """
+    candidates = [row[0] for row in conn.execute(
+        "SELECT DISTINCT term FROM habit_search_vocab WHERE term >= ? AND term < ? AND col != 'owner'",
+        (word[0], chr(ord(word[0]) + 1)))]
+    return difflib.get_close_matches(word, candidates, n=3, cutoff=cutoff)
+
+
+def search_habits(conn, user_id, text, limit=10, fuzzy=True, cutoff=0.75):
+    """ Rank the habits whose name or description matches text.
+
+    Args:
+        conn: A connection to a database migrated to the search schema.
+        user_id (int): Search this user's habits; None searches every user's.
+        text (str): Words to look for; each matches words that start with it, ignoring case
+            and accents.
+        limit (int): Most results returned.
+        fuzzy (bool): When nothing matches, retry with the indexed words closest to each word.
+        cutoff (float): difflib similarity, 0 to 1, a word needs to stand in for a query word.
+
+    Returns:
+        list: SearchResult tuples, best match first; fuzzy is True for results of the retry. score
+        is the bm25 relevance when searching every user and the summed column weights of the
+        matched words when searching one user's habits.
+
+    """
+    words = _words(text)
+    if not words:
+        return []
+    # Every word is a prefix: "run" matches "running"
+    if user_id is None:
+        rows = _rank_all(conn, " ".join(f'"{word}"*' for word in words), limit)
+    else:
+        # Prefixes up to _INDEXED_PREFIX characters are read from the prefix index as one list;
+        # longer ones would merge the lists of every matching word, so they are cut to that
+        # length and the few rows of the user that match are checked against the whole words
+        rows = _rank_user(conn, user_id, " ".join(f'"{word[:_INDEXED_PREFIX]}"*' for word in words),
+                          [(word,) for word in words], limit)
+    if rows or not fuzzy:
+        return [SearchResult(*row, False) for row in rows]
+    # Every query word must still match, through any one of its spelling corrections
+    corrections = [tuple(_closest_terms(conn, word, cutoff)) for word in words]
+    if not all(corrections):
+        return []
+    expression = " AND ".join("(" + " OR ".join(f'"{term}"' for term in terms) + ")" for terms in corrections)
+    if user_id is None:
+        rows = _rank_all(conn, expression, limit)
+    else:
+        rows = _rank_user(conn, user_id, expression, corrections, limit)
+    return [SearchResult(*row, True) for row in rows]
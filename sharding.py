@@ -0,0 +1,118 @@
+""" Spread users over several SQLite files.
+
+SQLite lets one writer at a time into a database file, so with every user in one file
+all check-ins queue behind each other. ShardRouter maps each user_id to one of N files
+(user_id modulo N, so the mapping never changes while N stays the same) and hands out
+HabitTrackers bound to the user's file: writers for users in different shards then run
+in parallel. A user's row, habits and check-ins all live in their shard, which makes
+habit ids unique per shard only. Admin queries that span users fan out over a thread
+pool, one task per shard, and merge the results in a fixed order.
+"""
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
+from database import Database
+from habit_tracker import HabitTracker
+from rollups import rank_habits
+
+
+class ShardRouter:
+    """ Route users to shard database files.
+
+    Args:
+        db_files (list): The shard files; a user's shard is db_files[user_id % len(db_files)].
+        max_workers (int): Threads used by fan-out queries; defaults to one per shard.
+    """
+
+    def __init__(self, db_files, max_workers=None):
+        self.db_files = list(db_files)
+        if not self.db_files:
+            raise ValueError("A ShardRouter needs at least one database file")
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or len(self.db_files),
+                                           thread_name_prefix="habit-shard")
+
+    @classmethod
+    def from_directory(cls, directory, shards, prefix="shard", **options):
+        """ A router over `shards` files named <prefix>_<n>.db in directory """
+        os.makedirs(directory, exist_ok=True)
+        return cls([os.path.join(directory, f"{prefix}_{index:03d}.db") for index in range(shards)], **options)
+
+    def shard_of(self, user_id):
+        return user_id % len(self.db_files)
+
+    def db_file(self, user_id):
+        return self.db_files[self.shard_of(user_id)]
+
+    def database(self, user_id):
+        return Database(self.db_file(user_id))
+
+    def tracker(self, user_id):
+        """ A HabitTracker for the user, bound to the user's shard """
+        return HabitTracker(user_id, self.db_file(user_id))
+
+    def fan_out(self, function, *args):
+        """ Call function(db_file, *args) for every shard in parallel; the results come back in shard order """
+        futures = [self.executor.submit(function, db_file, *args) for db_file in self.db_files]
+        return [future.result() for future in futures]
+
+    def migrate(self):
+        """ Migrate every shard and return their schema versions """
+        return self.fan_out(lambda db_file: Database(db_file).migrate())
+
+    def mark_habits_done_bulk(self, records, chunk_size=500):
+        """ HabitTracker.mark_habits_done_bulk across shards: the records are split by the shard of
+        their user and each shard's share is written in parallel. Malformed records are rejected. """
+        by_shard = {}
+        rejected = []
+        for record in records:
+            if not isinstance(record, (tuple, list)) or len(record) != 3 or not isinstance(record[0], int):
+                rejected.append((record, "Malformed record"))
+                continue
+            by_shard.setdefault(self.db_file(record[0]), []).append(record)
+
+        def write(db_file):
+            shard_records = by_shard.get(db_file)
+            if not shard_records:
+                return {"inserted": 0, "rejected": []}
+            return HabitTracker(shard_records[0][0], db_file).mark_habits_done_bulk(shard_records, chunk_size)
+
+        inserted = 0
+        for result in self.fan_out(write):
+            inserted += result["inserted"]
+            rejected.extend(result["rejected"])
+        return {"inserted": inserted, "rejected": rejected}
+
+    def count_rows(self, table):
+        """ The number of rows of a table, summed over the shards """
+        def count(db_file):
+            with Database(db_file).pool.connection() as conn:
+                return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+        return sum(self.fan_out(count))
+
+    def rank_habits(self, start=None, end=None, limit=10, best=True):
+        """ rollups.rank_habits over every user of every shard.
+
+        Returns:
+            list: (shard, habit_id, name, checkins) tuples; ties are broken by shard, then habit id.
+
+        """
+        def rank(db_file):
+            with Database(db_file).pool.connection() as conn:
+                return rank_habits(conn, start, end, limit, best)
+
+        ranked = ((shard, habit_id, name, checkins)
+                  for shard, rows in enumerate(self.fan_out(rank))
+                  for habit_id, name, checkins in rows)
+        # Each shard's top `limit` holds every habit that can make the overall top `limit`
+        sign = -1 if best else 1
+        return heapq.nsmallest(limit, ranked, key=lambda row: (sign * row[3], row[0], row[1]))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
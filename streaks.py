@@ -0,0 +1,204 @@
+""" Materialized per-habit streaks.
+
+habit_streaks holds one row per habit with check-ins, with streaks counted in the
+day/week periods of habit_calendar. The triggers below extend it in O(1) as check-ins
+arrive in period order; anything they cannot apply incrementally (a backfilled
+check-in, a deleted or edited one, a periodicity change) marks the row stale, and
+refresh_stale_streaks() rebuilds those rows from habit_tracking, and from the per-day
+counts of compacted check-ins in habit_checkin_days, before they are read.
+"""
+import heapq
+from collections import namedtuple
+from itertools import groupby
+from habit_calendar import HabitCalendar, period_ordinal
+from rollups import day_sql, has_compacted_checkins, has_period_keys, week_of, week_sql
+
+StreakSummary = namedtuple("StreakSummary", [
+    "habit_id", "current_streak", "current_start", "longest_streak", "longest_start", "longest_end",
+    "last_period",
+])
+
+
+def _period(row, keys):
+    """ SQL period ordinal, as in habit_calendar, of a habit_tracking row of the habit h """
+    if keys:
+        day, week = f"{row}.day_key", f"{row}.week_key"
+    else:
+        day, week = day_sql(f"{row}.checked_at"), week_sql(f"{row}.checked_at")
+    return _period_of(day, week)
+
+
+def _period_of(day, week):
+    return f"CASE WHEN h.periodicity IN ('weekly', '2') THEN {week} ELSE {day} END"
+
+
+_NEW_CURRENT = "CASE WHEN checkin.period = last_period + 1 THEN current_streak + 1 ELSE 1 END"
+_NEW_START = "CASE WHEN checkin.period = last_period + 1 THEN current_start ELSE checkin.period END"
+
+
+def streak_schema(keys=True):
+    """ habit_streaks and the triggers maintaining it, from the period keys or from checked_at """
+    checkin = f"(SELECT {_period('NEW', keys)} AS period FROM habits h WHERE h.id = NEW.habit_id) AS checkin"
+    return [
+        '''CREATE TABLE IF NOT EXISTS habit_streaks (
+                habit_id INTEGER PRIMARY KEY,
+                current_streak INTEGER NOT NULL DEFAULT 0,
+                current_start INTEGER,
+                longest_streak INTEGER NOT NULL DEFAULT 0,
+                longest_start INTEGER,
+                longest_end INTEGER,
+                last_period INTEGER,
+                stale INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (habit_id) REFERENCES habits(id)
+            )''',
+        "CREATE INDEX IF NOT EXISTS idx_habit_streaks_stale ON habit_streaks (habit_id) WHERE stale = 1",
+        f'''CREATE TRIGGER IF NOT EXISTS habit_tracking_streak_insert AFTER INSERT ON habit_tracking
+            BEGIN
+                INSERT OR IGNORE INTO habit_streaks (habit_id) VALUES (NEW.habit_id);
+                UPDATE habit_streaks SET stale = 1
+                FROM {checkin}
+                WHERE habit_streaks.habit_id = NEW.habit_id AND checkin.period < last_period;
+                UPDATE habit_streaks SET
+                    current_streak = {_NEW_CURRENT},
+                    current_start = {_NEW_START},
+                    longest_streak = MAX(longest_streak, {_NEW_CURRENT}),
+                    longest_start = CASE WHEN {_NEW_CURRENT} > longest_streak THEN {_NEW_START} ELSE longest_start END,
+                    longest_end = CASE WHEN {_NEW_CURRENT} > longest_streak THEN checkin.period ELSE longest_end END,
+                    last_period = checkin.period
+                FROM {checkin}
+                WHERE habit_streaks.habit_id = NEW.habit_id AND stale = 0
+                  AND (last_period IS NULL OR checkin.period > last_period);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS habit_tracking_streak_delete AFTER DELETE ON habit_tracking
+            BEGIN
+                UPDATE habit_streaks SET stale = 1 WHERE habit_id = OLD.habit_id;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS habit_tracking_streak_update AFTER UPDATE OF habit_id, checked_at ON habit_tracking
+            BEGIN
+                INSERT OR IGNORE INTO habit_streaks (habit_id) VALUES (NEW.habit_id);
+                UPDATE habit_streaks SET stale = 1 WHERE habit_id IN (OLD.habit_id, NEW.habit_id);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS habits_streak_periodicity AFTER UPDATE OF periodicity ON habits
+            BEGIN
+                UPDATE habit_streaks SET stale = 1 WHERE habit_id = NEW.id;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS habits_streak_delete AFTER DELETE ON habits
+            BEGIN
+                DELETE FROM habit_streaks WHERE habit_id = OLD.id;
+            END''',
+    ]
+
+
+STREAK_SCHEMA = streak_schema()
+
+
+def summarize_streaks(rows):
+    """ Summarize the streaks of each habit from its period calendar.
+
+    Args:
+        rows (iterable): (habit_id, periodicity, checked_at) triples grouped by habit_id.
+
+    Yields:
+        StreakSummary: one per habit, with periods as habit_calendar ordinals. A streak is a run
+        of consecutive days (daily habits) or weeks (weekly habits) with at least one check-in,
+        the earliest of equally long streaks is the longest, and the current streak is the one
+        ending at the last checked period.
+
+    """
+    return summarize_periods((habit_id, periodicity, period_ordinal(checked_at, periodicity))
+                             for habit_id, periodicity, checked_at in rows)
+
+
+def summarize_periods(rows):
+    """ summarize_streaks for (habit_id, periodicity, period ordinal) triples grouped by habit_id """
+    for habit_id, checkins in groupby(rows, key=lambda row: row[0]):
+        checkins = list(checkins)
+        calendar = HabitCalendar.from_periods(checkins[0][1], (period for _, _, period in checkins))
+        current_streak, current_start = calendar.current_run()
+        longest_streak, longest_start = calendar.longest_run()
+        yield StreakSummary(habit_id, current_streak, current_start, longest_streak, longest_start,
+                            longest_start + longest_streak - 1, calendar.last_period)
+
+
+def _checkins(keys):
+    """ (habit_id, periodicity, period) of every dated check-in, read from the period keys when there are any """
+    return f"""
+        SELECT * FROM (
+            SELECT t.habit_id, h.periodicity, {_period("t", keys)} AS period FROM habit_tracking t
+            JOIN habits h ON h.id = t.habit_id
+        ) WHERE period IS NOT NULL
+    """
+
+
+_COMPACTED = f"""
+    SELECT c.habit_id, h.periodicity, {_period_of("c.day", week_of("c.day"))} AS period
+    FROM habit_checkin_days c JOIN habits h ON h.id = c.habit_id
+"""
+
+
+def iter_periods(conn, habit_ids=None):
+    """ (habit_id, periodicity, period) of the dated check-ins of the given habits, or of every habit,
+    grouped by habit_id; days of compacted check-ins count as checked-in periods too """
+    checkins = _checkins(has_period_keys(conn))
+    compacted = has_compacted_checkins(conn)
+    if habit_ids is None:
+        chunks = [None]
+    else:
+        habit_ids = list(habit_ids)
+        chunks = [habit_ids[start:start + 500] for start in range(0, len(habit_ids), 500)]
+    for chunk in chunks:
+        scope = "" if chunk is None else f"habit_id IN ({', '.join('?' for _ in chunk)})"
+        rows = conn.execute(checkins + (f" AND {scope}" if scope else "") + " ORDER BY habit_id", chunk or [])
+        if compacted:
+            rows = heapq.merge(rows, conn.execute(
+                _COMPACTED + (f" WHERE c.{scope}" if scope else "") + " ORDER BY c.habit_id", chunk or []),
+                key=lambda row: row[0])
+        yield from rows
+
+
+def rebuild_streaks(conn, habit_ids=None):
+    """ Recompute habit_streaks rows from the check-ins, for the given habits or all of them """
+    if habit_ids is None:
+        conn.execute("DELETE FROM habit_streaks")
+        _insert_summaries(conn, iter_periods(conn))
+        return
+
+    habit_ids = list(habit_ids)
+    for start in range(0, len(habit_ids), 500):
+        chunk = habit_ids[start:start + 500]
+        conn.execute(f"DELETE FROM habit_streaks WHERE habit_id IN ({', '.join('?' for _ in chunk)})", chunk)
+        _insert_summaries(conn, iter_periods(conn, chunk))
+
+
+def _insert_summaries(conn, rows):
+    conn.executemany("""
+        INSERT INTO habit_streaks (habit_id, current_streak, current_start, longest_streak,
+                                   longest_start, longest_end, last_period)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, summarize_periods(rows))
+
+
+def refresh_stale_streaks(pool):
+    """ Rebuild the rows the triggers marked stale; a no-op read when there are none """
+    with pool.connection() as conn:
+        if conn.execute("SELECT 1 FROM habit_streaks WHERE stale = 1 LIMIT 1").fetchone() is None:
+            return
+    with pool.transaction() as conn:
+        stale = [row[0] for row in conn.execute("SELECT habit_id FROM habit_streaks WHERE stale = 1")]
+        rebuild_streaks(conn, stale)
+
+
+def create_streak_table(conn):
+    """ Migration step: create habit_streaks with its triggers and fill it from existing check-ins """
+    for sql in streak_schema(has_period_keys(conn)):
+        conn.execute(sql)
+    rebuild_streaks(conn)
+
+
+def recreate_streak_table(conn):
+    """ Migration step: replace an older habit_streaks layout and its triggers with the current one """
+    for trigger in ("habit_tracking_streak_insert", "habit_tracking_streak_delete", "habit_tracking_streak_update",
+                    "habits_streak_periodicity", "habits_streak_delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS habit_streaks")
+    create_streak_table(conn)
@@ -0,0 +1,79 @@
+import random
+import unittest
+from datetime import date, datetime, timedelta
+from analytics import Analytics
+from habit import Habit
+from numpy_analytics import np, NumpyAnalytics
+
+
+def make_habit(name, periodicity, tracking_data):
+    habit = Habit(1, name, '', periodicity, ':memory:')
+    habit.tracking_data = tracking_data
+    return habit
+
+
+def random_habits(seed, count=20):
+    rng = random.Random(seed)
+    habits = []
+    for index in range(count):
+        checked_at = datetime(2024, 1, 1) + timedelta(hours=rng.randint(0, 23))
+        tracking_data = []
+        for _ in range(rng.randint(0, 60)):
+            checked_at += timedelta(hours=rng.choice([12, 24, 24, 30, 47, 49, 72, 168]))
+            tracking_data.append(checked_at)
+        habits.append(make_habit(f'Habit {index}', rng.choice(['daily', 'weekly']), tracking_data))
+    return habits
+
+
+class AnalyticsTestCase(unittest.TestCase):
+    def setUp(self):
+        days = [datetime(2024, 5, day, 8) for day in (1, 2, 3, 5, 6, 13)]
+        self.analytics = Analytics([make_habit('Walk', 'daily', days)])
+
+    def test_longest_streak(self):
+        self.assertEqual(self.analytics.get_longest_streak(), 3)
+        self.assertEqual(self.analytics.get_longest_streak_for_habit('Walk'), 3)
+        self.assertEqual(self.analytics.get_longest_streak_for_habit('Swim'), 0)
+
+    def test_gap_completion_and_period_counts(self):
+        self.assertEqual(self.analytics.get_longest_gap_for_habit('Walk'), 7)
+        self.assertEqual(self.analytics.get_completion_rate('Walk'), 6 / 13)
+        self.assertEqual(self.analytics.get_period_counts('Walk')[date(2024, 5, 13)], 1)
+
+
+@unittest.skipUnless(np is not None, "numpy is not installed")
+class NumpyAnalyticsTestCase(unittest.TestCase):
+    def test_matches_python_backend(self):
+        for seed in range(5):
+            habits = random_habits(seed)
+            python, vectorized = Analytics(habits), NumpyAnalytics(habits)
+            self.assertEqual(vectorized.get_longest_streak(), python.get_longest_streak())
+            self.assertEqual(vectorized.get_longest_streaks(),
+                             [habit.calendar().longest_streak() for habit in habits])
+            for habit in habits + [make_habit('Missing', 'daily', [])]:
+                name = habit.name
+                self.assertEqual(vectorized.get_longest_streak_for_habit(name),
+                                 python.get_longest_streak_for_habit(name))
+                self.assertEqual(vectorized.get_longest_gap_for_habit(name), python.get_longest_gap_for_habit(name))
+                self.assertAlmostEqual(vectorized.get_completion_rate(name), python.get_completion_rate(name))
+                self.assertEqual(vectorized.get_period_counts(name), python.get_period_counts(name))
+
+    def test_habits_sharing_a_name(self):
+        days = [datetime(2024, 5, day, 8) for day in (1, 2, 3, 10)]
+        habits = [make_habit('Walk', 'daily', days), make_habit('Walk', 'daily', days[2:]),
+                  make_habit('Swim', 'daily', days[:1])]
+        python, vectorized = Analytics(habits), NumpyAnalytics(habits)
+        self.assertEqual(vectorized.get_longest_streaks(), [3, 1, 1])
+        self.assertEqual(vectorized.get_longest_streak(), python.get_longest_streak())
+        self.assertEqual(NumpyAnalytics(habits[::-1]).get_longest_streak(), 3)
+        # Lookups by name find the first habit with it, as Analytics does
+        self.assertEqual(vectorized.get_longest_streak_for_habit('Walk'), python.get_longest_streak_for_habit('Walk'))
+
+    def test_empty(self):
+        analytics = NumpyAnalytics([])
+        self.assertEqual(analytics.get_longest_streak(), 0)
+        self.assertEqual(analytics.get_longest_streaks(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from async_tracker import AsyncHabitTracker
+from connection import close_all_pools
+from database import Database
+
+
+class AsyncHabitTrackerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        Database(self.db_file).migrate()
+        self.tracker = AsyncHabitTracker(1, self.db_file)
+        await self.tracker.create_habit(1, 'Exercise', 'Hit the gym.', 'daily')
+
+    async def asyncTearDown(self):
+        await self.tracker.close()
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    async def checkin_count(self):
+        habit_id = (await self.tracker.get_habit_info('Exercise'))[0]
+        return len(await self.tracker.get_habit_tracking_by_id(habit_id))
+
+    async def test_mirrors_the_blocking_api(self):
+        self.assertEqual((await self.tracker.get_habit_info('Exercise'))[2], 'Exercise')
+        self.assertEqual(await self.tracker.update_habit('Exercise', new_description='Lift.'),
+                         "Habit updated successfully")
+        self.assertEqual(await self.tracker.mark_habit_as_done(1, 'Exercise'), "Habit marked as done successfully")
+        self.assertEqual((await self.tracker.get_streak('Exercise')).longest_streak, 1)
+        self.assertEqual(len(await self.tracker.get_habits_with_longest_streak()), 1)
+        self.assertEqual(await self.tracker.get_worst_streak_habit(), 'Exercise')
+
+    async def test_concurrent_checkins_are_group_committed(self):
+        statuses = await asyncio.gather(*(self.tracker.mark_habit_as_done(1, 'Exercise') for _ in range(200)))
+        self.assertEqual(set(statuses), {"Habit marked as done successfully"})
+        self.assertEqual(await self.checkin_count(), 200)
+        self.assertLess(self.tracker.group_commits, 10)
+
+    async def test_cancelled_checkin_is_not_written(self):
+        first = asyncio.ensure_future(self.tracker.mark_habit_as_done(1, 'Exercise'))
+        second = asyncio.ensure_future(self.tracker.mark_habit_as_done(1, 'Exercise'))
+        await asyncio.sleep(0)
+        # The first check-in is being written; the second is still queued and can be dropped
+        second.cancel()
+        await first
+        await self.tracker.close()
+        self.assertTrue(second.cancelled())
+        self.assertEqual(len(self.tracker.tracker.get_habit_tracking_by_id(1)), 1)
+
+    async def test_timeout(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.tracker._run(time.sleep, 0.5, timeout=0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
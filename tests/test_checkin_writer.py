@@ -0,0 +1,83 @@
+import os
+import queue
+import tempfile
+import threading
+import unittest
+from checkin_writer import FLUSHED, QUEUED, CheckinWriter
+from connection import close_all_pools
+from database import Database
+from habit_tracker import HabitTracker
+
+
+class CheckinWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        Database(self.db_file).migrate()
+        self.tracker = HabitTracker(1, self.db_file)
+        self.tracker.create_habit(1, 'Exercise', 'Hit the gym.', 'daily')
+        self.habit_id = self.tracker.get_habit_info('Exercise')[0]
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def count_checkins(self):
+        return len(self.tracker.get_habit_tracking_by_id(self.habit_id))
+
+    def test_flushed_check_ins_are_committed_on_return(self):
+        with CheckinWriter(self.db_file, FLUSHED) as writer:
+            tracker = HabitTracker(1, self.db_file, writer=writer)
+            self.assertEqual(tracker.mark_habit_as_done(1, 'Exercise'), "Habit marked as done successfully")
+            self.assertEqual(self.count_checkins(), 1)
+            self.assertEqual(writer.mark_habit_as_done(1, 'Unknown'), "Error marking habit as done: unknown habit")
+            self.assertEqual(writer.mark_habit_as_done(1, self.habit_id, '2024-05-01 08:00:00'),
+                             "Habit marked as done successfully")
+        self.assertEqual(self.count_checkins(), 2)
+
+    def test_concurrent_check_ins_share_transactions(self):
+        with CheckinWriter(self.db_file, FLUSHED, max_delay=0.05) as writer:
+            def check_in():
+                for _ in range(20):
+                    writer.mark_habit_as_done(1, 'Exercise')
+
+            threads = [threading.Thread(target=check_in) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(writer.written, 160)
+            self.assertLess(writer.commits, 160)
+        self.assertEqual(self.count_checkins(), 160)
+
+    def test_queued_check_ins_are_written_on_flush_and_close(self):
+        writer = CheckinWriter(self.db_file, QUEUED, max_delay=60)
+        futures = [writer.submit(1, 'Exercise', f'2024-05-{day:02d}') for day in range(1, 11)]
+        self.assertEqual(writer.mark_habit_as_done(1, 'Exercise'), "Habit check-in queued")
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(self.count_checkins(), 11)
+        self.assertTrue(all(future.result() == "Habit marked as done successfully" for future in futures))
+
+        for _ in range(5):
+            writer.mark_habit_as_done(1, 'Exercise')
+        writer.close()
+        self.assertEqual(self.count_checkins(), 16)
+        with self.assertRaises(Exception):
+            writer.submit(1, 'Exercise')
+
+    def test_full_queue_applies_backpressure(self):
+        writer = CheckinWriter(self.db_file, QUEUED, max_batch=1, max_queue=2, put_timeout=0.05)
+        # Hold the write lock so the background thread cannot drain the queue
+        accepted = 0
+        with self.tracker.pool.transaction():
+            with self.assertRaises(queue.Full):
+                for _ in range(10):
+                    writer.mark_habit_as_done(1, 'Exercise')
+                    accepted += 1
+        writer.close()
+        self.assertLess(accepted, 10)
+        self.assertEqual(self.count_checkins(), accepted)
+
+
+if __name__ == '__main__':
+    unittest.main()
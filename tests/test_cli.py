@@ -0,0 +1,119 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+import cli
+from connection import close_all_pools
+from database import Database
+from habit_tracker import HabitTracker
+
+
+class CliTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        Database(self.db_file).migrate()
+        self.tracker = HabitTracker(1, self.db_file)
+        self.tracker.create_habit(1, 'Exercise', 'Hit the gym.', 'daily')
+        self.tracker.create_habit(1, 'Reading', 'Read a book.', 'weekly')
+        HabitTracker(2, self.db_file).create_habit(2, 'Exercise', 'Hit the gym.', 'daily')
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def run_cli(self, *argv, stdin=''):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        status = cli.main(['--db', self.db_file] + list(argv), io.StringIO(stdin), stdout, stderr)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_bulk_import_streams_rejects_and_a_summary(self):
+        lines = [json.dumps({'habit': 'Exercise', 'checked_at': f'2024-05-{day:02d} 08:00:00'}) for day in range(1, 6)]
+        lines += [json.dumps({'habit': 'Exercise', 'user_id': 2}), json.dumps({'habit': 'Unknown'}), 'not json', '']
+        status, out, err = self.run_cli('--progress', '2', 'bulk-import', '--chunk-size', '1', stdin='\n'.join(lines))
+        self.assertEqual(status, 1)
+        self.assertEqual([json.loads(line)['reason'] for line in out.splitlines()], ['Unknown habit', 'Malformed record'])
+        self.assertIn('8 rows read, 6 inserted, 2 rejected', err)
+        self.assertEqual(self.tracker.get_streak('Exercise').longest_streak, 5)
+
+    def test_csv_import_and_export_round_trip(self):
+        stdin = 'habit,checked_at\nExercise,2024-05-01 08:00:00\nReading,2024-05-06 09:30:00\n'
+        self.assertEqual(self.run_cli('bulk-import', '--input-format', 'csv', stdin=stdin)[0], 0)
+        status, out, _ = self.run_cli('--format', 'csv', 'export')
+        rows = list(csv.DictReader(io.StringIO(out)))
+        self.assertEqual([(row['habit'], row['checked_at']) for row in rows],
+                         [('Exercise', '2024-05-01 08:00:00'), ('Reading', '2024-05-06 09:30:00')])
+        _, out, _ = self.run_cli('--user', '2', 'export')
+        self.assertEqual(out, '')
+        _, out, _ = self.run_cli('export', '--all-users')
+        self.assertEqual(len(out.splitlines()), 2)
+
+    def test_bulk_import_rejects_rows_with_a_non_scalar_habit(self):
+        rows = [{'habit': ['Exercise']}, {'habit': {'name': 'Exercise'}}, {'habit_id': [1]}, {'habit': 'Exercise'}]
+        status, out, err = self.run_cli('bulk-import', stdin='\n'.join(map(json.dumps, rows)))
+        self.assertEqual(status, 1)
+        self.assertEqual([json.loads(line) for line in out.splitlines()],
+                         [{'record': [row], 'reason': 'Malformed record'} for row in rows[:3]])
+        self.assertIn('4 rows read, 1 inserted, 3 rejected', err)
+
+    def test_compact(self):
+        stdin = 'habit,checked_at\nExercise,2020-05-01 08:00:00\nExercise,2020-05-02 08:00:00\n'
+        self.run_cli('bulk-import', '--input-format', 'csv', stdin=stdin)
+        self.run_cli('checkin', 'Exercise')
+        status, out, err = self.run_cli('compact', '--keep-days', '30', '--archive',
+                                        os.path.join(self.temp_dir.name, 'archive.db'))
+        self.assertEqual(status, 0)
+        self.assertEqual(json.loads(out)['archived'], 2)
+        self.assertIn('2 check-ins archived', err)
+        self.assertEqual(len(self.run_cli('export')[1].splitlines()), 1)
+        self.assertEqual(self.tracker.get_streak('Exercise').longest_streak, 2)
+
+    def test_report_counts_compacted_checkins(self):
+        start = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(days=24)
+        stdin = ''.join(f'Exercise,{start + timedelta(days=day)}\n' for day in range(20))
+        self.run_cli('bulk-import', '--input-format', 'csv', stdin='habit,checked_at\n' + stdin)
+        before = self.run_cli('report')[1]
+        self.assertEqual(json.loads(before.splitlines()[0])['checkins'], 20)
+        _, out, _ = self.run_cli('compact', '--keep-days', '10', '--archive',
+                                 os.path.join(self.temp_dir.name, 'archive.db'))
+        self.assertEqual(json.loads(out)['archived'], 14)
+        self.assertEqual(self.run_cli('report')[1], before)
+
+    def test_due(self):
+        self.run_cli('checkin', 'Exercise', '--at', '2000-01-01 08:00:00')
+        self.run_cli('checkin', 'Reading', '--at', (datetime.now() - timedelta(days=7)).isoformat())
+        status, out, _ = self.run_cli('due')
+        self.assertEqual(status, 0)
+        self.assertEqual([json.loads(line)['habit_id'] for line in out.splitlines()], [2])
+        self.assertEqual(self.run_cli('due', '--remind-before', '0')[:2], (0, ''))
+        with self.assertRaises(SystemExit), mock.patch('sys.stderr', io.StringIO()):
+            self.run_cli('due', '--remind-before', '-5')
+
+    def test_search(self):
+        status, out, _ = self.run_cli('search', 'READ')
+        self.assertEqual(status, 0)
+        self.assertEqual([json.loads(line)['name'] for line in out.splitlines()], ['Reading'])
+
+    def test_checkin_streaks_and_report(self):
+        self.assertEqual(self.run_cli('checkin', 'Exercise', '--at', '2024-05-01 07:00:00')[0], 0)
+        self.assertEqual(self.run_cli('checkin', 'Exercise', '--at', '2024-05-02 07:00:00')[0], 0)
+        self.assertEqual(self.run_cli('checkin', 'Unknown')[0], 1)
+
+        _, out, _ = self.run_cli('streaks')
+        streaks = {row['name']: row for row in map(json.loads, out.splitlines())}
+        self.assertEqual(streaks['Exercise']['longest_streak'], 2)
+        _, out, _ = self.run_cli('streaks', '--habit', 'Exercise')
+        self.assertEqual(json.loads(out)['longest_start'], '2024-05-01 00:00:00')
+
+        _, out, _ = self.run_cli('--format', 'csv', 'report')
+        report = {row['name']: row for row in csv.DictReader(io.StringIO(out))}
+        self.assertEqual((report['Exercise']['checkins'], report['Exercise']['completion_rate']), ('2', '1.0'))
+        self.assertEqual(report['Reading']['checkins'], '0')
+
+
+if __name__ == '__main__':
+    unittest.main()
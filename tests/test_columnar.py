@@ -0,0 +1,156 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from analytics import Analytics
+from datetime import date
+from columnar import ColumnarReader, _decode_column, _encode_column, export_history, habits_from_file, import_history
+from compaction import compact_checkins
+from connection import close_all_pools
+from database import Database
+from habit_tracker import HabitTracker
+from loadgen import generate
+
+
+class ColumnarTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'source.db')
+        self.path = os.path.join(self.temp_dir.name, 'history.htck')
+        Database(self.db_file).migrate()
+        generate(self.db_file, users=3, habits_per_user=4, checkins_per_habit=50, seed=5)
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def rows(self, db_file, query):
+        conn = sqlite3.connect(db_file)
+        try:
+            return conn.execute(query).fetchall()
+        finally:
+            conn.close()
+
+    def test_encode_column_round_trips_with_the_narrowest_width(self):
+        for values, width in (([5, 6, 6, 100], 1), ([0, 40000, 1], 4), ([1, -(1 << 40)], 8), ([7], 1)):
+            first, actual_width, data = _encode_column(values)
+            self.assertEqual(actual_width, width)
+            self.assertEqual(list(_decode_column(data, first, actual_width)), values)
+
+    def test_export_and_import_round_trip(self):
+        total = self.rows(self.db_file, "SELECT COUNT(*) FROM habit_tracking")[0][0]
+        summary = export_history(self.db_file, self.path, chunk_rows=70)
+        self.assertEqual((summary["habits"], summary["checkins"]), (12, total))
+        self.assertEqual(summary["chunks"], -(-total // 70))
+        self.assertEqual(summary["bytes"], os.path.getsize(self.path))
+
+        target = os.path.join(self.temp_dir.name, 'target.db')
+        Database(target).migrate()
+        self.assertEqual(import_history(self.path, target), {"habits": 12, "checkins": total, "checkin_days": 0})
+        for query in ("SELECT user_id, id, name, description, periodicity, creation_date FROM habits ORDER BY id",
+                      "SELECT id, habit_id, checked_at FROM habit_tracking ORDER BY id",
+                      "SELECT * FROM habit_streaks ORDER BY habit_id",
+                      "SELECT * FROM habit_daily_counts ORDER BY day, habit_id",
+                      "SELECT * FROM habit_weekly_counts ORDER BY week, habit_id",
+                      "SELECT * FROM habit_checkin_totals ORDER BY habit_id",
+                      "SELECT name FROM sqlite_master WHERE type = 'trigger' ORDER BY name"):
+            self.assertEqual(self.rows(target, query), self.rows(self.db_file, query), query)
+
+        # A second import changes nothing and the triggers keep the rollups up to date afterwards
+        import_history(self.path, target)
+        self.assertEqual(self.rows(target, "SELECT COUNT(*) FROM habit_tracking"), [(total,)])
+        habit = self.rows(target, "SELECT user_id, name FROM habits ORDER BY id LIMIT 1")[0]
+        HabitTracker(habit[0], target).mark_habit_as_done(habit[0], habit[1])
+        self.assertEqual(self.rows(target, "SELECT SUM(checkins) FROM habit_checkin_totals"), [(total + 1,)])
+
+    def test_round_trip_keeps_utc_offsets(self):
+        conn = sqlite3.connect(self.db_file)
+        with conn:
+            conn.execute("UPDATE users SET utc_offset = CASE id WHEN 1 THEN 330 WHEN 2 THEN -300 END")
+            conn.execute("UPDATE habit_tracking SET utc_offset = (SELECT COALESCE(users.utc_offset, 0) FROM users "
+                         "JOIN habits ON habits.user_id = users.id WHERE habits.id = habit_tracking.habit_id)")
+            conn.execute("UPDATE habit_tracking SET utc_offset = 60 WHERE id % 7 = 0")
+            users = conn.execute("SELECT id, email, username, password, created_at FROM users").fetchall()
+        conn.close()
+        export_history(self.db_file, self.path, chunk_rows=64)
+
+        target = os.path.join(self.temp_dir.name, 'target.db')
+        Database(target).migrate()
+        conn = sqlite3.connect(target)
+        with conn:
+            conn.executemany("INSERT INTO users (id, email, username, password, created_at) VALUES (?, ?, ?, ?, ?)",
+                             users)
+        conn.close()
+        import_history(self.path, target)
+        for query in ("SELECT id, utc_offset FROM users ORDER BY id",
+                      "SELECT id, checked_at, utc_offset, checked_epoch, day_key, week_key FROM habit_tracking "
+                      "ORDER BY id"):
+            self.assertEqual(self.rows(target, query), self.rows(self.db_file, query), query)
+        self.assertEqual(self.rows(target, "SELECT COUNT(DISTINCT utc_offset) FROM habit_tracking"), [(4,)])
+
+    def test_round_trip_keeps_compacted_checkins(self):
+        (middle,) = self.rows(self.db_file, "SELECT checked_at FROM habit_tracking ORDER BY checked_at "
+                                            "LIMIT 1 OFFSET 300")[0]
+        compacted = compact_checkins(self.db_file, date.fromisoformat(middle[:10]), vacuum_seconds=0, measure=False)
+        self.assertGreater(compacted["archived"], 250)
+        days = self.rows(self.db_file, "SELECT COUNT(*) FROM habit_checkin_days")[0][0]
+        summary = export_history(self.db_file, self.path, chunk_rows=40)
+        self.assertEqual(summary["checkin_days"], days)
+
+        target = os.path.join(self.temp_dir.name, 'target.db')
+        Database(target).migrate()
+        self.assertEqual(import_history(self.path, target)["checkin_days"], days)
+        for query in ("SELECT * FROM habit_checkin_days ORDER BY habit_id, day",
+                      "SELECT * FROM habit_streaks ORDER BY habit_id",
+                      "SELECT * FROM habit_daily_counts ORDER BY day, habit_id",
+                      "SELECT * FROM habit_checkin_totals ORDER BY habit_id"):
+            self.assertEqual(self.rows(target, query), self.rows(self.db_file, query), query)
+        self.assertEqual(HabitTracker(2, target).get_habit_ranking(), HabitTracker(2, self.db_file).get_habit_ranking())
+
+        tracker = HabitTracker(2, self.db_file)
+        with ColumnarReader(self.path) as reader:
+            user = habits_from_file(reader, user_id=2)
+            self.assertEqual(sum(row[2] for row in reader.iter_checkin_days()),
+                             compacted["archived"])
+        checkins = dict(self.rows(self.db_file, "SELECT habit_id, checkins FROM habit_checkin_totals"))
+        analytics = Analytics(user.habits)
+        for habit, (_, habit_id, name, *_) in zip(user.habits, tracker.get_all_habits()):
+            self.assertEqual(habit.name, name)
+            self.assertEqual(len(habit.checkins), checkins[habit_id])
+            self.assertEqual(list(habit.checkins), sorted(habit.checkins))
+            self.assertEqual(analytics.get_longest_streak_for_habit(name), tracker.get_streak(name).longest_streak)
+
+    def test_readers_with_and_without_mmap_agree(self):
+        export_history(self.db_file, self.path, chunk_rows=64)
+        expected = self.rows(self.db_file, "SELECT id, habit_id, checked_at FROM habit_tracking "
+                                           "ORDER BY habit_id, checked_at, id")
+        for use_mmap in (True, False):
+            with ColumnarReader(self.path, use_mmap=use_mmap) as reader:
+                self.assertEqual(len(reader), len(expected))
+                checkins = [(row.id, row.habit_id, row.checked_at.strftime('%Y-%m-%d %H:%M:%S'))
+                            for row in reader.iter_checkins()]
+                self.assertEqual(checkins, expected)
+                self.assertEqual(len(reader.habit_checkins(3)), sum(row[1] == 3 for row in expected))
+
+    def test_habits_from_file_match_analytics_on_the_database(self):
+        export_history(self.db_file, self.path, chunk_rows=100)
+        tracker = HabitTracker(2, self.db_file)
+        with ColumnarReader(self.path) as reader:
+            user = habits_from_file(reader, user_id=2)
+        self.assertEqual(sorted(habit.name for habit in user.habits), sorted(row[2] for row in tracker.get_all_habits()))
+        analytics = Analytics(user.habits)
+        for habit in user.habits:
+            with Database(self.db_file).pool.connection() as conn:
+                habit_id = conn.execute("SELECT id FROM habits WHERE user_id = 2 AND name = ?", (habit.name,)).fetchone()[0]
+            self.assertEqual(analytics.get_longest_streak_for_habit(habit.name), tracker.get_streak(habit.name).longest_streak)
+            self.assertEqual(len(habit.checkins), len(tracker.get_habit_tracking_by_id(habit_id)))
+
+    def test_rejects_files_of_another_format(self):
+        with open(self.path, 'wb') as file:
+            file.write(b'not a history file at all')
+        with self.assertRaises(ValueError):
+            ColumnarReader(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+from compaction import archive_path, compact_checkins, enable_incremental_vacuum
+from connection import close_all_pools, get_pool
+from database import Database
+from habit_tracker import HabitTracker
+from parallel_analytics import analyze
+from rollups import rebuild_rollups
+from streaks import rebuild_streaks, refresh_stale_streaks, summarize_streaks
+
+ROLLUPS = ["SELECT * FROM habit_daily_counts ORDER BY day, habit_id",
+           "SELECT * FROM habit_weekly_counts ORDER BY week, habit_id",
+           "SELECT * FROM habit_checkin_totals ORDER BY habit_id"]
+STREAKS = "SELECT * FROM habit_streaks ORDER BY habit_id"
+
+
+class CompactionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        Database(self.db_file).migrate()
+        self.tracker = HabitTracker(1, self.db_file)
+        for index in range(6):
+            self.tracker.create_habit(1, f'Habit {index}', '', 'weekly' if index % 3 == 0 else 'daily')
+        rng = random.Random(3)
+        records = []
+        for index in range(6):
+            day = datetime(2023, 1, 1, 8, 0)
+            for _ in range(300):
+                day += timedelta(hours=rng.choice([3, 24, 24, 24, 30, 72]))
+                records.append((1, f'Habit {index}', day))
+        self.assertEqual(self.tracker.mark_habits_done_bulk(records)["inserted"], len(records))
+        with self.tracker.pool.transaction() as conn:
+            conn.execute("INSERT INTO habit_tracking (habit_id, checked_at) VALUES (1, 'not a date')")
+        self.pool = get_pool(self.db_file)
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def read(self, *queries):
+        with self.pool.connection() as conn:
+            return [conn.execute(sql).fetchall() for sql in queries]
+
+    def expected_streaks(self, conn, checkins):
+        periodicities = dict(conn.execute("SELECT id, periodicity FROM habits"))
+        rows = sorted((habit_id, periodicities[habit_id], checked_at) for habit_id, checked_at in checkins
+                      if checked_at != 'not a date')
+        return [tuple(summary) + (0,) for summary in summarize_streaks(rows)]
+
+    def test_compaction_archives_old_checkins_and_keeps_results_exact(self):
+        refresh_stale_streaks(self.pool)
+        before = self.read(STREAKS, *ROLLUPS)
+        (checkins,) = self.read("SELECT habit_id, checked_at FROM habit_tracking")
+        report = compact_checkins(self.db_file, date(2023, 9, 1), batch_size=100)
+
+        old = [row for row in checkins if row[1] < '2023-09-01']
+        self.assertEqual(report["archived"], len(old))
+        self.assertGreater(report["batches"], len(old) // 150)
+        self.assertGreater(report["bytes_reclaimed"], 0)
+        self.assertEqual(report["bytes_reclaimed"], report["bytes_before"] - report["bytes_after"])
+        self.assertIn("streaks_ms_after", report)
+        with sqlite3.connect(archive_path(self.db_file)) as archive:
+            self.assertEqual(sorted(archive.execute("SELECT habit_id, checked_at FROM habit_tracking")), sorted(old))
+        (remaining, compacted) = self.read("SELECT MIN(checked_at) FROM habit_tracking WHERE day_key IS NOT NULL",
+                                           "SELECT SUM(checkins) FROM habit_checkin_days")
+        self.assertGreaterEqual(remaining[0][0], '2023-09-01')
+        self.assertEqual(compacted[0][0], len(old))
+        self.assertEqual(self.read(STREAKS, *ROLLUPS), before)
+
+        # Rebuilds count the compacted days, so they reproduce the results
+        with self.pool.transaction() as conn:
+            rebuild_streaks(conn)
+            rebuild_rollups(conn)
+        self.assertEqual(self.read(STREAKS, *ROLLUPS), before)
+
+        # Running again archives nothing new
+        self.assertEqual(compact_checkins(self.db_file, date(2023, 9, 1), measure=False)["archived"], 0)
+
+    def test_backfill_after_compaction(self):
+        (checkins,) = self.read("SELECT habit_id, checked_at FROM habit_tracking")
+        compact_checkins(self.db_file, date(2023, 9, 1), vacuum_seconds=0, measure=False)
+        # A check-in on a compacted day and one filling a gap between compacted days
+        backfill = [(1, 'Habit 1', '2023-03-01 12:00:00'), (1, 'Habit 2', '2023-01-05 09:00:00')]
+        self.tracker.mark_habits_done_bulk(backfill)
+        refresh_stale_streaks(self.pool)
+
+        with self.pool.connection() as conn:
+            ids = {name: habit_id for habit_id, name in conn.execute("SELECT id, name FROM habits")}
+            expected = self.expected_streaks(conn, checkins + [(ids[name], at) for _, name, at in backfill])
+            self.assertEqual(conn.execute(STREAKS).fetchall(), expected)
+            rollups = [conn.execute(sql).fetchall() for sql in ROLLUPS]
+        with self.pool.transaction() as conn:
+            rebuild_rollups(conn)
+        self.assertEqual(self.read(*ROLLUPS), rollups)
+
+    def test_parallel_analytics_count_compacted_checkins(self):
+        as_of = datetime(2024, 1, 1)
+        before = {by: analyze(self.db_file, workers=1, partitions=3, by=by, as_of=as_of) for by in ('habit', 'user')}
+        self.assertEqual(before['habit'].checkins, 1800)
+        compact_checkins(self.db_file, date(2023, 9, 1), vacuum_seconds=0, measure=False)
+        for by, report in before.items():
+            self.assertEqual(analyze(self.db_file, workers=1, partitions=3, by=by, as_of=as_of), report, by)
+
+    def test_incremental_vacuum_on_converted_database(self):
+        with self.pool.connection() as conn:
+            conn.execute("PRAGMA auto_vacuum = NONE")
+            conn.execute("VACUUM")
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 0)
+        report = compact_checkins(self.db_file, date(2023, 9, 1), measure=False)
+        self.assertEqual(report["vacuum_pages"], 0)
+        self.assertLessEqual(report["bytes_reclaimed"], 0)
+        self.assertGreater(report["bytes_free"], 0)
+
+        self.assertTrue(enable_incremental_vacuum(self.db_file))
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from connection import ConnectionPool, get_pool, close_all_pools
+from database import Database
+from habit_tracker import HabitTracker
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        self.pool = ConnectionPool(self.db_file, size=2, timeout=0.2)
+        with self.pool.transaction() as conn:
+            conn.execute("CREATE TABLE items (value INTEGER)")
+
+    def tearDown(self):
+        self.pool.close()
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def test_wal_mode_enabled(self):
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+
+    def test_connection_reused_within_thread(self):
+        with self.pool.connection() as outer:
+            with self.pool.connection() as inner:
+                self.assertIs(outer, inner)
+        with self.pool.connection() as again:
+            self.assertIs(outer, again)
+
+    def test_nested_transaction_rolls_back_to_savepoint(self):
+        with self.pool.transaction() as conn:
+            conn.execute("INSERT INTO items VALUES (1)")
+            with self.assertRaises(ValueError):
+                with self.pool.transaction() as nested:
+                    nested.execute("INSERT INTO items VALUES (2)")
+                    raise ValueError
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT value FROM items").fetchall(), [(1,)])
+
+    def test_pool_size_is_bounded(self):
+        release = threading.Event()
+        holding = threading.Barrier(3)
+
+        def hold():
+            with self.pool.connection():
+                holding.wait()
+                release.wait()
+
+        threads = [threading.Thread(target=hold) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        holding.wait()
+        with self.assertRaises(sqlite3.OperationalError):
+            with self.pool.connection():
+                pass
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.pool.stats()["open"], 2)
+
+    def test_health_check_drops_broken_connections(self):
+        with self.pool.connection() as conn:
+            pass
+        conn.close()
+        self.assertEqual(self.pool.health_check(), 0)
+        with self.pool.connection() as fresh:
+            self.assertEqual(fresh.execute("SELECT COUNT(*) FROM items").fetchone()[0], 0)
+
+
+class SharedPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        Database(self.db_file).migrate()
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def test_classes_share_one_pool(self):
+        tracker = HabitTracker(1, self.db_file)
+        self.assertIs(tracker.pool, Database(self.db_file).pool)
+        self.assertIs(tracker.pool, get_pool(self.db_file))
+
+    def test_check_in_round_trip(self):
+        tracker = HabitTracker(1, self.db_file)
+        self.assertEqual(tracker.create_habit(1, 'Swim', 'Swim every week', 'weekly'), "Habit created successfully")
+        tracker.mark_habit_as_done(1, 'Swim')
+        habit_id = tracker.get_habit_info('Swim')[0]
+        self.assertEqual(len(tracker.get_habit_tracking_by_id(habit_id)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
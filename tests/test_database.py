@@ -0,0 +1,97 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from connection import close_all_pools
+from database import Database, MIGRATIONS
+
+
+class MigrationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        self.db = Database(self.db_file)
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def query_plan(self, sql, parameters=()):
+        with self.db.pool.connection() as conn:
+            rows = conn.execute("EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+        return " | ".join(row[3] for row in rows)
+
+    def test_migrations_are_ordered(self):
+        versions = [version for version, _, _ in MIGRATIONS]
+        self.assertEqual(versions, sorted(set(versions)))
+
+    def test_migrate_is_idempotent(self):
+        latest = MIGRATIONS[-1][0]
+        self.assertEqual(self.db.migrate(), latest)
+        self.assertEqual(self.db.migrate(), latest)
+        with self.db.pool.connection() as conn:
+            applied = conn.execute("SELECT version FROM schema_version ORDER BY version").fetchall()
+        self.assertEqual([row[0] for row in applied], list(range(1, latest + 1)))
+
+    def test_upgrades_database_without_schema_version(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.execute("CREATE TABLE habits (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, "
+                     "description TEXT NOT NULL, periodicity TEXT NOT NULL, creation_date TIMESTAMP)")
+        conn.commit()
+        conn.close()
+        self.db.migrate()
+        with self.db.pool.connection() as conn:
+            columns = [col[1] for col in conn.execute("PRAGMA table_info(habits)")]
+        self.assertIn('user_id', columns)
+
+    def test_initialize_database_on_fresh_file(self):
+        self.assertEqual(self.db.initialize_database(), "Database initialized successfully")
+
+    def test_habit_lookups_use_indexes(self):
+        self.db.migrate()
+        self.assertIn("USING INDEX idx_habits_user_name_nocase (user_id=?)",
+                      self.query_plan("SELECT * FROM habits WHERE user_id=?", (1,)))
+        self.assertIn("INDEX idx_habits_user_name_nocase (user_id=? AND name=?)",
+                      self.query_plan("SELECT id FROM habits WHERE user_id=? AND name=? COLLATE NOCASE", (1, 'Swim')))
+        with self.db.pool.connection() as conn:
+            names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'habits' "
+                                                    "AND type = 'index' AND sql IS NOT NULL ORDER BY name")]
+        self.assertEqual(names, ['idx_habits_user_name_nocase'])
+
+    def test_tracking_lookups_use_indexes(self):
+        self.db.migrate()
+        plan = self.query_plan("SELECT checked_at FROM habit_tracking WHERE habit_id = ? ORDER BY checked_at", (1,))
+        self.assertIn("idx_habit_tracking_habit_checked (habit_id=?)", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+        # With statistics showing the window is selective, the range scan reads only recent rows
+        with self.db.pool.transaction() as conn:
+            conn.executemany("INSERT INTO habit_tracking (habit_id, checked_at) VALUES (?, ?)",
+                             [(i % 50, f'2023-01-{i % 28 + 1:02d}') for i in range(2000)])
+            conn.executemany("INSERT INTO habit_tracking (habit_id, checked_at) VALUES (?, '2024-05-01')",
+                             [(i,) for i in range(5)])
+            conn.execute("ANALYZE")
+        plan = self.query_plan("SELECT habit_id FROM habit_tracking WHERE checked_at >= ? GROUP BY habit_id",
+                               ('2024-01-01',))
+        # Either the checked_at index or a skip-scan of (habit_id, checked_at) may win, but
+        # both must seek to the start of the window instead of scanning the table
+        self.assertRegex(plan, r"SEARCH habit_tracking USING COVERING INDEX idx_habit_tracking_\w+ \(.*checked_at>\?\)")
+
+    def test_ensure_schema_migrates_only_when_behind(self):
+        self.assertEqual(self.db.schema_version(), 0)
+        self.assertEqual(self.db.ensure_schema(), 0)
+        latest = MIGRATIONS[-1][0]
+        self.assertEqual(self.db.schema_version(), latest)
+        self.assertEqual(self.db.ensure_schema(), latest)
+
+    def test_populate_tables_fills_the_right_columns(self):
+        self.db.migrate()
+        self.db.populate_tables()
+        habits = {row[2]: row[3:5] for row in self.db.get_habits_by_user_id(1)}
+        self.assertEqual(len(habits), 6)
+        self.assertEqual(habits['Drink 1 lt of water'], ('Drink 1 liter of water every day', 'daily'))
+        self.assertEqual(habits['Swim'], ('Swim every week', 'weekly'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from datetime import datetime
+from analytics import Analytics
+from habit import Habit, User
+from habit_calendar import HabitCalendar, to_epoch_seconds
+
+
+class HabitModelTestCase(unittest.TestCase):
+    def test_check_ins_are_kept_sorted(self):
+        habit = Habit(1, 'Walk', '', 'daily', ':memory:')
+        for checked_at in ('2024-05-03 08:00:00', '2024-05-01 08:00:00', datetime(2024, 5, 2, 21, 30),
+                           '2024-05-04 07:00:00'):
+            habit.add_checkin(checked_at)
+        self.assertEqual(list(habit.checkins), sorted(habit.checkins))
+        self.assertEqual(habit.tracking_data[2], datetime(2024, 5, 3, 8))
+        self.assertEqual(habit.calculate_habit_streak(), 4)
+
+    def test_tracking_data_round_trip(self):
+        habit = Habit(1, 'Walk', '', 'weekly', ':memory:')
+        habit.tracking_data = ['2024-05-13 10:00:00', datetime(2024, 5, 6, 9)]
+        self.assertEqual(habit.tracking_data, [datetime(2024, 5, 6, 9), datetime(2024, 5, 13, 10)])
+        self.assertEqual(habit.checkins[0], to_epoch_seconds('2024-05-06 09:00:00'))
+        self.assertFalse(hasattr(habit, '__dict__'))
+
+    def test_epoch_calendar_matches_datetime_calendar(self):
+        checkins = [datetime(1969, 12, 28, 23), datetime(1970, 1, 1), datetime(2024, 2, 29, 23, 59),
+                    datetime(2024, 3, 1), datetime(2024, 3, 4, 12)]
+        for periodicity in ('daily', 'weekly'):
+            expected = HabitCalendar(periodicity, checkins)
+            calendar = HabitCalendar.from_epoch_seconds(periodicity, [to_epoch_seconds(value) for value in checkins])
+            self.assertEqual((calendar.origin, calendar.bits), (expected.origin, expected.bits))
+
+    def test_user_indexes_habits_by_name(self):
+        user = User(1, 'user@example.com', 'user', 'password', datetime.now())
+        first, second = Habit(1, 'Walk', '', 'daily', ':memory:'), Habit(1, 'Walk', '', 'weekly', ':memory:')
+        user.add_habit(first)
+        user.add_habit(second)
+        self.assertIs(user.get_habit('Walk'), first)
+        user.remove_habit(first)
+        self.assertIs(user.get_habit('Walk'), second)
+        self.assertIs(Analytics(user)._find_habit('Walk'), second)
+        user.remove_habit(second)
+        self.assertIsNone(user.get_habit('Walk'))
+
+
+if __name__ == '__main__':
+    unittest.main()
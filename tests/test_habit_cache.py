@@ -0,0 +1,111 @@
+import os
+import tempfile
+import threading
+import unittest
+from connection import close_all_pools
+from database import Database
+from habit import Habit
+from habit_cache import LRUCache
+from habit_tracker import HabitTracker
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = LRUCache(maxsize=2, ttl=10.0, clock=lambda: self.now)
+
+    def test_hits_misses_and_evictions(self):
+        self.assertEqual(self.cache.get_or_load('a', lambda: 1), 1)
+        self.assertEqual(self.cache.get_or_load('a', lambda: 2), 1)
+        self.cache.get_or_load('b', lambda: 2)
+        self.cache.get_or_load('a', lambda: 3)
+        self.cache.get_or_load('c', lambda: 3)
+        # 'b' was the least recently used entry
+        self.assertEqual(self.cache.get_or_load('b', lambda: 4), 4)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['size']), (2, 4, 2, 2))
+
+    def test_entries_expire(self):
+        self.cache.get_or_load('a', lambda: 1)
+        self.now = 10.5
+        self.assertEqual(self.cache.get_or_load('a', lambda: 2), 2)
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    def test_invalidation_during_load_is_not_cached(self):
+        def load():
+            self.cache.invalidate(lambda key: True)
+            return 'stale'
+
+        self.assertEqual(self.cache.get_or_load('a', load), 'stale')
+        self.assertEqual(self.cache.get_or_load('a', lambda: 'fresh'), 'fresh')
+
+    def test_concurrent_use(self):
+        cache = LRUCache(maxsize=50)
+        wrong = []
+
+        def worker(offset):
+            for index in range(2000):
+                key = (index + offset) % 80
+                if cache.get_or_load(key, lambda: key * 2) != key * 2:
+                    wrong.append(key)
+                if index % 97 == 0:
+                    cache.invalidate(lambda cached: cached % 7 == offset)
+
+        threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(wrong, [])
+        stats = cache.stats()
+        self.assertLessEqual(stats['size'], 50)
+        self.assertEqual(stats['hits'] + stats['misses'], 8000)
+
+
+class HabitCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        Database(self.db_file).migrate()
+        self.tracker = HabitTracker(1, self.db_file)
+        self.tracker.create_habit(1, 'Exercise', 'Hit the gym.', 'daily')
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def test_repeated_lookups_are_served_from_the_cache(self):
+        first = self.tracker.get_habit_info('Exercise')
+        hits = self.tracker.cache.stats()['hits']
+        self.assertEqual(self.tracker.get_habit_info('Exercise'), first)
+        self.assertEqual(self.tracker.cache.stats()['hits'], hits + 1)
+
+    def test_writes_invalidate(self):
+        # A second tracker for the same user shares the pool's cache
+        other = HabitTracker(1, self.db_file)
+        self.assertIsNone(self.tracker.get_habit_info('Reading'))
+        self.assertEqual(len(other.get_all_habits()), 1)
+        self.assertEqual(len(Database(self.db_file).get_habits_by_user_id(1)), 1)
+
+        other.create_habit(1, 'Reading', 'Read a book.', 'weekly')
+        self.assertEqual(self.tracker.get_habit_info('Reading')[2], 'Reading')
+        self.assertEqual(len(self.tracker.get_all_habits()), 2)
+        self.assertEqual(len(Database(self.db_file).get_habits_by_user_id(1)), 2)
+
+        other.update_habit('Reading', new_name='Study', new_periodicity='daily')
+        self.assertIsNone(self.tracker.get_habit_info('Reading'))
+        self.assertEqual(self.tracker.get_habit_info('Study')[4], 'daily')
+
+        other.remove_habit('Study')
+        self.assertIsNone(self.tracker.get_habit_info('Study'))
+        Habit(1, 'Exercise', '', 'daily', self.db_file).delete_habit()
+        self.assertEqual(self.tracker.get_all_habits(), [])
+        self.assertEqual(Database(self.db_file).get_habits_by_user_id(1), [])
+
+    def test_callers_cannot_modify_cached_lists(self):
+        self.tracker.get_all_habits().clear()
+        self.assertEqual(len(self.tracker.get_all_habits()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from datetime import date, datetime
+from habit import Habit
+from habit_calendar import HabitCalendar, period_ordinal, period_start
+
+
+class HabitCalendarTestCase(unittest.TestCase):
+    def test_check_ins_within_a_day_count_once(self):
+        calendar = HabitCalendar('daily', ['2024-05-01 07:00:00', '2024-05-01 23:59:00',
+                                           '2024-05-02 00:01:00', '2024-05-03 21:00:00'])
+        self.assertEqual(len(calendar), 3)
+        self.assertEqual(calendar.longest_run(), (3, period_ordinal(date(2024, 5, 1), 'daily')))
+
+    def test_weekly_periods_start_on_monday(self):
+        self.assertEqual(period_start(period_ordinal('2024-05-12 23:00:00', 'weekly'), 'weekly'), date(2024, 5, 6))
+        self.assertEqual(period_start(period_ordinal(date(1969, 12, 31), 'weekly'), 'weekly'), date(1969, 12, 29))
+        calendar = HabitCalendar('weekly', ['2024-05-06 08:00:00', '2024-05-19 22:00:00', '2024-06-03 08:00:00'])
+        self.assertEqual(calendar.longest_streak(), 2)
+        self.assertEqual(calendar.completion_rate(), 3 / 5)
+
+    def test_backfilled_periods_extend_the_calendar(self):
+        calendar = HabitCalendar('daily', [date(2024, 5, 3), date(2024, 5, 1)])
+        calendar.add(date(2024, 5, 2))
+        self.assertEqual(list(calendar.periods()), [period_ordinal(date(2024, 5, day), 'daily') for day in (1, 2, 3)])
+        self.assertIn('2024-05-02 12:00:00', calendar)
+        self.assertNotIn('2024-04-30 12:00:00', calendar)
+
+    def test_current_streak_and_on_track(self):
+        calendar = HabitCalendar('daily', [date(2024, 5, day) for day in (1, 3, 4)])
+        self.assertEqual(calendar.current_run(), (2, period_ordinal(date(2024, 5, 3), 'daily')))
+        self.assertTrue(calendar.is_on_track(datetime(2024, 5, 5, 23)))
+        self.assertEqual(calendar.current_streak(datetime(2024, 5, 6)), 0)
+        self.assertEqual(calendar.completion_rate(date(2024, 4, 29), date(2024, 5, 8)), 3 / 10)
+
+    def test_habit_status(self):
+        habit = Habit(1, 'Walk', '', 'weekly', ':memory:')
+        self.assertEqual(habit.check_habit_status(), "No tracking data available")
+        habit.tracking_data = [datetime.now()]
+        self.assertEqual(habit.check_habit_status(), "Habit is on track")
+        self.assertEqual(habit.calculate_habit_streak(), 1)
+        habit.periodicity = 'monthly'
+        self.assertEqual(habit.check_habit_status(), "Invalid periodicity")
+
+
+if __name__ == '__main__':
+    unittest.main()
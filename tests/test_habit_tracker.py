@@ -1,5 +1,13 @@
 import unittest
 import os
+import random
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from unittest import mock
+from connection import close_all_pools
+from database import Database
+from habit_tracker import HabitTracker
 
 class MyTestCase(unittest.TestCase):
     def setUp(self):
@@ -25,6 +33,142 @@ class MyTestCase(unittest.TestCase):
         # Another test case that doesn't interact with the file
         pass
 
+class HabitTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        Database(self.db_file).migrate()
+        self.tracker = HabitTracker(1, self.db_file)
+        self.tracker.create_habit(1, 'Exercise', 'Hit the gym.', 'daily')
+        self.tracker.create_habit(1, 'Reading', 'Read for at least 30 minutes.', 'weekly')
+        HabitTracker(2, self.db_file).create_habit(2, 'Exercise', 'Hit the gym.', 'daily')
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def count_checkins(self, habit_id):
+        return len(self.tracker.get_habit_tracking_by_id(habit_id))
+
+    def test_bulk_check_in_by_name_and_id(self):
+        reading_id = self.tracker.get_habit_info('Reading')[0]
+        result = self.tracker.mark_habits_done_bulk([
+            (1, 'Exercise', '2024-05-01 08:00:00'),
+            (1, 'Exercise', datetime(2024, 5, 2, 8, 0)),
+            (1, reading_id, None),
+            (2, 'Exercise', '2024-05-01'),
+        ], chunk_size=2)
+        self.assertEqual(result, {"inserted": 4, "rejected": []})
+        self.assertEqual(self.count_checkins(reading_id), 1)
+
+    def test_bulk_check_in_rejects_bad_records(self):
+        reading_id = self.tracker.get_habit_info('Reading')[0]
+        bad = [
+            (1, 'Unknown', None),
+            (2, reading_id, None),
+            (1, 'Exercise', 'not a date'),
+            ('too', 'short'),
+            (1, ['Exercise'], None),
+            (1, {'name': 'Exercise'}, None),
+            ([1], 'Exercise', None),
+        ]
+        result = self.tracker.mark_habits_done_bulk(bad + [(1, 'Exercise', None)])
+        self.assertEqual(result["inserted"], 1)
+        self.assertEqual([record for record, _ in result["rejected"]], bad)
+        self.assertEqual([reason for _, reason in result["rejected"][3:]], ["Malformed record"] * 4)
+
+    def test_bulk_check_in_rejects_the_chunk_that_fails(self):
+        insert = HabitTracker._insert_checkins
+        calls = []
+
+        def fail_second_chunk(conn, rows):
+            calls.append(rows)
+            if len(calls) == 2:
+                raise sqlite3.OperationalError("database is locked")
+            insert(conn, rows)
+
+        records = [(1, 'Exercise', f'2024-05-0{day} 08:00:00') for day in range(1, 7)] + [(1, 'Unknown', None)]
+        with mock.patch.object(HabitTracker, '_insert_checkins', staticmethod(fail_second_chunk)):
+            result = self.tracker.mark_habits_done_bulk(records, chunk_size=2)
+        self.assertEqual(result["inserted"], 4)
+        self.assertEqual(result["rejected"], [(records[2], "Database error: database is locked"),
+                                              (records[3], "Database error: database is locked"),
+                                              (records[6], "Unknown habit")])
+        self.assertEqual(self.count_checkins(self.tracker.get_habit_info('Exercise')[0]), 4)
+
+    def test_longest_streak_matches_per_habit_calculation(self):
+        rng = random.Random(7)
+        habit_ids = [row[1] for row in self.tracker.get_all_habits()]
+        records = []
+        for habit_id in habit_ids:
+            day = datetime(2024, 1, 1, 9, 0)
+            for _ in range(40):
+                day += timedelta(hours=rng.choice([0, 5, 20, 24, 24, 30, 48, 72, 170]))
+                records.append((habit_id, day.strftime('%Y-%m-%d %H:%M:%S'), 0))
+        with self.tracker.pool.transaction() as conn:
+            self.tracker._insert_checkins(conn, records)
+
+        expected = {}
+        for _, habit_id, _, _, periodicity, _ in self.tracker.get_all_habits():
+            rows = sorted(row[2] for row in self.tracker.get_habit_tracking_by_id(habit_id))
+            expected[habit_id] = self.tracker.calculate_streak(
+                [{"checked_at": datetime.fromisoformat(checked_at)} for checked_at in rows], periodicity)
+        streaks = self.tracker.get_habits_with_longest_streak()
+        self.assertEqual({row[0]: row[5:] for row in streaks}, expected)
+
+    def test_longest_streak_range(self):
+        self.tracker.mark_habits_done_bulk([(1, 'Exercise', f'2024-05-{day:02d}') for day in (1, 2, 3, 5, 6)])
+        streak = [row for row in self.tracker.get_habits_with_longest_streak() if row[1] == 'Exercise'][0]
+        self.assertEqual(streak[5:], (3, datetime(2024, 5, 1), datetime(2024, 5, 3)))
+
+    def test_habits_are_ordered_by_longest_streak(self):
+        self.tracker.create_habit(1, 'Archery', '', 'daily')
+        self.tracker.mark_habits_done_bulk([(1, 'Exercise', f'2024-05-{day:02d}') for day in (1, 2, 3)]
+                                           + [(1, 'Archery', '2024-05-01'), (1, 'Reading', '2024-05-01')])
+        self.assertEqual([(row[1], row[5]) for row in self.tracker.get_habits_with_longest_streak()],
+                         [('Exercise', 3), ('Archery', 1), ('Reading', 1)])
+
+    def test_streaks_count_periods_not_exact_intervals(self):
+        self.tracker.mark_habits_done_bulk([
+            (1, 'Exercise', '2024-05-01 07:00:00'),
+            (1, 'Exercise', '2024-05-01 21:00:00'),
+            (1, 'Exercise', '2024-05-02 23:30:00'),
+            (1, 'Exercise', '2024-05-03 06:15:00'),
+            (1, 'Reading', '2024-05-06 10:00:00'),
+            (1, 'Reading', '2024-05-19 22:00:00'),
+        ])
+        self.assertEqual(self.tracker.get_streak('Exercise').longest_streak, 3)
+        reading = self.tracker.get_streak('Reading')
+        self.assertEqual((reading.longest_streak, reading.longest_start), (2, datetime(2024, 5, 6)))
+
+    def test_queries_are_scoped_to_the_user(self):
+        other = HabitTracker(2, self.db_file)
+        own_id = self.tracker.get_habit_info('Exercise')[0]
+        other_id = other.get_habit_info('Exercise')[0]
+        self.assertNotEqual(own_id, other_id)
+        self.assertIsNone(other.get_habit_info('Reading'))
+        self.assertEqual([row[2] for row in other.get_all_habits()], ['Exercise'])
+        self.assertEqual([habit.name for habit in other.iter_all_habits(records=True)], ['Exercise'])
+
+        self.tracker.mark_habits_done_bulk([(1, 'Exercise', '2024-05-01'), (2, 'Exercise', '2024-05-02')])
+        self.assertEqual(other.get_habit_tracking_by_id(own_id), [])
+        self.assertEqual(list(other.iter_habit_tracking_by_id(own_id)), [])
+        self.assertEqual([row[0] for row in other.get_habits_with_longest_streak()], [other_id])
+
+        other.update_habit('Reading', new_description='Not mine')
+        other.remove_habit('Reading')
+        self.assertEqual(self.tracker.get_habit_info('Reading')[3], 'Read for at least 30 minutes.')
+        other.remove_habit('Exercise')
+        self.assertIsNone(other.get_habit_info('Exercise'))
+        self.assertEqual(self.tracker.get_habit_info('Exercise')[0], own_id)
+
+        self.assertEqual(other.create_habit(1, 'Swimming', '', 'daily'),
+                         "Error creating habit: user 1 is not the tracker's user")
+        self.assertIsNone(self.tracker.get_habit_info('Swimming'))
+        self.assertEqual(other.create_habit(2, 'Swimming', '', 'daily'), "Habit created successfully")
+        self.assertEqual([row[2] for row in other.get_all_habits()], ['Swimming'])
+
+
 class TestSuite(unittest.TestSuite):
     def __init__(self):
         super().__init__()
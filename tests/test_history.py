@@ -0,0 +1,68 @@
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from connection import close_all_pools
+from database import Database
+from habit_tracker import HabitTracker
+from history import CheckIn, HabitRecord, checkin_key, iter_checkin_batches
+
+
+class HistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        self.database = Database(self.db_file)
+        self.database.migrate()
+        self.tracker = HabitTracker(1, self.db_file)
+        for name in ('Exercise', 'Reading', 'Swim'):
+            self.tracker.create_habit(1, name, '', 'daily')
+        rng = random.Random(5)
+        records = []
+        for name in ('Exercise', 'Reading', 'Swim'):
+            for _ in range(250):
+                # Duplicate timestamps make the id tie-breaker matter
+                day = datetime(2024, 1, 1) + timedelta(hours=rng.randint(0, 100))
+                records.append((1, name, day))
+        rng.shuffle(records)
+        self.tracker.mark_habits_done_bulk(records)
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def expected(self, habit_id=None):
+        with self.tracker.pool.connection() as conn:
+            rows = conn.execute("SELECT id, habit_id, checked_at FROM habit_tracking").fetchall()
+        return sorted((row for row in rows if habit_id in (None, row[1])), key=checkin_key)
+
+    def test_streams_every_check_in_in_key_order(self):
+        for batch_size in (1, 7, 1000):
+            self.assertEqual(list(self.database.iter_habit_tracking(batch_size=batch_size)), self.expected())
+        self.assertEqual(list(self.tracker.iter_habit_tracking_by_id(2, batch_size=16)), self.expected(2))
+
+    def test_batches_are_bounded(self):
+        sizes = [len(batch) for batch in iter_checkin_batches(self.tracker.pool, batch_size=100)]
+        self.assertEqual(sizes, [100] * 7 + [50])
+
+    def test_resume_after_a_key(self):
+        expected = self.expected()
+        after = checkin_key(expected[299])
+        self.assertEqual(list(self.database.iter_habit_tracking(batch_size=64, after=after)), expected[300:])
+        expected = self.expected(3)
+        after = checkin_key(expected[9])
+        self.assertEqual(list(self.tracker.iter_habit_tracking_by_id(3, after=after)), expected[10:])
+
+    def test_typed_records(self):
+        record = next(self.tracker.iter_habit_tracking_by_id(1, records=True))
+        self.assertIsInstance(record, CheckIn)
+        self.assertIsInstance(record.checked_at, datetime)
+        self.assertEqual(checkin_key(record), checkin_key(self.expected(1)[0]))
+        habits = list(self.tracker.iter_all_habits(batch_size=2, records=True))
+        self.assertEqual([habit.name for habit in habits], ['Exercise', 'Reading', 'Swim'])
+        self.assertIsInstance(habits[0], HabitRecord)
+
+
+if __name__ == '__main__':
+    unittest.main()
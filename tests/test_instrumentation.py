@@ -0,0 +1,92 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+import instrumentation
+from connection import close_all_pools
+from database import Database
+from habit_tracker import HabitTracker
+from instrumentation import JsonLinesSink, MemorySink, PrometheusSink
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        Database(self.db_file).migrate()
+        self.tracker = HabitTracker(1, self.db_file)
+        self.tracker.create_habit(1, 'Exercise', 'Hit the gym.', 'daily')
+        self.tracker.mark_habits_done_bulk([(1, 'Exercise', f'2024-05-{day:02d} 08:00:00') for day in range(1, 21)])
+
+    def tearDown(self):
+        instrumentation.disable()
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def test_records_statements_rows_and_timings(self):
+        sink = MemorySink()
+        instrumentation.enable(sink)
+        habit_id = self.tracker.get_habit_info('Exercise')[0]
+        self.assertEqual(len(self.tracker.get_habit_tracking_by_id(habit_id)), 20)
+        self.tracker.mark_habit_as_done(1, 'Exercise')
+
+        tracking, checkin = sink.records[1], sink.records[2]
+        self.assertEqual(tracking.method, 'HabitTracker.get_habit_tracking_by_id')
+        self.assertEqual([statement.sql for statement in tracking.statements],
+                         ["SELECT t.id, t.habit_id, t.checked_at FROM habit_tracking t JOIN habits h ON h.id = t.habit_id "
+                          "WHERE t.habit_id = ? AND h.user_id = ?"])
+        self.assertEqual(tracking.rows_returned, 20)
+        self.assertGreater(tracking.wall_seconds, 0)
+        self.assertGreaterEqual(tracking.acquire_seconds, 0)
+        # The check-in row plus the habit_streaks row its trigger maintains
+        self.assertGreaterEqual(checkin.rows_changed, 1)
+        self.assertEqual(sink.snapshot()['HabitTracker.mark_habit_as_done']['calls'], 1)
+
+    def test_nested_calls_are_part_of_the_outer_call(self):
+        sink = MemorySink()
+        instrumentation.enable(sink)
+        self.tracker.create_habit(1, 'Reading', '', 'weekly')
+        self.assertEqual([record.method for record in sink.records], ['HabitTracker.create_habit'])
+
+    def test_errors_are_counted(self):
+        sink = MemorySink()
+        instrumentation.enable(sink)
+        with self.tracker.pool.transaction() as conn:
+            conn.execute("DROP TABLE habit_streaks")
+        self.tracker.update_habit('Exercise', new_periodicity='weekly')
+        self.assertEqual(sink.snapshot()['HabitTracker.update_habit']['errors'], 1)
+
+    def test_slow_query_log_captures_the_plan(self):
+        sink = MemorySink()
+        instrumentation.enable(sink, slow_query_ms=0)
+        self.tracker.get_habit_tracking_by_id(1)
+        plans = [entry['plan'] for entry in sink.slow_queries if entry['plan']]
+        self.assertTrue(any('idx_habit_tracking_habit_checked' in step for plan in plans for step in plan))
+
+    def test_json_lines_sink(self):
+        output = io.StringIO()
+        instrumentation.enable(JsonLinesSink(output))
+        self.tracker.get_all_habits()
+        entry = json.loads(output.getvalue().splitlines()[0])
+        self.assertEqual((entry['type'], entry['method']), ('call', 'HabitTracker.get_all_habits'))
+
+    def test_prometheus_text(self):
+        sink = PrometheusSink()
+        instrumentation.enable(sink)
+        self.tracker.get_worst_streak_habit()
+        text = sink.render()
+        self.assertIn('habit_tracker_calls_total{method="HabitTracker.get_worst_streak_habit"} 1', text)
+        self.assertIn('habit_tracker_call_seconds_bucket{method="HabitTracker.get_worst_streak_habit",le="+Inf"} 1',
+                      text)
+
+    def test_disabled_records_nothing(self):
+        sink = MemorySink()
+        instrumentation.enable(sink)
+        instrumentation.disable()
+        self.tracker.get_all_habits()
+        self.assertEqual(len(sink.records), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
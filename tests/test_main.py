@@ -0,0 +1,50 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from connection import close_all_pools
+from main import SAMPLE_HABITS, startup
+
+
+class StartupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def test_startup_seeds_only_a_new_database(self):
+        user, tracker = startup(self.db_file)
+        seeded = len(user.habits)
+        self.assertEqual(seeded, 6 + len(SAMPLE_HABITS))
+        tracker.mark_habit_as_done(1, 'Exercise')
+        tracker.remove_habit('Coffee')
+
+        user, tracker = startup(self.db_file)
+        self.assertEqual(len(user.habits), seeded - 1)
+        habit_id = tracker.get_habit_info('Exercise')[0]
+        self.assertEqual(len(tracker.get_habit_tracking_by_id(habit_id)), 1)
+
+    def test_startup_keeps_a_database_from_before_the_migrations(self):
+        shipped = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main_db.db')
+        shutil.copyfile(shipped, self.db_file)
+        with sqlite3.connect(self.db_file) as conn:
+            habits = conn.execute("SELECT COUNT(*) FROM habits WHERE user_id = 1").fetchone()[0]
+            self.assertIsNone(conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'schema_version'").fetchone())
+        user, _ = startup(self.db_file)
+        self.assertEqual(len(user.habits), habits)
+
+    def test_importing_main_skips_the_interactive_dependencies(self):
+        code = "import sys, main; print('questionary' in sys.modules, 'tabulate' in sys.modules)"
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+        self.assertEqual(output.split(), ['False', 'False'])
+
+
+if __name__ == '__main__':
+    unittest.main()
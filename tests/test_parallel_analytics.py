@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+from collections import Counter
+from datetime import datetime
+from connection import close_all_pools
+from database import Database
+from habit_calendar import HabitCalendar
+from loadgen import generate
+from parallel_analytics import analyze, partition_ranges, _connect_read_only
+
+
+class ParallelAnalyticsTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.db_file = os.path.join(cls.temp_dir.name, 'test.db')
+        Database(cls.db_file).migrate()
+        generate(cls.db_file, users=6, habits_per_user=5, checkins_per_habit=60, seed=3)
+        database = Database(cls.db_file)
+        with database.pool.transaction() as conn:
+            conn.execute("INSERT INTO habits (user_id, name, description, periodicity) VALUES (1, 'Idle', '', 'daily')")
+            conn.execute("INSERT INTO habit_tracking (habit_id, checked_at) VALUES (1, NULL)")
+        cls.as_of = datetime(2023, 6, 1)
+        close_all_pools()
+
+    @classmethod
+    def tearDownClass(cls):
+        close_all_pools()
+        cls.temp_dir.cleanup()
+
+    def expected(self):
+        """ The report computed one habit at a time with HabitCalendar """
+        with Database(self.db_file).pool.connection() as conn:
+            habits = conn.execute("SELECT id, user_id, name, periodicity FROM habits ORDER BY id").fetchall()
+            streaks, histogram, on_track, checkins = [], Counter(), 0, 0
+            for habit_id, user_id, name, periodicity in habits:
+                rows = conn.execute("SELECT checked_at FROM habit_tracking WHERE habit_id = ? AND checked_at IS NOT NULL",
+                                    (habit_id,)).fetchall()
+                if not rows:
+                    continue
+                calendar = HabitCalendar(periodicity, (row[0] for row in rows))
+                checkins += len(rows)
+                on_track += calendar.is_on_track(self.as_of)
+                histogram[calendar.longest_streak()] += 1
+                streaks.append((-calendar.longest_streak(), habit_id, name))
+        return len(habits), checkins, on_track, dict(sorted(histogram.items())), sorted(streaks)[:5]
+
+    def test_report_matches_a_per_habit_calculation(self):
+        report = analyze(self.db_file, workers=1, top_k=5, as_of=self.as_of)
+        habits, checkins, on_track, histogram, streaks = self.expected()
+        self.assertEqual((report.habits, report.checkins, report.on_track), (habits, checkins, on_track))
+        self.assertEqual(report.tracked_habits, habits - 1)
+        self.assertEqual(report.streak_histogram, histogram)
+        self.assertEqual([(-row[3], row[0], row[2]) for row in report.longest_streaks], streaks)
+        self.assertEqual(sum(report.completion_histogram.values()), habits - 1)
+
+    def test_report_does_not_depend_on_partitioning(self):
+        reference = analyze(self.db_file, workers=1, partitions=1, as_of=self.as_of)
+        for partitions, by in ((3, 'habit'), (7, 'user'), (100, 'habit')):
+            self.assertEqual(analyze(self.db_file, workers=1, partitions=partitions, by=by, as_of=self.as_of),
+                             reference)
+        self.assertEqual(analyze(self.db_file, workers=2, partitions=5, as_of=self.as_of), reference)
+
+    def test_partitions_cover_every_key_once(self):
+        conn = _connect_read_only(self.db_file)
+        try:
+            ranges = partition_ranges(conn, 4)
+            ids = [row[0] for row in conn.execute("SELECT id FROM habits ORDER BY id")]
+        finally:
+            conn.close()
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual([habit_id for habit_id in ids if any(low <= habit_id <= high for low, high in ranges)], ids)
+        self.assertTrue(all(ranges[i][1] < ranges[i + 1][0] for i in range(3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from connection import close_all_pools
+from database import Database
+from loadgen import generate
+from perf_suite import compare, run_suite
+
+
+class LoadGeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def build(self, name, seed):
+        db_file = os.path.join(self.temp_dir.name, name)
+        Database(db_file).migrate()
+        summary = generate(db_file, users=3, habits_per_user=4, checkins_per_habit=30, seed=seed)
+        conn = sqlite3.connect(db_file)
+        rows = conn.execute("SELECT h.name, h.periodicity, t.checked_at FROM habit_tracking t "
+                            "JOIN habits h ON h.id = t.habit_id ORDER BY t.id").fetchall()
+        conn.close()
+        return summary, rows
+
+    def test_same_seed_same_data(self):
+        summary, rows = self.build('a.db', 7)
+        self.assertEqual((summary['users'], summary['habits'], summary['checkins']), (3, 12, len(rows)))
+        self.assertEqual(self.build('b.db', 7)[1], rows)
+        self.assertNotEqual(self.build('c.db', 8)[1], rows)
+
+    def test_suite_reports_every_operation(self):
+        result = run_suite(users=3, habits_per_user=3, checkins_per_habit=20, repeat=5)
+        self.assertEqual(result['dataset']['habits'], 9)
+        for stats in result['operations'].values():
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+        self.assertIn('Analytics.get_completion_rate', result['operations'])
+        self.assertIn('Database.get_habits_by_user_id', result['operations'])
+
+    def test_compare_flags_regressions(self):
+        before = {'operations': {'fast': {'p50_ms': 1.0}, 'slow': {'p50_ms': 1.0}}}
+        after = {'operations': {'fast': {'p50_ms': 0.9}, 'slow': {'p50_ms': 1.5}, 'new': {'p50_ms': 1.0}}}
+        rows, regressions = compare(before, after, threshold=0.2)
+        self.assertEqual([row[0] for row in rows], ['fast', 'slow'])
+        self.assertEqual(regressions, ['slow'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from connection import close_all_pools
+from database import Database
+from habit_tracker import HabitTracker
+from replica import ReadReplica
+
+
+class ReadReplicaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        Database(self.db_file).migrate()
+        self.tracker = HabitTracker(1, self.db_file)
+        self.tracker.create_habit(1, 'Run', '', 'daily')
+        self.tracker.create_habit(1, 'Read', '', 'weekly')
+        self.tracker.mark_habits_done_bulk([(1, 'Run', '2024-05-01 08:00:00'), (1, 'Run', '2024-05-02 08:00:00'),
+                                            (1, 'Read', '2024-05-01 08:00:00')])
+        self.replicas = []
+
+    def tearDown(self):
+        for replica in self.replicas:
+            replica.close()
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def replica(self, **options):
+        replica = ReadReplica(self.db_file, **options)
+        self.replicas.append(replica)
+        return replica
+
+    def test_analytics_read_the_snapshot(self):
+        replica = self.replica(max_staleness=None, pages_per_step=1)
+        tracker = HabitTracker(1, self.db_file, replica=replica)
+        self.assertIsNone(replica.lag())
+        self.assertEqual(tracker.get_habits_with_longest_streak(), self.tracker.get_habits_with_longest_streak())
+        self.assertEqual(tracker.get_worst_streak_habit(), 'Read')
+        self.assertEqual(replica.refreshes, 1)
+
+        # Backfilled check-ins mark the streak stale; the copy rebuilds it without writing to the live file
+        self.tracker.mark_habits_done_bulk([(1, 'Read', '2024-04-24 08:00:00'), (1, 'Read', '2024-04-25 08:00:00')])
+        self.assertEqual(tracker.get_worst_streak_habit(), 'Read')
+        self.assertEqual(replica.stats()["checkins_behind"], 2)
+        self.assertTrue(replica.refresh())
+        self.assertEqual(tracker.get_worst_streak_habit(), 'Run')
+        self.assertEqual({row[1]: row[5] for row in tracker.get_habits_with_longest_streak()}, {'Run': 2, 'Read': 2})
+        with self.tracker.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM habit_streaks WHERE stale = 1").fetchone()[0], 1)
+
+        # Nothing committed since: the snapshot is only marked fresh
+        time.sleep(0.01)
+        lag = replica.lag()
+        self.assertFalse(replica.refresh())
+        self.assertLess(replica.lag(), lag)
+        self.assertEqual((replica.refreshes, replica.skipped), (2, 1))
+        with replica.connection() as conn, self.assertRaises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM habits")
+
+    def test_staleness_bound_and_file_snapshot(self):
+        path = os.path.join(self.temp_dir.name, 'replica.db')
+        replica = self.replica(path=path, max_staleness=0)
+        tracker = HabitTracker(1, self.db_file, replica=replica)
+        self.assertEqual(tracker.get_habit_ranking(), [(1, 'Run', 2), (2, 'Read', 1)])
+        self.tracker.mark_habits_done_bulk([(1, 'Read', '2024-05-03 08:00:00')] * 2)
+        self.assertEqual(tracker.get_habit_ranking(), [(2, 'Read', 3), (1, 'Run', 2)])
+        self.assertEqual(replica.stats()["checkins_behind"], 0)
+        self.assertFalse(os.path.exists(f"{path}.tmp"))
+
+        # Reads go on while a writer holds the live database's write lock
+        writer = sqlite3.connect(self.db_file, isolation_level=None)
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("INSERT INTO habit_tracking (habit_id, checked_at) VALUES (1, '2024-04-20 08:00:00')")
+        try:
+            self.assertEqual(len(tracker.get_habits_with_longest_streak()), 2)
+        finally:
+            writer.execute("COMMIT")
+            writer.close()
+
+    def test_readers_get_their_own_connections(self):
+        replica = self.replica(max_staleness=None)
+        replica.refresh()
+        inside = threading.Barrier(2, timeout=5)
+        seen = {}
+
+        def read(name):
+            with replica.connection() as conn:
+                inside.wait()
+                seen[name] = (id(conn), conn.execute("SELECT COUNT(*) FROM habit_tracking").fetchone()[0])
+                inside.wait()
+
+        reader = threading.Thread(target=read, args=('thread',))
+        reader.start()
+        read('main')
+        reader.join()
+        self.assertNotEqual(seen['thread'][0], seen['main'][0])
+        self.assertEqual(seen['thread'][1], 3)
+
+        # A read in progress keeps its snapshot while a refresh swaps the next one in
+        self.tracker.mark_habits_done_bulk([(1, 'Read', '2024-05-03 08:00:00')])
+        with replica.connection() as conn:
+            self.assertTrue(replica.refresh())
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM habit_tracking").fetchone()[0], 3)
+        with replica.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM habit_tracking").fetchone()[0], 4)
+
+    def test_background_refresh(self):
+        replica = self.replica(max_staleness=None)
+        replica.refresh()
+        replica.start(interval=0.01)
+        self.tracker.mark_habits_done_bulk([(1, 'Read', '2024-05-03 08:00:00')])
+        deadline = time.monotonic() + 5
+        while replica.stats()["checkins_behind"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        replica.stop()
+        self.assertEqual(replica.stats()["checkins_behind"], 0)
+        self.assertGreaterEqual(replica.refreshes, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import random
+import tempfile
+import unittest
+from collections import Counter
+from datetime import date, datetime, timedelta
+from connection import close_all_pools
+from database import Database
+from habit_tracker import HabitTracker
+from rollups import rank_habits, rebuild_rollups
+
+
+def random_timestamp(rng):
+    day = date(1969, 12, 1) + timedelta(days=rng.randint(0, 120)) if rng.random() < 0.1 \
+        else date(2024, 1, 1) + timedelta(days=rng.randint(0, 400))
+    if rng.random() < 0.1:
+        return day.isoformat()
+    return datetime.combine(day, datetime.min.time()).replace(hour=rng.randint(0, 23)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class RollupsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        Database(self.db_file).migrate()
+        self.tracker = HabitTracker(1, self.db_file)
+        for index in range(8):
+            HabitTracker(1 + index % 2, self.db_file).create_habit(1 + index % 2, f'Habit {index}', '', 'daily')
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def rescan(self, conn, start, end, limit, best, user_id):
+        """ The ranking computed from every raw check-in """
+        habits = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT id, name, user_id FROM habits")}
+        counts = Counter()
+        for habit_id, checked_at in conn.execute("SELECT habit_id, checked_at FROM habit_tracking"):
+            if checked_at is None or habit_id not in habits or user_id not in (None, habits[habit_id][1]):
+                continue
+            day = date.fromisoformat(checked_at[:10])
+            if (start is None or day >= start) and (end is None or day <= end):
+                counts[habit_id] += 1
+        ranking = sorted(counts.items(), key=lambda item: (-item[1] if best else item[1], item[0]))
+        return [(habit_id, habits[habit_id][0], count) for habit_id, count in ranking[:limit]]
+
+    def random_writes(self, rng, conn):
+        for _ in range(rng.randint(1, 40)):
+            action = rng.random()
+            if action < 0.7:
+                conn.execute("INSERT INTO habit_tracking (habit_id, checked_at) VALUES (?, ?)",
+                             (rng.randint(1, 9), random_timestamp(rng) if rng.random() > 0.02 else None))
+            elif action < 0.85:
+                conn.execute("DELETE FROM habit_tracking WHERE id = (SELECT id FROM habit_tracking "
+                             "ORDER BY random() LIMIT 1)")
+            else:
+                conn.execute("UPDATE habit_tracking SET checked_at = ?, habit_id = ? WHERE id = "
+                             "(SELECT id FROM habit_tracking ORDER BY random() LIMIT 1)",
+                             (random_timestamp(rng), rng.randint(1, 8)))
+
+    def test_rankings_match_a_full_rescan(self):
+        rng = random.Random(11)
+        for _ in range(60):
+            with self.tracker.pool.transaction() as conn:
+                self.random_writes(rng, conn)
+                for _ in range(5):
+                    start = None if rng.random() < 0.2 else random_timestamp(rng)[:10]
+                    end = None if rng.random() < 0.2 else random_timestamp(rng)[:10]
+                    start = start and date.fromisoformat(start)
+                    end = end and date.fromisoformat(end)
+                    args = (start, end, rng.randint(1, 10), rng.random() < 0.5, rng.choice([None, 1, 2]))
+                    self.assertEqual(rank_habits(conn, *args), self.rescan(conn, *args), args)
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        rng = random.Random(12)
+        with self.tracker.pool.transaction() as conn:
+            for _ in range(30):
+                self.random_writes(rng, conn)
+            tables = ("habit_daily_counts", "habit_weekly_counts", "habit_checkin_totals")
+            incremental = [conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall() for table in tables]
+            rebuild_rollups(conn)
+            rebuilt = [conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall() for table in tables]
+        self.assertEqual(incremental, rebuilt)
+
+    def test_worst_habits(self):
+        self.tracker.mark_habits_done_bulk(
+            [(1, 'Habit 0', None)] * 3 + [(2, 'Habit 1', None)] + [(1, 'Habit 2', None)] * 2
+            + [(1, 'Habit 4', '2020-01-01 08:00:00')])
+        self.assertEqual(self.tracker.get_worst_streak_habit(), 'Habit 4')
+        self.assertEqual(self.tracker.get_worst_habit_last_month(), 'Habit 2')
+        self.assertEqual([row[1] for row in self.tracker.get_habit_ranking(limit=2)], ['Habit 0', 'Habit 2'])
+        self.assertEqual(HabitTracker(2, self.db_file).get_worst_streak_habit(), 'Habit 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from connection import close_all_pools, get_pool
+from database import Database
+from habit_tracker import HabitTracker
+from scheduler import DUE, OVERDUE, DueScheduler
+
+
+def epoch(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+
+class SchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        Database(self.db_file).migrate()
+        self.pool = get_pool(self.db_file)
+        with self.pool.transaction() as conn:
+            conn.executemany("INSERT INTO users (id, email, username, password, utc_offset) VALUES (?, '', '', '', ?)",
+                             [(1, 0), (2, -300)])
+        self.tracker = HabitTracker(1, self.db_file)
+        self.tracker.create_habit(1, 'Run', '', 'daily')
+        self.tracker.create_habit(1, 'Read', '', 'weekly')
+        HabitTracker(2, self.db_file).create_habit(2, 'Swim', '', 'daily')
+        self.tracker.create_habit(1, 'Old', '', 'daily')
+        self.tracker.mark_habits_done_bulk([
+            (1, 'Run', '2024-05-01 08:00:00'), (1, 'Read', '2024-04-30 08:00:00'),
+            (2, 'Swim', '2024-05-01 22:00:00'), (1, 'Old', '2024-03-01 08:00:00'),
+        ])
+        self.ids = {row[2]: row[1] for row in self.tracker.get_all_habits()}
+        self.ids.update({row[2]: row[1] for row in HabitTracker(2, self.db_file).get_all_habits()})
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def events(self, scheduler, now):
+        return [(event.kind, event.at, event.habit_id) for event in scheduler.due_events(now)]
+
+    def test_events_follow_each_users_periods(self):
+        scheduler = DueScheduler.from_database(self.db_file, now=epoch(2024, 5, 1, 12))
+        # The streak of 'Old' broke long before, so it is not scheduled
+        self.assertEqual(len(scheduler), 4)
+        self.assertEqual(scheduler.next_at(), epoch(2024, 5, 2))
+        self.assertEqual(self.events(scheduler, epoch(2024, 5, 1, 23)), [])
+        run, read, swim = self.ids['Run'], self.ids['Read'], self.ids['Swim']
+        self.assertEqual(self.events(scheduler, epoch(2024, 5, 3, 6)), [
+            (DUE, epoch(2024, 5, 2), run),
+            (DUE, epoch(2024, 5, 2, 5), swim),
+            (OVERDUE, epoch(2024, 5, 3), run),
+            (OVERDUE, epoch(2024, 5, 3, 5), swim),
+        ])
+        # The week of 30 April ends on Sunday 5 May
+        self.assertEqual(self.events(scheduler, epoch(2024, 5, 20)), [
+            (DUE, epoch(2024, 5, 6), read),
+            (OVERDUE, epoch(2024, 5, 13), read),
+        ])
+        self.assertIsNone(scheduler.next_at())
+
+    def test_checkins_move_deadlines(self):
+        scheduler = DueScheduler.from_database(self.db_file, now=epoch(2024, 5, 1, 12))
+        run = self.ids['Run']
+        self.assertEqual(self.events(scheduler, epoch(2024, 5, 2, 1)), [(DUE, epoch(2024, 5, 2), run)])
+        self.tracker.mark_habits_done_bulk([(1, 'Run', '2024-05-02 07:00:00'), (1, 'Run', '2024-05-02 09:00:00')])
+        self.tracker.create_habit(1, 'Walk', '', 'daily')
+        self.tracker.mark_habits_done_bulk([(1, 'Walk', '2024-05-02 10:00:00')])
+        self.assertEqual(scheduler.sync(self.pool), 3)
+        self.assertEqual(len(scheduler), 5)
+
+        walk = max(row[1] for row in self.tracker.get_all_habits())
+        # The superseded deadline of 3 May is skipped
+        self.assertEqual([event for event in self.events(scheduler, epoch(2024, 5, 4, 1)) if event[2] in (run, walk)], [
+            (DUE, epoch(2024, 5, 3), run), (DUE, epoch(2024, 5, 3), walk),
+            (OVERDUE, epoch(2024, 5, 4), run), (OVERDUE, epoch(2024, 5, 4), walk),
+        ])
+
+    def test_remind_before_and_forget(self):
+        scheduler = DueScheduler.from_database(self.db_file, remind_before=3600, now=epoch(2024, 5, 1, 12))
+        scheduler.forget(self.ids['Swim'])
+        self.assertEqual([event[:3] for event in self.events(scheduler, epoch(2024, 5, 3))],
+                         [(DUE, epoch(2024, 5, 2, 23), self.ids['Run']), (OVERDUE, epoch(2024, 5, 3), self.ids['Run'])])
+        self.assertFalse(scheduler.checked_in(self.ids['Swim'], 0))
+
+    def test_remind_before_zero(self):
+        scheduler = DueScheduler.from_database(self.db_file, remind_before=0, now=epoch(2024, 5, 1, 12))
+        run = self.ids['Run']
+        # Due at the deadline itself: each event is emitted once
+        self.assertEqual([event for event in self.events(scheduler, epoch(2024, 5, 3, 1)) if event[2] == run],
+                         [(DUE, epoch(2024, 5, 3), run), (OVERDUE, epoch(2024, 5, 3), run)])
+        self.assertEqual(self.events(scheduler, epoch(2024, 5, 3, 1)), [])
+        with self.assertRaises(ValueError):
+            DueScheduler(remind_before=-1)
+
+
+if __name__ == '__main__':
+    unittest.main()
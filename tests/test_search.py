@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+from connection import close_all_pools
+from database import Database
+from habit_tracker import HabitTracker
+from search import rebuild_search_index, search_habits
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        self.database = Database(self.db_file)
+        self.database.migrate()
+        self.tracker = HabitTracker(1, self.db_file)
+        self.tracker.create_habit(1, 'Exercise', 'Hit the gym or go running.', 'daily')
+        self.tracker.create_habit(1, 'Running', 'Morning run in the park.', 'daily')
+        self.tracker.create_habit(1, 'Café reading', 'Read a chapter over coffee.', 'weekly')
+        HabitTracker(2, self.db_file).create_habit(2, 'Running', 'Evening run.', 'daily')
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def names(self, text, user_id=1, **options):
+        with self.database.pool.connection() as conn:
+            return [row.name for row in search_habits(conn, user_id, text, **options)]
+
+    def test_prefix_matches_are_scoped_and_ranked_by_name_first(self):
+        self.assertEqual(self.names('run'), ['Running', 'Exercise'])
+        self.assertEqual(self.names('RUN', user_id=2), ['Running'])
+        self.assertEqual(self.names('run park'), ['Running'])
+        self.assertEqual(self.names('runni'), ['Running', 'Exercise'])
+        self.assertEqual(self.names('rung', fuzzy=False), [])
+        self.assertEqual(sorted(self.names('run', user_id=None)), ['Exercise', 'Running', 'Running'])
+        self.assertEqual(self.names('cafe'), ['Café reading'])
+        self.assertEqual(self.names('  '), [])
+
+    def test_fuzzy_fallback_corrects_typos(self):
+        with self.database.pool.connection() as conn:
+            results = search_habits(conn, 1, 'excercise')
+        self.assertEqual([(row.name, row.fuzzy) for row in results], [('Exercise', True)])
+        self.assertEqual(self.names('excercise', fuzzy=False), [])
+        self.assertEqual(self.names('zzzz'), [])
+
+    def test_index_follows_habit_changes(self):
+        self.tracker.update_habit('running', new_name='Jogging', new_description='Slow laps.')
+        self.assertEqual(self.names('jog'), ['Jogging'])
+        self.assertEqual(self.names('park'), [])
+        self.tracker.remove_habit('EXERCISE')
+        self.assertEqual(self.names('gym'), [])
+        with self.database.pool.transaction() as conn:
+            rebuild_search_index(conn)
+        self.assertEqual(self.names('jog'), ['Jogging'])
+
+    def test_name_lookups_ignore_case(self):
+        self.assertEqual(self.tracker.get_habit_info('exercise')[2], 'Exercise')
+        self.tracker.mark_habit_as_done(1, 'RUNNING')
+        self.assertEqual(self.tracker.get_streak('running').longest_streak, 1)
+        result = self.tracker.mark_habits_done_bulk([(1, 'exercise', '2024-01-01 08:00:00')])
+        self.assertEqual(result['inserted'], 1)
+        self.assertIsNone(HabitTracker(2, self.db_file).get_streak('Running'))
+
+    def test_tracker_search(self):
+        self.assertEqual([row.name for row in self.tracker.search_habits('coffee')], ['Café reading'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import threading
+import unittest
+from connection import close_all_pools
+from database import Database
+from habit_tracker import HabitTracker
+from rollups import rank_habits
+from sharding import ShardRouter
+
+
+class ShardRouterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.router = ShardRouter.from_directory(self.temp_dir.name, 3)
+        self.router.migrate()
+        for user_id in range(1, 7):
+            tracker = self.router.tracker(user_id)
+            tracker.create_habit(user_id, 'Exercise', '', 'daily')
+            tracker.create_habit(user_id, 'Reading', '', 'weekly')
+
+    def tearDown(self):
+        self.router.close()
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def test_users_live_in_their_shard(self):
+        self.assertEqual(self.router.db_file(4), self.router.db_files[1])
+        self.assertEqual(self.router.tracker(4).db_file, self.router.db_file(1))
+        self.assertEqual(len(Database(self.router.db_files[1]).get_habits_by_user_id(4)), 2)
+        self.assertEqual(Database(self.router.db_files[0]).get_habits_by_user_id(4), [])
+        self.assertEqual(self.router.count_rows('habits'), 12)
+
+    def test_bulk_check_ins_are_split_by_shard(self):
+        records = [(user_id, 'Exercise', f'2024-05-{day:02d}') for user_id in range(1, 7) for day in range(1, 4)]
+        result = self.router.mark_habits_done_bulk(records + [(7, 'Exercise', None), ('bad',)])
+        self.assertEqual(result['inserted'], 18)
+        self.assertEqual([record for record, _ in result['rejected']], [('bad',), (7, 'Exercise', None)])
+        for user_id in range(1, 7):
+            self.assertEqual(self.router.tracker(user_id).get_streak('Exercise').longest_streak, 3)
+
+    def test_parallel_writers(self):
+        def write(user_id):
+            tracker = self.router.tracker(user_id)
+            for _ in range(50):
+                tracker.mark_habit_as_done(user_id, 'Reading')
+
+        threads = [threading.Thread(target=write, args=(user_id,)) for user_id in range(1, 7)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.router.count_rows('habit_tracking'), 300)
+
+    def test_fan_out_ranking_matches_a_single_database(self):
+        single = os.path.join(self.temp_dir.name, 'single.db')
+        Database(single).migrate()
+        records = [(user_id, name, f'2024-05-{day:02d}')
+                   for user_id in range(1, 7) for name in ('Exercise', 'Reading')
+                   for day in range(1, (user_id * 3 + len(name)) % 9 + 2)]
+        for user_id in range(1, 7):
+            HabitTracker(user_id, single).create_habit(user_id, 'Exercise', '', 'daily')
+            HabitTracker(user_id, single).create_habit(user_id, 'Reading', '', 'weekly')
+        HabitTracker(1, single).mark_habits_done_bulk(records)
+        self.router.mark_habits_done_bulk(records)
+
+        with Database(single).pool.connection() as conn:
+            for best in (True, False):
+                expected = rank_habits(conn, limit=12, best=best)
+                ranked = self.router.rank_habits(limit=12, best=best)
+                self.assertEqual([row[3] for row in ranked], [row[2] for row in expected])
+                self.assertEqual(sorted(row[2:] for row in ranked), sorted(row[1:] for row in expected))
+                self.assertEqual(self.router.rank_habits(limit=4, best=best), ranked[:4])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from connection import close_all_pools
+from database import Database
+from habit_tracker import HabitTracker
+from streaks import rebuild_streaks, summarize_streaks
+
+
+class HabitStreaksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        Database(self.db_file).migrate()
+        self.tracker = HabitTracker(1, self.db_file)
+        self.tracker.create_habit(1, 'Exercise', 'Hit the gym.', 'daily')
+        self.habit_id = self.tracker.get_habit_info('Exercise')[0]
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def check_in(self, *timestamps):
+        with self.tracker.pool.transaction() as conn:
+            self.tracker._insert_checkins(conn, [(self.habit_id, timestamp, 0) for timestamp in timestamps])
+
+    def stored_rows(self):
+        with self.tracker.pool.connection() as conn:
+            return conn.execute("SELECT * FROM habit_streaks ORDER BY habit_id").fetchall()
+
+    def stale_count(self):
+        with self.tracker.pool.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM habit_streaks WHERE stale = 1").fetchone()[0]
+
+    def expected_summary(self):
+        rows = [(row[1], 'daily', row[2]) for row in self.tracker.get_habit_tracking_by_id(self.habit_id)]
+        return next(summarize_streaks(rows))
+
+    def test_in_order_check_ins_update_incrementally(self):
+        rng = random.Random(3)
+        day = datetime(2024, 1, 1, 7, 30)
+        for _ in range(60):
+            day += timedelta(hours=rng.choice([0, 3, 20, 24, 24, 30, 50]))
+            self.check_in(day.strftime('%Y-%m-%d %H:%M:%S'))
+        self.assertEqual(self.stale_count(), 0)
+        self.assertEqual(self.stored_rows()[0][:7], tuple(self.expected_summary()))
+
+    def test_incremental_rows_match_full_rebuild(self):
+        self.check_in('2024-05-01 08:00:00', '2024-05-02 08:00:00', '2024-05-04 08:00:00')
+        self.tracker.get_streak('Exercise')
+        incremental = self.stored_rows()
+        with self.tracker.pool.transaction() as conn:
+            rebuild_streaks(conn)
+        self.assertEqual(self.stored_rows(), incremental)
+
+    def test_backfill_marks_stale_and_rebuilds(self):
+        self.check_in('2024-05-01 08:00:00', '2024-05-03 08:00:00')
+        self.check_in('2024-05-02 08:00:00')
+        self.assertEqual(self.stale_count(), 1)
+        streak = self.tracker.get_streak('Exercise')
+        self.assertEqual(self.stale_count(), 0)
+        self.assertEqual((streak.longest_streak, streak.longest_start, streak.longest_end),
+                         (3, datetime(2024, 5, 1), datetime(2024, 5, 3)))
+
+    def test_deleted_check_in_rebuilds(self):
+        self.check_in('2024-05-01 08:00:00', '2024-05-02 08:00:00', '2024-05-03 08:00:00')
+        with self.tracker.pool.transaction() as conn:
+            conn.execute("DELETE FROM habit_tracking WHERE checked_at = '2024-05-02 08:00:00'")
+        self.assertEqual(self.tracker.get_streak('Exercise').longest_streak, 1)
+
+    def test_periodicity_change_rebuilds(self):
+        self.check_in('2024-05-01 08:00:00', '2024-05-08 08:00:00')
+        self.assertEqual(self.tracker.get_streak('Exercise').longest_streak, 1)
+        self.tracker.update_habit('Exercise', new_periodicity='weekly')
+        self.assertEqual(self.stale_count(), 1)
+        self.assertEqual(self.tracker.get_streak('Exercise').longest_streak, 2)
+
+    def test_removed_habit_drops_its_streak(self):
+        self.check_in('2024-05-01 08:00:00')
+        self.tracker.remove_habit('Exercise')
+        self.assertEqual(self.stored_rows(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
+from connection import close_all_pools
+from database import Database, MIGRATIONS
+from habit_calendar import period_ordinal
+from habit_tracker import HabitTracker
+from loadgen import generate
+from rollups import rank_habits
+from timekeys import add_period_keys, local_time, parse_time
+
+PERIOD_KEYS_VERSION = next(step[0] for step in MIGRATIONS if step[2] is add_period_keys)
+
+
+class TimekeysTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.temp_dir.name, 'test.db')
+        self.db = Database(self.db_file)
+
+    def tearDown(self):
+        close_all_pools()
+        self.temp_dir.cleanup()
+
+    def keys(self):
+        with self.db.pool.connection() as conn:
+            return conn.execute("SELECT id, checked_at, utc_offset, checked_epoch, day_key, week_key "
+                                "FROM habit_tracking ORDER BY id").fetchall()
+
+    def server_time_zone(self, name):
+        previous = os.environ.get('TZ')
+        os.environ['TZ'] = name
+        time.tzset()
+
+        def restore():
+            if previous is None:
+                os.environ.pop('TZ', None)
+            else:
+                os.environ['TZ'] = previous
+            time.tzset()
+        self.addCleanup(restore)
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), "needs time.tzset")
+    def test_migration_keys_existing_checkins(self):
+        # Check-ins of the first releases are in the server's local time
+        self.server_time_zone('EST5EDT,M3.2.0,M11.1.0')
+        with mock.patch('database.MIGRATIONS', [step for step in MIGRATIONS if step[0] < PERIOD_KEYS_VERSION]):
+            self.db.migrate()
+        tracker = HabitTracker(1, self.db_file)
+        tracker.create_habit(1, 'Read', '', 'weekly')
+        with self.db.pool.transaction() as conn:
+            conn.executemany("INSERT INTO habit_tracking (habit_id, checked_at) VALUES (1, ?)",
+                             [('2024-03-04 23:30:00',), ('1969-12-29',), ('not a date',), ('2024-03-10 08:00:00',),
+                              ('2024-07-01 12:00:00',)])
+            conn.execute("DELETE FROM habit_tracking WHERE checked_at = '2024-03-10 08:00:00'")
+            before = conn.execute("SELECT * FROM habit_weekly_counts ORDER BY week").fetchall()
+
+        self.db.migrate()
+        rows = self.keys()
+        self.assertEqual([row[0] for row in rows], [1, 2, 3, 5])
+        self.assertEqual(rows[0][2:], (-300, 1709595000 + 5 * 3600, period_ordinal('2024-03-04', 'daily'),
+                                       period_ordinal('2024-03-04', 'weekly')))
+        self.assertEqual(rows[1][4:], (-3, 0))
+        self.assertEqual(rows[2][2:], (0, None, None, None))
+        # Daylight saving time
+        self.assertEqual(rows[3][2:4], (-240, int(datetime(2024, 7, 1, 16, tzinfo=timezone.utc).timestamp())))
+        with self.db.pool.transaction() as conn:
+            self.assertEqual(conn.execute("SELECT * FROM habit_weekly_counts ORDER BY week").fetchall(), before)
+            # Deleted ids are not reused after the table is rebuilt
+            conn.execute("INSERT INTO habit_tracking (habit_id, checked_at) VALUES (1, '2024-03-11')")
+            self.assertEqual(conn.execute("SELECT MAX(id) FROM habit_tracking").fetchone()[0], 6)
+            self.assertEqual(conn.execute("SELECT checkins FROM habit_weekly_counts WHERE week = ?",
+                                          (period_ordinal('2024-03-11', 'weekly'),)).fetchone()[0], 1)
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), "needs time.tzset")
+    def test_seeded_checkins_use_the_server_offset(self):
+        self.server_time_zone('EST5EDT,M3.2.0,M11.1.0')
+        self.db.migrate()
+        self.db.populate_tables()
+        rows = self.keys()
+        self.assertTrue(rows)
+        for _, checked_at, utc_offset, checked_epoch, _, _ in rows:
+            self.assertEqual(checked_epoch, int(datetime.fromisoformat(checked_at).timestamp()))
+            self.assertIn(utc_offset, (-300, -240))
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), "needs time.tzset")
+    def test_generated_checkins_use_the_server_offset(self):
+        self.server_time_zone('EST5EDT,M3.2.0,M11.1.0')
+        self.db.migrate()
+        generate(self.db_file, users=2, habits_per_user=3, checkins_per_habit=150, seed=4)
+        rows = self.keys()
+        self.assertEqual({row[2] for row in rows}, {-300, -240})
+        for _, checked_at, utc_offset, checked_epoch, day_key, _ in rows:
+            self.assertEqual((checked_at, utc_offset), local_time(datetime.fromisoformat(checked_at)))
+            self.assertEqual(checked_epoch, int(datetime.fromisoformat(checked_at).timestamp()))
+            self.assertEqual(day_key, period_ordinal(checked_at, 'daily'))
+
+    def test_checkins_are_bucketed_in_the_users_time_zone(self):
+        self.db.migrate()
+        tracker = HabitTracker(1, self.db_file)
+        self.assertEqual(tracker.set_utc_offset(-300), "Error updating time zone: unknown user")
+        with self.db.pool.transaction() as conn:
+            conn.executemany("INSERT INTO users (id, email, username, password) VALUES (?, '', '', '')", [(1,), (2,)])
+        tracker.create_habit(1, 'Run', '', 'daily')
+        HabitTracker(2, self.db_file).create_habit(2, 'Swim', '', 'daily')
+        self.assertEqual(tracker.set_utc_offset(-300), "Time zone updated successfully")
+        HabitTracker(2, self.db_file).set_utc_offset(540)
+        # 02:00 UTC on 2 May is the evening of 1 May in New York and 11:00 on 2 May in Tokyo
+        instant = datetime(2024, 5, 2, 2, 0, tzinfo=timezone.utc)
+        result = tracker.mark_habits_done_bulk([(1, 'Run', instant), (2, 'Swim', instant),
+                                                (1, 'Run', '2024-05-01 07:00:00')])
+        self.assertEqual(result, {"inserted": 3, "rejected": []})
+
+        rows = self.keys()
+        self.assertEqual([row[1:3] for row in rows], [('2024-05-01 21:00:00', -300), ('2024-05-02 11:00:00', 540),
+                                                      ('2024-05-01 07:00:00', -300)])
+        self.assertEqual({row[3] for row in rows[:2]}, {int(instant.timestamp())})
+        may_1 = period_ordinal('2024-05-01', 'daily')
+        self.assertEqual([row[4] for row in rows], [may_1, may_1 + 1, may_1])
+        with self.db.pool.connection() as conn:
+            self.assertEqual(rank_habits(conn, start=date(2024, 5, 1), end=date(2024, 5, 1), best=True),
+                             [(1, 'Run', 2)])
+
+    def test_local_time(self):
+        instant = datetime(2024, 1, 1, 23, 30, tzinfo=timezone.utc)
+        self.assertEqual(local_time(instant, 60), ('2024-01-02 00:30:00', 60))
+        self.assertEqual(local_time(datetime(2024, 1, 1, 23, 30), 60), ('2024-01-01 23:30:00', 60))
+        self.assertEqual(local_time('2024-01-01T23:30:00-02:00', 0), ('2024-01-02 01:30:00', 0))
+        self.assertEqual(local_time(date(2024, 1, 1), -90), ('2024-01-01 00:00:00', -90))
+        checked_at, offset = local_time(None)
+        now = datetime.now().astimezone()
+        self.assertEqual(offset, now.utcoffset() // timedelta(minutes=1))
+        self.assertLess(abs(datetime.fromisoformat(checked_at) - now.replace(tzinfo=None)), timedelta(minutes=1))
+        with self.assertRaises(ValueError):
+            parse_time('yesterday')
+        with self.assertRaises(TypeError):
+            parse_time(12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+""" Canonical check-in times and precomputed period keys.
+
+A check-in's checked_at is the user's wall-clock time, as it always was, and habit_tracking
+stores next to it the user's offset from UTC at that moment (utc_offset, in minutes east
+of UTC). From the two SQLite computes three integer columns once, when the row is written:
+
+    checked_epoch  seconds since 1970-01-01 00:00 UTC
+    day_key        the local day, numbered like habit_calendar.period_ordinal numbers days
+    week_key       the local Monday-based week, numbered the same way
+
+day_key and week_key are indexed, so the rollups, the streaks and period range queries
+group and compare integers and never parse checked_at again. checked_at is read the same
+way whatever its spelling ('2024-05-01', '2024-05-01 08:00:00', '2024-05-01T08:00:00.5');
+values SQLite cannot read as a time get NULL keys and are left out of every period count.
+
+Each user's offset lives in users.utc_offset. NULL, the default, stands for the server's
+local time zone, which is what check-ins were recorded in before offsets existed. A
+check-in row always has a definite offset: check-ins written before the migration, and
+the seeded sample check-ins, get the server's offset at their checked_at (server_offset()),
+and the column's default of 0 goes with checked_at's default, CURRENT_TIMESTAMP, in UTC.
+"""
+from datetime import date, datetime, timedelta, timezone
+from rollups import day_sql, rollup_schema
+from streaks import streak_schema
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+TRACKING_TABLE = f'''CREATE TABLE habit_tracking (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        habit_id INTEGER NOT NULL,
+        checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        utc_offset INTEGER NOT NULL DEFAULT 0,
+        checked_epoch INTEGER GENERATED ALWAYS AS
+            (CAST(strftime('%s', checked_at) AS INTEGER) - utc_offset * 60) STORED,
+        day_key INTEGER GENERATED ALWAYS AS ({day_sql("checked_at")}) STORED,
+        week_key INTEGER GENERATED ALWAYS AS ((day_key + 7000003) / 7 - 1000000) STORED,
+        FOREIGN KEY (habit_id) REFERENCES habits(id)
+    )'''
+
+KEY_INDEXES = [
+    # Covers the per-habit period scans of the streak rebuild and parallel_analytics
+    "CREATE INDEX IF NOT EXISTS idx_habit_tracking_habit_keys ON habit_tracking (habit_id, day_key, week_key)",
+    "CREATE INDEX IF NOT EXISTS idx_habit_tracking_day ON habit_tracking (day_key, habit_id)",
+]
+
+# Day ranges now use idx_habit_tracking_day
+_REPLACED_INDEXES = {"idx_habit_tracking_checked"}
+
+
+def add_period_keys(conn):
+    """ Migration step: add users.utc_offset and rebuild habit_tracking with the generated time columns.
+
+    SQLite cannot add stored generated columns to an existing table, so the check-ins are
+    copied into a new one, keeping their ids, and the indexes and triggers are recreated.
+    """
+    if "utc_offset" not in [column[1] for column in conn.execute("PRAGMA table_info(users)")]:
+        conn.execute("ALTER TABLE users ADD COLUMN utc_offset INTEGER")
+    if "day_key" in [column[1] for column in conn.execute("PRAGMA table_xinfo(habit_tracking)")]:
+        return
+    indexes = [row[1] for row in conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'habit_tracking' AND sql IS NOT NULL")
+        if row[0] not in _REPLACED_INDEXES]
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'habit_tracking'").fetchone()
+
+    conn.execute("ALTER TABLE habit_tracking RENAME TO habit_tracking_unkeyed")
+    conn.execute(TRACKING_TABLE)
+    # Check-ins recorded so far were in the server's local time
+    conn.create_function("server_offset", 1, server_offset, deterministic=True)
+    conn.execute("INSERT INTO habit_tracking (id, habit_id, checked_at, utc_offset) "
+                 "SELECT id, habit_id, checked_at, server_offset(checked_at) FROM habit_tracking_unkeyed")
+    conn.execute("DROP TABLE habit_tracking_unkeyed")
+    if sequence is not None:
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'habit_tracking'", sequence)
+
+    for sql in indexes + KEY_INDEXES:
+        conn.execute(sql)
+    # Dropping the old table dropped its triggers; these read the period keys instead of checked_at
+    for sql in rollup_schema() + streak_schema():
+        conn.execute(sql)
+
+
+def parse_time(value=None):
+    """ A check-in time as a datetime: None is now (in UTC), strings are ISO formatted and dates are midnight.
+
+    Raises:
+        TypeError, ValueError: value is not a time.
+    """
+    if value is None:
+        return datetime.now(timezone.utc)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, datetime.min.time())
+    raise TypeError(f"Cannot read {value!r} as a check-in time")
+
+
+def local_time(value, utc_offset=None):
+    """ The (checked_at, utc_offset) columns of a check-in at time value for a user with utc_offset.
+
+    Naive datetimes are taken to be the user's wall-clock time already; aware ones, like
+    parse_time(None), are converted to it. A utc_offset of None is the server's time zone.
+    """
+    value = parse_time(value) if not isinstance(value, datetime) else value
+    if value.tzinfo is not None:
+        value = value.astimezone(None if utc_offset is None else timezone(timedelta(minutes=utc_offset)))
+    elif utc_offset is None:
+        value = value.astimezone()
+    else:
+        value = value.replace(tzinfo=timezone(timedelta(minutes=utc_offset)))
+    return value.strftime(TIMESTAMP_FORMAT), int(value.utcoffset().total_seconds()) // 60
+
+
+def server_offset(checked_at):
+    """ The server's utc_offset, in minutes, at the local wall-clock time checked_at; 0 if it is not a time """
+    try:
+        value = datetime.fromisoformat(checked_at)
+    except (TypeError, ValueError):
+        return 0
+    return int(value.astimezone().utcoffset().total_seconds()) // 60
+
+
+def user_offsets(conn, user_ids):
+    """ {user_id: utc_offset} of the given users; users without a row or an offset map to None """
+    user_ids = list(user_ids)
+    offsets = dict.fromkeys(user_ids)
+    for start in range(0, len(user_ids), 500):
+        chunk = user_ids[start:start + 500]
+        offsets.update(conn.execute(
+            f"SELECT id, utc_offset FROM users WHERE id IN ({', '.join('?' for _ in chunk)})", chunk))
+    return offsets